@@ -1,8 +1,15 @@
+import argparse
+import hashlib
 import json
 import os
 import re
 import shutil
+import stat
 import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 from openai import OpenAI
@@ -69,21 +76,64 @@ def extract_all_headings_from_md(md_file_path):
     return headings
 
 
-def call_deepseek_for_hierarchy(headings, api_key):
-    """
-    Call DeepSeek API to analyze heading hierarchy using Chain of Thought prompting
+# Windowed hierarchy analysis: heading lists longer than the window are split into
+# overlapping segments that are analyzed in parallel and joined in the middle of each overlap
+HIERARCHY_WINDOW_SIZE = int(os.environ.get('STEP3_WINDOW_SIZE', '120'))
+HIERARCHY_WINDOW_OVERLAP = int(os.environ.get('STEP3_WINDOW_OVERLAP', '20'))
+HIERARCHY_WINDOW_WORKERS = int(os.environ.get('STEP3_WINDOW_WORKERS', '4'))
+
+# Completion tokens and latency of the hierarchy LLM calls made by this process
+LLM_USAGE = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "seconds": 0.0}
+LLM_USAGE_LOCK = threading.Lock()
+
+
+def record_llm_usage(response, seconds):
+    """Add one response to LLM_USAGE and return its completion token count (None if unknown)"""
+    usage = getattr(response, 'usage', None)
+    prompt_tokens = getattr(usage, 'prompt_tokens', None) or 0
+    completion_tokens = getattr(usage, 'completion_tokens', None)
+    with LLM_USAGE_LOCK:
+        LLM_USAGE['calls'] += 1
+        LLM_USAGE['prompt_tokens'] += prompt_tokens
+        LLM_USAGE['completion_tokens'] += completion_tokens or 0
+        LLM_USAGE['seconds'] += seconds
+    return completion_tokens
+
+
+def call_deepseek_for_hierarchy(headings, api_key, context=None, debug_reasoning=False):
     """
-    # Prepare the heading list for the prompt
-    heading_list = [{"index": i, "content": h['content']} for i, h in enumerate(headings)]
+    Call DeepSeek API to analyze heading hierarchy
 
-    # Create the Chain of Thought prompt
-    prompt = f"""你是一个文档结构分析专家。我将给你一个从PDF文档中提取的标题列表，这些标题目前都被标记为一级标题。
+    The default prompt is compact: headings go out as numbered lines and come back as a
+    bare [[index, level], ...] array, so completion tokens are spent on levels only.
+    debug_reasoning uses the Chain of Thought prompt instead, which also returns the
+    analysis and a reasoning string for every heading.
+
+    Args:
+        context: titles of probable ancestors before the first heading (outermost first),
+            shown to the LLM for orientation only
+        debug_reasoning: ask for the analysis and per-heading reasoning (slower)
+    """
+    context_block = ""
+    if context:
+        context_lines = "\n".join(f"- {title}" for title in context)
+        context_block = f"""
+这些标题是文档中间的一段。它们之前可能的上级标题如下（从外到内，仅供参考，不要输出）：
+{context_lines}
+"""
+
+    if debug_reasoning:
+        # Prepare the heading list for the prompt
+        heading_list = [{"index": i, "content": h['content']} for i, h in enumerate(headings)]
+        # Create the Chain of Thought prompt
+        system_prompt = "你是一个专业的文档结构分析助手，擅长使用逻辑推理分析文档层级结构。"
+        prompt = f"""你是一个文档结构分析专家。我将给你一个从PDF文档中提取的标题列表，这些标题目前都被标记为一级标题。
 
 请使用思维链(Chain of Thought)的方式，分析这些标题的层级关系，并为每个标题分配合适的层级(level)。
 
 标题列表：
 {json.dumps(heading_list, ensure_ascii=False, indent=2)}
-
+{context_block}
 请按照以下步骤进行分析：
 
 步骤1: 理解文档结构
@@ -128,6 +178,15 @@ def call_deepseek_for_hierarchy(headings, api_key):
 5. 必须为所有标题分配层级
 
 现在请开始分析："""
+    else:
+        heading_lines = "\n".join(f"{i}\t{h['content']}" for i, h in enumerate(headings))
+        system_prompt = "你是文档结构分析助手，只输出JSON。"
+        prompt = f"""为下列从PDF提取的标题分配层级：1为最高层级，数字越大越深；不要跳级；并列标题同级；每个标题都必须给出层级。
+{context_block}
+标题（序号\t标题）：
+{heading_lines}
+
+只输出JSON，不要解释：{{"levels": [[序号, 层级], ...]}}"""
 
     try:
         # Initialize DeepSeek client (uses OpenAI-compatible API)
@@ -137,25 +196,37 @@ def call_deepseek_for_hierarchy(headings, api_key):
         )
 
         # Call the API
+        started = time.perf_counter()
         response = client.chat.completions.create(
             model="deepseek-chat",
             messages=[
-                {"role": "system", "content": "你是一个专业的文档结构分析助手，擅长使用逻辑推理分析文档层级结构。"},
+                {"role": "system", "content": system_prompt},
                 {"role": "user", "content": prompt}
             ],
             temperature=0.3,
             response_format={"type": "json_object"}
         )
+        elapsed = time.perf_counter() - started
+        completion_tokens = record_llm_usage(response, elapsed)
+        print(f"  LLM: {len(headings)} headings, {completion_tokens} completion tokens, {elapsed:.1f}s")
 
         # Parse the response
         result = json.loads(response.choices[0].message.content)
 
-        print("\n=== LLM 分析过程 ===")
-        print(result.get('analysis', 'No analysis provided'))
-        print("\n=== 层级划分结果 ===")
+        if debug_reasoning:
+            print("\n=== LLM 分析过程 ===")
+            print(result.get('analysis', 'No analysis provided'))
+            print("\n=== 层级划分结果 ===")
 
-        # Extract hierarchy information
-        hierarchy_result = result.get('hierarchy', [])
+            # Extract hierarchy information
+            hierarchy_result = result.get('hierarchy', [])
+        else:
+            hierarchy_result = []
+            for pair in result.get('levels', []):
+                index, level = int(pair[0]), int(pair[1])
+                if 0 <= index < len(headings):
+                    hierarchy_result.append({"index": index, "content": headings[index]['content'],
+                                             "level": level, "reasoning": ""})
 
         # Validate and return
         if len(hierarchy_result) != len(headings):
@@ -171,6 +242,408 @@ def call_deepseek_for_hierarchy(headings, api_key):
                 for i, h in enumerate(headings)]
 
 
+def plan_windows(count, size=None, overlap=None):
+    """
+    Split range(count) into overlapping (start, end) windows
+
+    Consecutive windows share `overlap` headings; a single window covers short lists.
+    """
+    size = size or HIERARCHY_WINDOW_SIZE
+    overlap = min(HIERARCHY_WINDOW_OVERLAP if overlap is None else overlap, size // 2)
+    if count <= size:
+        return [(0, count)]
+    windows = []
+    start = 0
+    while True:
+        end = min(start + size, count)
+        windows.append((start, end))
+        if end == count:
+            return windows
+        start = end - overlap
+
+
+def window_ancestor_context(headings, start):
+    """
+    Probable ancestors of headings[start] from numbering alone
+
+    Numbering schemes rank by first appearance in the document (as in
+    infer_levels_by_numbering). Walking back from start, a heading is kept when its
+    scheme ranks above every scheme kept so far, which yields a nested chain such as
+    第三章 > 第二节 > 一、. Unnumbered documents get no context.
+    """
+    rank = {}
+    for heading in headings[:start]:
+        scheme, _ = match_numbering(heading['content'])
+        if scheme is not None and scheme not in rank:
+            rank[scheme] = len(rank)
+    chain = []
+    outermost = len(rank)
+    for heading in reversed(headings[:start]):
+        scheme, _ = match_numbering(heading['content'])
+        if scheme is not None and rank[scheme] < outermost:
+            chain.append(heading['content'])
+            outermost = rank[scheme]
+            if outermost == 0:
+                break
+    return list(reversed(chain))
+
+
+def reconcile_windows(headings, windows, results):
+    """
+    Merge per-window LLM levels into one hierarchy
+
+    Windows are merged in order. Each window is shifted by the level difference that
+    occurs most often on the headings it shares with the merged part, so that relative
+    levels from different windows line up. The seam is the middle of the overlap: the
+    earlier window wins before it, the later one from it on.
+    """
+    merged = {}
+    for (start, end), result in zip(windows, results, strict=True):
+        window = {}
+        for item in result:
+            local = item.get('index')
+            if isinstance(local, int) and 0 <= local < end - start:
+                window[start + local] = item
+        shared = [i for i in range(start, end) if i in merged and i in window]
+        offset = 0
+        if shared:
+            diffs = Counter(merged[i]['level'] - window[i].get('level', 1) for i in shared)
+            offset = diffs.most_common(1)[0][0]
+        seam = start + (len(shared) + 1) // 2 if shared else start
+        for i in range(seam, end):
+            if i in window:
+                merged[i] = {"index": i, "content": headings[i]['content'],
+                             "level": max(1, window[i].get('level', 1) + offset),
+                             "reasoning": window[i].get('reasoning', '')}
+            elif i not in merged:
+                # Heading missing from the LLM answer: stay at the level of the one before
+                prev_level = merged[i - 1]['level'] if i - 1 in merged else 1
+                merged[i] = {"index": i, "content": headings[i]['content'], "level": prev_level,
+                             "reasoning": "LLM未返回该标题"}
+    return [merged[i] for i in range(len(headings))]
+
+
+def analyze_hierarchy_with_llm(headings, api_key, debug_reasoning=False):
+    """
+    LLM hierarchy for a heading list of any length
+
+    Lists up to HIERARCHY_WINDOW_SIZE headings go to the LLM in one request. Longer
+    lists are split into overlapping windows, each carrying its probable ancestors, so
+    that no single answer runs into the output limit. The windows run in parallel and
+    are reconciled at the seams.
+    """
+    windows = plan_windows(len(headings))
+    if len(windows) == 1:
+        return call_deepseek_for_hierarchy(headings, api_key, debug_reasoning=debug_reasoning)
+
+    print(f"  {len(headings)} headings: analyzing {len(windows)} overlapping windows "
+          f"of up to {HIERARCHY_WINDOW_SIZE}")
+    with ThreadPoolExecutor(max_workers=HIERARCHY_WINDOW_WORKERS) as pool:
+        futures = [pool.submit(call_deepseek_for_hierarchy, headings[start:end], api_key,
+                               window_ancestor_context(headings, start), debug_reasoning)
+                   for start, end in windows]
+        results = [future.result() for future in futures]
+    return reconcile_windows(headings, windows, results)
+
+
+CHINESE_DIGITS = {'零': 0, '〇': 0, '一': 1, '二': 2, '两': 2, '三': 3, '四': 4, '五': 5,
+                  '六': 6, '七': 7, '八': 8, '九': 9}
+CN_NUM = r'[零〇一二两三四五六七八九十百]+'
+
+# Numbering schemes of Chinese reports and regulations: (scheme name, pattern)
+# The level of each scheme is not fixed; it follows the order in which schemes appear
+NUMBERING_SCHEMES = [
+    ('chapter', re.compile(rf'^第({CN_NUM}|\d+)[章编]')),
+    ('section', re.compile(rf'^第({CN_NUM}|\d+)节')),
+    ('article', re.compile(rf'^第({CN_NUM}|\d+)条')),
+    ('cn_dun', re.compile(rf'^({CN_NUM})\s*[、.．]')),
+    ('cn_paren', re.compile(rf'^[（(]\s*({CN_NUM})\s*[）)]')),
+    ('decimal', re.compile(r'^(\d+(?:[.．]\d+)+)(?![.．]?\d)')),
+    ('arabic', re.compile(r'^(\d+)\s*[.．、](?!\d)')),
+    ('arabic_paren', re.compile(r'^[（(]\s*(\d+)\s*[）)]')),
+    ('circled', re.compile(r'^([①②③④⑤⑥⑦⑧⑨⑩⑪⑫⑬⑭⑮⑯⑰⑱⑲⑳])')),
+]
+CIRCLED = '①②③④⑤⑥⑦⑧⑨⑩⑪⑫⑬⑭⑮⑯⑰⑱⑲⑳'
+
+# Numbering-rule level inference: documents at or above this confidence skip the LLM
+RULE_CONFIDENCE_THRESHOLD = float(os.environ.get('STEP3_RULE_CONFIDENCE', '0.9'))
+# Above this share of unresolved headings the whole document goes to the LLM instead of ranges
+RULE_MAX_UNRESOLVED_SHARE = 0.3
+# Unnumbered headings before the first numbered one are taken as the (possibly wrapped) title
+RULE_MAX_TITLE_HEADINGS = 3
+
+
+def chinese_numeral_to_int(text):
+    """Convert a Chinese numeral such as 十二 or 二十三 to int (None if it cannot be parsed)"""
+    if text.isdigit():
+        return int(text)
+    total, current = 0, 0
+    for ch in text:
+        if ch in CHINESE_DIGITS:
+            current = CHINESE_DIGITS[ch]
+        elif ch == '十':
+            total += (current or 1) * 10
+            current = 0
+        elif ch == '百':
+            total += (current or 1) * 100
+            current = 0
+        else:
+            return None
+    return total + current
+
+
+def match_numbering(title):
+    """
+    Identify the numbering scheme of a heading
+
+    Returns:
+        (scheme, number) or (None, None); decimal numbering such as 1.2.3 becomes
+        scheme "decimal3" with the last component as number
+    """
+    for scheme, pattern in NUMBERING_SCHEMES:
+        m = pattern.match(title.strip())
+        if not m:
+            continue
+        token = m.group(1)
+        if scheme == 'decimal':
+            parts = re.split(r'[.．]', token)
+            return f"decimal{len(parts)}", int(parts[-1])
+        if scheme == 'circled':
+            return scheme, CIRCLED.index(token) + 1
+        return scheme, chinese_numeral_to_int(token)
+    return None, None
+
+
+def infer_levels_by_numbering(headings):
+    """
+    Infer heading levels from numbering schemes without calling the LLM
+
+    Up to RULE_MAX_TITLE_HEADINGS unnumbered headings before the first numbered one
+    are the document title (level 1). Each numbering scheme gets its level when it
+    first appears: one below the heading before it. Later headings with the same
+    scheme reuse that level. Other unnumbered headings stay unresolved.
+
+    Returns:
+        (levels, confidence): levels[i] is a dict like the LLM result or None when
+        unresolved; confidence is the resolved share reduced by numbering anomalies
+        (skipped levels, out-of-order numbers)
+    """
+    levels = [None] * len(headings)
+    numbering = [match_numbering(h['content']) for h in headings]
+    first_numbered = next((i for i, (scheme, _) in enumerate(numbering) if scheme), None)
+    if first_numbered is None:
+        return levels, 0.0
+    title_headings = first_numbered if first_numbered <= RULE_MAX_TITLE_HEADINGS else 1
+    scheme_level = {}
+    last_number = {}  # (parent heading index, scheme) -> last number seen
+    open_headings = {}  # level -> index of the latest heading at that level
+    prev_level = None
+    base_level = 1
+    anomalies = 0
+    numbered = 0
+
+    for i, heading in enumerate(headings):
+        scheme, number = numbering[i]
+        if scheme is None:
+            if i < title_headings:
+                # Title block before the first numbered heading
+                levels[i] = {"index": i, "content": heading['content'], "level": 1,
+                             "reasoning": "编号规则: 文档标题"}
+                open_headings = {1: i}
+                base_level = 2
+            continue
+
+        numbered += 1
+        level = scheme_level.get(scheme)
+        if level is None:
+            level = prev_level + 1 if prev_level is not None else base_level
+            scheme_level[scheme] = level
+        if prev_level is not None and level > prev_level + 1:
+            # Known scheme appearing below a skipped level: keep levels contiguous
+            anomalies += 1
+            level = prev_level + 1
+
+        parent = open_headings.get(level - 1)
+        expected = last_number.get((parent, scheme), 0) + 1
+        if number is not None and number != expected:
+            anomalies += 1
+        last_number[(parent, scheme)] = number if number is not None else expected
+
+        open_headings = {lv: idx for lv, idx in open_headings.items() if lv < level}
+        open_headings[level] = i
+        prev_level = level
+        levels[i] = {"index": i, "content": heading['content'], "level": level,
+                     "reasoning": f"编号规则: {scheme}"}
+
+    if not headings:
+        return levels, 1.0
+    resolved = sum(1 for lv in levels if lv is not None)
+    confidence = resolved / len(headings) * (1 - anomalies / max(numbered, 1))
+    return levels, round(confidence, 3)
+
+
+def find_content_list(md_file):
+    """MinerU's <name>_content_list.json next to the markdown file, or None"""
+    content_list = md_file.with_name(f"{md_file.stem}_content_list.json")
+    return content_list if content_list.exists() else None
+
+
+def extract_headings_from_content_list(md_file, content_list_file):
+    """
+    Build headings from MinerU content_list.json in one pass over the markdown
+
+    Blocks with a text_level are the headings MinerU found in the layout. They are
+    matched in order to the markdown heading lines, so each heading keeps its
+    line_number for slicing and gains page_idx and text_level. Markdown headings
+    without a matching block keep the page of the previous heading and no text_level.
+    """
+    with open(content_list_file, encoding='utf-8') as f:
+        blocks = [b for b in json.load(f) if b.get('text_level')]
+
+    def normalize(text):
+        return re.sub(r'\s+', '', text)
+
+    headings = extract_all_headings_from_md(md_file)
+    block_index = 0
+    page_idx = 0
+    for heading in headings:
+        # Blocks and markdown headings are both in reading order: search forward only
+        for k in range(block_index, len(blocks)):
+            if normalize(blocks[k].get('text', '')) == normalize(heading['content']):
+                block_index = k + 1
+                page_idx = blocks[k].get('page_idx', page_idx)
+                heading['text_level'] = blocks[k]['text_level']
+                break
+        heading['page_idx'] = page_idx
+    return headings
+
+
+def infer_levels_from_layout(headings):
+    """
+    Use MinerU text_level as heading levels, leaving inconsistent headings unresolved
+
+    Returns:
+        levels list like infer_levels_by_numbering, or None when the layout is flat
+        (all headings share one text_level) and carries no hierarchy. A heading is
+        left unresolved when it has no text_level, when its numbering scheme sits at
+        a different layout level than most headings of that scheme, or when it skips
+        a level.
+    """
+    layout_levels = sorted({h['text_level'] for h in headings if h.get('text_level')})
+    if len(layout_levels) < 2:
+        return None
+    rank = {text_level: i + 1 for i, text_level in enumerate(layout_levels)}
+
+    levels = []
+    scheme_levels = {}
+    for i, heading in enumerate(headings):
+        if not heading.get('text_level'):
+            levels.append(None)
+            continue
+        level = rank[heading['text_level']]
+        scheme, _ = match_numbering(heading['content'])
+        if scheme:
+            scheme_levels.setdefault(scheme, Counter())[level] += 1
+        levels.append({"index": i, "content": heading['content'], "level": level,
+                       "reasoning": f"版面层级: text_level {heading['text_level']}"})
+
+    prev_level = 0
+    for i, heading in enumerate(headings):
+        if levels[i] is None:
+            continue
+        scheme, _ = match_numbering(heading['content'])
+        level = levels[i]['level']
+        if (scheme and level != scheme_levels[scheme].most_common(1)[0][0]) or level > prev_level + 1:
+            levels[i] = None
+            continue
+        prev_level = level
+    return levels
+
+
+def unresolved_ranges(levels):
+    """Group consecutive unresolved heading indices: [(start, end_exclusive), ...]"""
+    ranges = []
+    start = None
+    for i, level in enumerate(levels + [{}]):
+        if level is None and start is None:
+            start = i
+        elif level is not None and start is not None:
+            ranges.append((start, i))
+            start = None
+    return ranges
+
+
+def resolve_range_with_llm(headings, levels, start, end, api_key, debug_reasoning=False):
+    """
+    Ask the LLM for the levels of headings[start:end] only
+
+    The nearest resolved heading before the range is sent first as an anchor, and the
+    LLM levels are shifted so the anchor keeps its rule-derived level. A range at the
+    start of the document has no anchor and takes the LLM levels as they are.
+    """
+    if start == 0:
+        result = analyze_hierarchy_with_llm(headings[start:end], api_key, debug_reasoning)
+        llm_levels = {item['index'] + 1: item.get('level', 1) for item in result}
+        offset, prev_level = 0, 0
+    else:
+        anchor = start - 1
+        subset = [headings[anchor]] + headings[start:end]
+        result = analyze_hierarchy_with_llm(subset, api_key, debug_reasoning)
+        llm_levels = {item['index']: item.get('level', 1) for item in result}
+        offset = levels[anchor]['level'] - llm_levels.get(0, 1)
+        prev_level = levels[anchor]['level']
+    for k, i in enumerate(range(start, end), start=1):
+        # Never go deeper than one level below the previous heading
+        level = min(max(1, llm_levels.get(k, 1) + offset), prev_level + 1)
+        levels[i] = {"index": i, "content": headings[i]['content'], "level": level,
+                     "reasoning": "LLM: 编号规则无法判断的标题"}
+        prev_level = level
+
+
+def resolve_heading_levels(headings, api_key, use_rules=True, debug_reasoning=False):
+    """
+    Determine heading levels: MinerU layout levels, then numbering rules, and the LLM
+    only where they fall short
+
+    Returns:
+        (llm_hierarchy, resolution) where resolution is "layout" or "rules" (no LLM
+        call), "layout+llm" or "rules+llm" (LLM for unresolved ranges only) or "llm"
+        (whole document)
+    """
+    if use_rules:
+        # Layout levels from content_list.json, when they carry a hierarchy
+        levels = infer_levels_from_layout(headings)
+        if levels is not None:
+            ranges = unresolved_ranges(levels)
+            unresolved = sum(end - start for start, end in ranges)
+            if not ranges:
+                print("  ✓ Levels taken from MinerU layout (text_level)")
+                return levels, "layout"
+            if unresolved / len(headings) <= RULE_MAX_UNRESOLVED_SHARE:
+                print(f"  ✓ Layout levels consistent for {len(headings) - unresolved}/{len(headings)} "
+                      f"headings, calling LLM for {len(ranges)} range(s)")
+                for start, end in ranges:
+                    resolve_range_with_llm(headings, levels, start, end, api_key, debug_reasoning)
+                return levels, "layout+llm"
+
+        levels, confidence = infer_levels_by_numbering(headings)
+        ranges = unresolved_ranges(levels)
+        unresolved = sum(end - start for start, end in ranges)
+        if not ranges and confidence >= RULE_CONFIDENCE_THRESHOLD:
+            print(f"  ✓ Levels resolved by numbering rules (confidence {confidence})")
+            return levels, "rules"
+        if (ranges and unresolved / len(headings) <= RULE_MAX_UNRESOLVED_SHARE
+                and confidence >= RULE_CONFIDENCE_THRESHOLD * (1 - RULE_MAX_UNRESOLVED_SHARE)):
+            print(f"  ✓ Numbering rules resolved {len(headings) - unresolved}/{len(headings)} headings, "
+                  f"calling LLM for {len(ranges)} range(s)")
+            for start, end in ranges:
+                resolve_range_with_llm(headings, levels, start, end, api_key, debug_reasoning)
+            return levels, "rules+llm"
+        print(f"  Numbering rules inconclusive (confidence {confidence}), using LLM for the whole document")
+
+    return analyze_hierarchy_with_llm(headings, api_key, debug_reasoning), "llm"
+
+
 def extract_content_between_headings(lines, start_line, end_line):
     """Extract content between two headings"""
     content_lines = []
@@ -180,79 +653,206 @@ def extract_content_between_headings(lines, start_line, end_line):
     return '\n'.join(content_lines).strip()
 
 
+def slice_sections(lines, headings):
+    """
+    Content of every heading section in one pass over the lines
+
+    Each line is right-stripped once and the document is joined into a single string.
+    A section is then a slice between the offsets of the lines after its heading and
+    before the next heading. The result equals calling extract_content_between_headings
+    for each heading.
+    """
+    offsets = [0]
+    for line in lines:
+        offsets.append(offsets[-1] + len(line.rstrip()) + 1)
+    text = '\n'.join(line.rstrip() for line in lines)
+
+    sections = []
+    for i, heading in enumerate(headings):
+        end_line = headings[i + 1]['line_number'] if i + 1 < len(headings) else len(lines)
+        start = offsets[min(heading['line_number'] + 1, len(lines))]
+        end = offsets[min(max(end_line, heading['line_number'] + 1), len(lines))]
+        sections.append(text[start:end].strip())
+    return sections
+
+
 def build_heading_hierarchy_with_llm(headings, llm_hierarchy, lines):
     """Build a hierarchical structure of headings with their content using LLM results"""
     hierarchy = []
 
     # Create a mapping from index to LLM hierarchy info
     llm_map = {item['index']: item for item in llm_hierarchy}
+    contents = slice_sections(lines, headings)
 
-    for i, heading in enumerate(headings):
-        # Find the next heading to determine content boundaries
-        next_heading_line = len(lines)
-        if i + 1 < len(headings):
-            next_heading_line = headings[i + 1]['line_number']
-
-        # Extract content for this heading
-        content = extract_content_between_headings(lines, heading['line_number'], next_heading_line)
+    # Open ancestors as (level, title); levels strictly increase from bottom to top
+    stack = []
 
+    for i, heading in enumerate(headings):
         # Get level from LLM result
         llm_info = llm_map.get(i, {"level": 1, "reasoning": "未找到LLM结果"})
         level = llm_info['level']
 
-        # Find parent heading path by looking backwards for higher level headings
-        parent_path = []
-        current_level = level
-
-        for j in range(i - 1, -1, -1):
-            prev_llm_info = llm_map.get(j, {"level": 1})
-            if prev_llm_info['level'] < current_level:
-                parent_path.insert(0, headings[j]['content'])
-                current_level = prev_llm_info['level']
-                if current_level == 1:
-                    break
+        # Parents are the open headings with a lower level
+        while stack and stack[-1][0] >= level:
+            stack.pop()
+        parent_path = [title for _, title in stack]
+        stack.append((level, heading['content']))
 
         hierarchy.append({
             'level': level,
             'title': heading['content'],
-            'content': content,
+            'content': contents[i],
             'parent_path': parent_path,
             'reasoning': llm_info.get('reasoning', ''),
-            'index': i
+            'index': i,
+            'page_idx': heading.get('page_idx')
         })
 
     return hierarchy
 
 
-def copy_images_recursively(source_images_dir, dest_doc_folder):
-    """Copy all images from source to destination, maintaining structure"""
+# How PDFs and images reach the Dataset: hardlink and reflink share the source data
+# (reflink copy-on-write), symlink points at the source, copy duplicates it. Any strategy
+# falls back to copy where the filesystem refuses it. Markdown is always a real file,
+# because it is rewritten in place (here and by Step4).
+MATERIALIZE_STRATEGIES = ('hardlink', 'reflink', 'symlink', 'copy')
+DEFAULT_MATERIALIZE = os.environ.get('STEP3_MATERIALIZE', 'copy')
+FICLONE = 0x40049409  # Linux ioctl behind `cp --reflink`
+
+
+def handle_remove_readonly(func, path, exc):
+    """rmtree error handler that clears the read-only flag (Windows) and retries"""
+    if os.path.exists(path):
+        os.chmod(path, stat.S_IWRITE)
+        func(path)
+
+
+def reflink_file(source, dest):
+    """Clone source into dest sharing its blocks; raises OSError where unsupported"""
+    import fcntl  # not available on Windows; the ImportError is handled by the caller
+
+    with open(source, 'rb') as src, open(dest, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    shutil.copystat(source, dest)
+
+
+def is_materialized(source, dest, strategy):
+    """
+    Whether dest already holds source under the given strategy
+
+    Links must point at the source itself; copies are compared by size and mtime
+    (copy2 and reflink keep the source mtime) and must not be links.
+    """
+    if not os.path.lexists(dest):
+        return False
+    if strategy == 'symlink':
+        return dest.is_symlink() and Path(os.readlink(dest)) == source.resolve()
+    if dest.is_symlink():
+        return False
+    if strategy == 'hardlink':
+        return os.path.samefile(source, dest)
+    src_stat, dest_stat = source.stat(), dest.stat()
+    return (src_stat.st_size == dest_stat.st_size and src_stat.st_mtime_ns == dest_stat.st_mtime_ns
+            and not os.path.samefile(source, dest))
+
+
+def materialize_file(source, dest, strategy='copy'):
+    """
+    Place source at dest with the given strategy unless it is already there
+
+    The new file is created under a temporary name and renamed over dest, so an
+    existing link is replaced rather than written through.
+
+    Returns:
+        "unchanged", the strategy used, or "copy" when the strategy was not possible
+    """
+    source, dest = Path(source), Path(dest)
+    if is_materialized(source, dest, strategy):
+        return "unchanged"
+
+    tmp = dest.with_name(f".{dest.name}.tmp")
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    used = strategy
+    try:
+        if strategy == 'hardlink':
+            os.link(source, tmp)
+        elif strategy == 'symlink':
+            os.symlink(source.resolve(), tmp)
+        elif strategy == 'reflink':
+            reflink_file(source, tmp)
+        else:
+            shutil.copy2(source, tmp)
+    except (OSError, ImportError, NotImplementedError):
+        # Cross-device link, no reflink support, no symlink privilege, ...
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        shutil.copy2(source, tmp)
+        used = 'copy'
+    if dest.is_dir() and not dest.is_symlink():
+        shutil.rmtree(dest, onerror=handle_remove_readonly)
+    os.replace(tmp, dest)
+    return used
+
+
+def sync_tree(source_dir, dest_dir, strategy='copy'):
+    """
+    Incrementally mirror source_dir into dest_dir
+
+    Files already in place (see is_materialized) are left alone, new or changed ones are
+    materialized, and files or folders no longer in the source are removed.
+
+    Returns:
+        Counter of materialize_file results plus "removed"
+    """
+    counts = Counter()
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    for root, dirs, files in os.walk(source_dir):
+        rel = Path(root).relative_to(source_dir)
+        target = dest_dir / rel
+        target.mkdir(exist_ok=True)
+        for name in files:
+            counts[materialize_file(Path(root) / name, target / name, strategy)] += 1
+        # Prune what the source no longer has at this level
+        keep = set(files) | set(dirs)
+        for entry in os.scandir(target):
+            if entry.name in keep:
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path, onerror=handle_remove_readonly)
+            else:
+                try:
+                    os.remove(entry.path)
+                except PermissionError:
+                    handle_remove_readonly(os.remove, entry.path, None)
+            counts['removed'] += 1
+    return counts
+
+
+def copy_images_recursively(source_images_dir, dest_doc_folder, materialize='copy'):
+    """
+    Sync all images from source to destination, maintaining structure
+
+    Only new or changed images are materialized (see sync_tree); images that are
+    gone from the source are removed.
+    """
     if not source_images_dir.exists():
         print("    - No images folder found")
         return
 
     dest_images_dir = dest_doc_folder / "images"
+    counts = sync_tree(source_images_dir, dest_images_dir, materialize)
+    placed = sum(counts.values()) - counts['unchanged'] - counts['removed']
 
-    # Remove existing images directory if it exists
-    if dest_images_dir.exists():
-        import stat
-        def handle_remove_readonly(func, path, exc):
-            if os.path.exists(path):
-                os.chmod(path, stat.S_IWRITE)
-                func(path)
-
-        shutil.rmtree(dest_images_dir, onerror=handle_remove_readonly)
-
-    # Copy the entire images directory
-    shutil.copytree(source_images_dir, dest_images_dir)
-
-    # Count copied images
+    # Count images
     image_count = 0
     for root, dirs, files in os.walk(dest_images_dir):
         for file in files:
             if file.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.svg', '.webp')):
                 image_count += 1
 
-    print(f"    - Copied {image_count} images to images folder")
+    print(f"    - Synced {image_count} images to images folder "
+          f"({placed} placed, {counts['unchanged']} unchanged, {counts['removed']} removed)")
 
 
 def rewrite_markdown_headings(md_file_path, hierarchy, output_path=None):
@@ -303,7 +903,9 @@ def rewrite_markdown_headings(md_file_path, hierarchy, output_path=None):
             # 非标题行，保持原样
             new_lines.append(line)
 
-    # 写入文件
+    # 写入文件；输出到其他路径时先删除旧文件，避免写穿指向源文件的链接
+    if Path(output_path) != Path(md_file_path) and os.path.lexists(output_path):
+        os.remove(output_path)
     with open(output_path, 'w', encoding='utf-8', errors='ignore') as f:
         f.writelines(new_lines)
 
@@ -311,8 +913,26 @@ def rewrite_markdown_headings(md_file_path, hierarchy, output_path=None):
     return output_path
 
 
-def create_folder_structure_for_document(doc_folder, hierarchy, md_file, auto_dir):
-    """Create folder structure for a single document based on heading hierarchy"""
+# Output layouts: "tree" writes one folder and .md file per heading; "index" writes a
+# single sections.jsonl with line ranges into the document markdown, from which
+# render_section_tree builds the tree (or part of it) on demand
+LAYOUTS = ('tree', 'index')
+DEFAULT_LAYOUT = os.environ.get('STEP3_LAYOUT', 'tree')
+SECTION_INDEX_NAME = 'sections.jsonl'
+
+
+def write_heading_tree(doc_folder, hierarchy, selected=None):
+    """
+    Write README.md for the document title and one folder with a .md file per heading
+
+    Args:
+        selected: heading indices to write (None writes all); the others only need
+            level, title and parent_path, not content
+
+    Returns:
+        number of files written
+    """
+    written = 0
 
     # Skip document title (usually the first level 1 heading) from folder creation
     filtered_hierarchy = []
@@ -322,13 +942,17 @@ def create_folder_structure_for_document(doc_folder, hierarchy, md_file, auto_di
         # Skip the first level 1 heading as it's typically the document title
         if heading_info['level'] == 1 and not first_level1_found:
             first_level1_found = True
+            if selected is not None and heading_info['index'] not in selected:
+                continue
             # Save the document title as README.md in root folder
             readme_file = doc_folder / "README.md"
             with open(readme_file, 'w', encoding='utf-8', errors='ignore') as f:
                 f.write(f"# {heading_info['title']}\n\n{heading_info['content']}")
+            written += 1
             print("    - Created: README.md (document title)")
             continue
-        filtered_hierarchy.append(heading_info)
+        if selected is None or heading_info['index'] in selected:
+            filtered_hierarchy.append(heading_info)
 
     # Create folders and save content for each heading
     for heading_info in filtered_hierarchy:
@@ -357,6 +981,7 @@ def create_folder_structure_for_document(doc_folder, hierarchy, md_file, auto_di
             with open(content_file, 'w', encoding='utf-8', errors='ignore') as f:
                 # Include the heading title and content
                 f.write(f"# {heading_info['title']}\n\n{heading_info['content']}")
+            written += 1
 
             try:
                 rel_path = content_file.relative_to(doc_folder)
@@ -364,12 +989,106 @@ def create_folder_structure_for_document(doc_folder, hierarchy, md_file, auto_di
             except:
                 print(f"    - Created: {content_file}")
 
+    return written
+
+
+def write_section_index(doc_folder, hierarchy, headings, line_count, markdown_name):
+    """
+    Write sections.jsonl: one line per heading with its place in the hierarchy
+
+    Sections are located by line ranges of the markdown: `line` is the heading line and
+    `end_line` the first line after the section (both 0-based). Rewriting heading levels
+    (here and in Step4) keeps line numbers, while character offsets would shift.
+    """
+    index_file = doc_folder / SECTION_INDEX_NAME
+    with open(index_file, 'w', encoding='utf-8') as f:
+        for i, h in enumerate(hierarchy):
+            end_line = headings[i + 1]['line_number'] if i + 1 < len(headings) else line_count
+            f.write(json.dumps({
+                "index": h['index'],
+                "level": h['level'],
+                "title": h['title'],
+                "parent_path": h['parent_path'],
+                "page_idx": h['page_idx'],
+                "line": headings[i]['line_number'],
+                "end_line": end_line,
+                "markdown": markdown_name
+            }, ensure_ascii=False) + "\n")
+    print(f"    - Created: {SECTION_INDEX_NAME} ({len(hierarchy)} sections)")
+
+
+def load_section_index(doc_folder):
+    """Rows of a document's sections.jsonl ([] when there is none)"""
+    index_file = Path(doc_folder) / SECTION_INDEX_NAME
+    if not index_file.exists():
+        return []
+    with open(index_file, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def render_section_tree(doc_folder, indices=None):
+    """
+    Build the heading folder tree of an index-layout document on demand
+
+    Only the selected sections are read from the markdown and written, with the same
+    paths and contents the tree layout produces.
+
+    Args:
+        doc_folder: Dataset folder of the document
+        indices: heading indices to render (None renders the whole tree)
+
+    Returns:
+        number of files written
+    """
+    doc_folder = Path(doc_folder)
+    rows = load_section_index(doc_folder)
+    if not rows:
+        print(f"  No {SECTION_INDEX_NAME} in {doc_folder}")
+        return 0
+
+    with open(doc_folder / rows[0]['markdown'], encoding='utf-8', errors='ignore') as f:
+        lines = f.readlines()
+
+    selected = None if indices is None else set(indices)
+    hierarchy = [{
+        'level': row['level'],
+        'title': row['title'],
+        'parent_path': row['parent_path'],
+        'index': row['index'],
+        'content': (extract_content_between_headings(lines, row['line'], row['end_line'])
+                    if selected is None or row['index'] in selected else None)
+    } for row in rows]
+    return write_heading_tree(doc_folder, hierarchy, selected)
+
+
+def create_folder_structure_for_document(doc_folder, hierarchy, md_file, auto_dir, materialize='copy',
+                                         layout='tree'):
+    """
+    Create folder structure for a single document based on heading hierarchy
+
+    PDFs and images are placed with the materialize strategy (MATERIALIZE_STRATEGIES)
+    and skipped when already up to date; the markdown is always copied. The heading
+    folders are written for the tree layout only (the index layout writes
+    sections.jsonl in write_document_output).
+    """
+    if layout == 'tree':
+        write_heading_tree(doc_folder, hierarchy)
+
     # Copy required files to the document root folder
-    # 1. Copy original markdown file
+    # 1. Markdown: rewritten from the source when there is a hierarchy, otherwise copied;
+    # never linked, since Step4 rewrites it in place
     if md_file.exists():
         dest_md = doc_folder / md_file.name
-        shutil.copy2(md_file, dest_md)
-        print(f"    - Copied markdown: {dest_md.name}")
+        rewritten = False
+        if hierarchy:
+            print("    - Rewriting markdown headings based on LLM analysis...")
+            try:
+                rewrite_markdown_headings(md_file, hierarchy, dest_md)
+                rewritten = True
+            except Exception as e:
+                print(f"      Warning: Failed to rewrite headings: {e}")
+        if not rewritten and materialize_file(md_file, dest_md, 'copy') != "unchanged":
+            print(f"    - Copied markdown: {dest_md.name}")
 
     # 2. Copy PDF files (look for .origin.pdf in auto directory and parent directory)
     pdf_files = list(auto_dir.glob("*.origin.pdf"))
@@ -377,40 +1096,132 @@ def create_folder_structure_for_document(doc_folder, hierarchy, md_file, auto_di
     parent_dir = auto_dir.parent
     pdf_files.extend(list(parent_dir.glob("*.pdf")))
 
+    seen = set()
     for pdf_file in pdf_files:
+        if pdf_file.name in seen:  # Avoid duplicates
+            continue
+        seen.add(pdf_file.name)
         dest_pdf = doc_folder / pdf_file.name
-        if not dest_pdf.exists():  # Avoid duplicates
-            shutil.copy2(pdf_file, dest_pdf)
-            print(f"    - Copied PDF: {dest_pdf.name}")
+        used = materialize_file(pdf_file, dest_pdf, materialize)
+        if used != "unchanged":
+            print(f"    - Placed PDF ({used}): {dest_pdf.name}")
 
-    # 3. Copy images folder with all images
+    # 3. Sync images folder with all images
     images_dir = auto_dir / "images"
-    copy_images_recursively(images_dir, doc_folder)
+    copy_images_recursively(images_dir, doc_folder, materialize)
+
 
-    # 4. Rewrite markdown file headings based on LLM hierarchy
-    if hierarchy and md_file.exists():
-        dest_md = doc_folder / md_file.name
-        if dest_md.exists():
-            print("    - Rewriting markdown headings based on LLM analysis...")
-            try:
-                rewrite_markdown_headings(dest_md, hierarchy)
-            except Exception as e:
-                print(f"      Warning: Failed to rewrite headings: {e}")
 
+# Incremental runs: the output directory keeps a manifest of what each document folder was
+# built from; documents whose fingerprint and options are unchanged are skipped
+MANIFEST_NAME = '.step3_manifest.json'
+MANIFEST_SAVE_EVERY = 50  # completed documents between manifest saves
+
+
+def load_manifest(output_path):
+    """Manifest entries by source document name ({} when missing or unreadable)"""
+    manifest_file = output_path / MANIFEST_NAME
+    if not manifest_file.exists():
+        return {}
+    try:
+        with open(manifest_file, encoding='utf-8') as f:
+            return json.load(f).get('documents', {})
+    except (OSError, ValueError, AttributeError) as e:
+        print(f"⚠ Ignoring unreadable manifest {manifest_file}: {e}")
+        return {}
 
 
-def organize_document_by_headings(source_dir, output_base_dir, api_key):
+def save_manifest(output_path, documents):
+    """Write the manifest atomically (temporary file, then rename)"""
+    manifest_file = output_path / MANIFEST_NAME
+    tmp = manifest_file.with_name(manifest_file.name + '.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({"version": 1, "documents": documents}, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, manifest_file)
+
+
+def file_sha256(path):
+    """SHA-256 hex digest of a file, read in 1 MB blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def asset_fingerprint(md_file, auto_dir):
     """
-    Organize documents by headings in hierarchical folder structure using LLM for hierarchy detection
-    Each source document gets its own folder in the output directory
+    Fingerprint of everything besides the markdown that shapes a document folder
+
+    Covers images/, the PDFs and content_list.json by relative path, size and mtime,
+    so no image has to be read.
     """
-    source_path = Path(source_dir)
-    output_path = Path(output_base_dir)
+    files = [p for p in (auto_dir / "images").rglob("*") if p.is_file()]
+    files += list(auto_dir.glob("*.origin.pdf")) + list(auto_dir.parent.glob("*.pdf"))
+    content_list = find_content_list(md_file)
+    if content_list is not None:
+        files.append(content_list)
+    digest = hashlib.sha256()
+    for path in sorted(files):
+        st = path.stat()
+        digest.update(f"{path.relative_to(auto_dir.parent).as_posix()}\t{st.st_size}\t{st.st_mtime_ns}\n"
+                      .encode())
+    return digest.hexdigest()
+
+
+def document_fingerprint(md_file, auto_dir, previous=None):
+    """
+    Source fingerprint of a document for the manifest
 
-    # Create output directory if it doesn't exist
-    output_path.mkdir(exist_ok=True)
+    The markdown hash of the previous entry is reused when size and mtime are
+    unchanged, so an unchanged corpus is checked without reading the markdown.
+    """
+    st = md_file.stat()
+    if (previous and previous.get('markdown_size') == st.st_size
+            and previous.get('markdown_mtime_ns') == st.st_mtime_ns):
+        markdown_sha256 = previous['markdown_sha256']
+    else:
+        markdown_sha256 = file_sha256(md_file)
+    return {
+        "markdown": md_file.name,
+        "markdown_sha256": markdown_sha256,
+        "markdown_size": st.st_size,
+        "markdown_mtime_ns": st.st_mtime_ns,
+        "assets": asset_fingerprint(md_file, auto_dir),
+    }
+
+
+def prune_vanished_documents(output_path, manifest, source_names):
+    """
+    Remove Dataset folders of manifest documents that are no longer in the source
+
+    Only folders recorded in the manifest are touched, and never a folder that a
+    current source document (whose name sanitizes to the same folder) still uses.
+    Returns the pruned names.
+    """
+    live_folders = {sanitize_filename(name) for name in source_names}
+    pruned = []
+    for doc_name in sorted(set(manifest) - set(source_names)):
+        folder = output_path / manifest[doc_name].get('folder', sanitize_filename(doc_name))
+        if folder.name in live_folders:
+            print(f"  - Kept {folder.name}: still used by a current source document")
+        else:
+            if folder.exists():
+                shutil.rmtree(folder, onerror=handle_remove_readonly)
+            print(f"  - Pruned {folder.name}: source document is gone")
+        del manifest[doc_name]
+        pruned.append(doc_name)
+    return pruned
+
+
+def find_source_documents(source_path):
+    """
+    Find MinerU output folders that contain an auto/*.md file
 
-    # Iterate through all subdirectories in the source directory
+    Returns:
+        list of (subdir, auto_dir, md_file)
+    """
+    documents = []
     for subdir in source_path.iterdir():
         if not subdir.is_dir():
             continue
@@ -427,74 +1238,257 @@ def organize_document_by_headings(source_dir, output_base_dir, api_key):
             print(f"Skipping {subdir.name}, no markdown file found")
             continue
 
-        md_file = md_files[0]  # Take the first markdown file found
-        doc_name = subdir.name  # Use the original directory name
-        doc_name_clean = sanitize_filename(doc_name)  # Clean the name for file system
+        documents.append((subdir, auto_dir, md_files[0]))  # Take the first markdown file found
+    return documents
 
-        print(f"\n{'='*60}")
-        print(f"Processing document: {doc_name}")
-        if doc_name != doc_name_clean:
-            print(f"  (Sanitized to: {doc_name_clean})")
-        print(f"{'='*60}")
 
-        # Create document folder in output directory (using sanitized name)
-        doc_folder = output_path / doc_name_clean
-        doc_folder.mkdir(parents=True, exist_ok=True)
+def analyze_document_headings(md_file, api_key, use_rules=True, use_content_list=True,
+                              debug_reasoning=False):
+    """
+    Extract headings and determine their levels (the network-bound part of a document)
 
-        # Extract headings from markdown file (all as level 1 initially)
+    Returns:
+        (headings, llm_hierarchy, resolution); llm_hierarchy is None when the document
+        has no headings, resolution is as in resolve_heading_levels or None
+    """
+    # Headings with page numbers and layout levels from MinerU content_list.json when
+    # available, otherwise from the markdown alone (all as level 1 initially)
+    content_list = find_content_list(md_file) if use_content_list else None
+    if content_list is not None:
+        headings = extract_headings_from_content_list(md_file, content_list)
+    else:
         headings = extract_all_headings_from_md(md_file)
+    if not headings:
+        return headings, None, None
+
+    print(f"  Found {len(headings)} headings in {md_file.name}, analyzing hierarchy...")
+
+    # Numbering rules first, LLM only for what they cannot resolve
+    llm_hierarchy, resolution = resolve_heading_levels(headings, api_key, use_rules, debug_reasoning)
+    return headings, llm_hierarchy, resolution
+
 
-        if not headings:
-            print(f"  No headings found in {doc_name}, copying files only")
-            # Still copy the required files even if no headings
-            create_folder_structure_for_document(doc_folder, [], md_file, auto_dir)
+def write_document_output(doc_name, doc_folder, md_file, auto_dir, headings, llm_hierarchy,
+                          materialize='copy', layout='tree'):
+    """
+    Build the hierarchy and write the document folder (the disk-bound part of a document)
+    """
+    # Create document folder in output directory
+    doc_folder.mkdir(parents=True, exist_ok=True)
+
+    if not headings:
+        print(f"  No headings found in {doc_name}, copying files only")
+        # Still copy the required files even if no headings
+        create_folder_structure_for_document(doc_folder, [], md_file, auto_dir, materialize, layout)
+        return
+
+    # Read the full markdown content
+    with open(md_file, encoding='utf-8', errors='ignore') as f:
+        lines = f.readlines()
+
+    # Build heading hierarchy with content using LLM results
+    hierarchy = build_heading_hierarchy_with_llm(headings, llm_hierarchy, lines)
+
+    # Save hierarchy analysis to JSON file for reference
+    hierarchy_json_file = doc_folder / "hierarchy_analysis.json"
+    print(f"  Saving hierarchy analysis to: {hierarchy_json_file}")
+
+    try:
+        with open(hierarchy_json_file, 'w', encoding='utf-8') as f:
+            json.dump({
+                "document": doc_name,
+                "total_headings": len(headings),
+                "hierarchy": [
+                    {
+                        "index": h['index'],
+                        "level": h['level'],
+                        "title": h['title'],
+                        "reasoning": h['reasoning'],
+                        "parent_path": h['parent_path'],
+                        "page_idx": h['page_idx']
+                    }
+                    for h in hierarchy
+                ]
+            }, f, ensure_ascii=False, indent=2)
+        print("  ✓ Saved hierarchy analysis to hierarchy_analysis.json")
+    except Exception as e:
+        print(f"  ⚠ Warning: Could not save hierarchy analysis: {e}")
+        print(f"     Folder: {doc_folder}")
+        print(f"     Exists: {doc_folder.exists()}")
+
+    if layout == 'index':
+        write_section_index(doc_folder, hierarchy, headings, len(lines), md_file.name)
+
+    # Create folder structure and save content
+    create_folder_structure_for_document(doc_folder, hierarchy, md_file, auto_dir, materialize, layout)
+
+
+def organize_document_by_headings(source_dir, output_base_dir, api_key, concurrency=1, io_workers=4,
+                                  use_rules=True, use_content_list=True, debug_reasoning=False,
+                                  materialize=DEFAULT_MATERIALIZE, incremental=True, layout=DEFAULT_LAYOUT):
+    """
+    Organize documents by headings in hierarchical folder structure using LLM for hierarchy detection
+    Each source document gets its own folder in the output directory
+
+    Args:
+        source_dir: MinerU output directory (one subdirectory per document)
+        output_base_dir: Dataset directory
+        api_key: DeepSeek API key
+        concurrency: number of documents whose LLM calls run at the same time;
+            1 keeps the original one-by-one processing
+        io_workers: threads for folder creation and copying when concurrency > 1
+        use_rules: infer levels from layout and numbering patterns and call the LLM only
+            for documents or heading ranges they cannot resolve
+        use_content_list: read headings, page numbers and layout levels from MinerU
+            *_content_list.json when it exists
+        debug_reasoning: use the Chain of Thought prompt that returns an analysis and
+            per-heading reasoning instead of the compact [[index, level], ...] prompt
+        materialize: how PDFs and images are placed, one of MATERIALIZE_STRATEGIES
+        incremental: skip documents whose source fingerprint and options match the
+            manifest (MANIFEST_NAME) and prune folders whose source is gone; False
+            reprocesses everything (the manifest is still updated)
+        layout: "tree" (one folder per heading) or "index" (sections.jsonl, rendered
+            into folders on demand with render_section_tree)
+
+    Returns:
+        list of {"document", "status", "error", "resolution"} per document, status being
+        "completed", "failed", "skipped" or "pruned"; a failing document does not stop
+        the others
+    """
+    source_path = Path(source_dir)
+    output_path = Path(output_base_dir)
+
+    # Create output directory if it doesn't exist
+    output_path.mkdir(exist_ok=True)
+
+    documents = find_source_documents(source_path)
+    results = []
+    usage_before = dict(LLM_USAGE)
+
+    # Compare sources with the manifest of the previous run
+    manifest = load_manifest(output_path)
+    options = {"use_rules": use_rules, "use_content_list": use_content_list,
+               "debug_reasoning": debug_reasoning, "materialize": materialize, "layout": layout}
+    fingerprints = {}
+    pending = []
+    for subdir, auto_dir, md_file in documents:
+        previous = manifest.get(subdir.name)
+        fingerprint = document_fingerprint(md_file, auto_dir, previous)
+        fingerprints[subdir.name] = fingerprint
+        source = (previous or {}).get('source', {})
+        if (incremental and previous and previous.get('options') == options
+                and source.get('markdown_sha256') == fingerprint['markdown_sha256']
+                and source.get('assets') == fingerprint['assets']
+                and (output_path / previous['folder']).is_dir()):
+            # Same content; keep the new size/mtime so the markdown is not hashed again
+            previous['source'] = fingerprint
+            results.append({"document": subdir.name, "status": "skipped", "error": None,
+                            "resolution": None})
             continue
+        pending.append((subdir, auto_dir, md_file))
+    if incremental and documents:
+        # Never prune on an empty source listing (wrong or unmounted source directory)
+        for doc_name in prune_vanished_documents(output_path, manifest, [d[0].name for d in documents]):
+            results.append({"document": doc_name, "status": "pruned", "error": None, "resolution": None})
+    if incremental:
+        print(f"Manifest: {len(pending)} new or changed, {len(documents) - len(pending)} unchanged documents")
+    save_manifest(output_path, manifest)
+
+    def record(doc_name, status, error, resolution):
+        """Add a result and keep the manifest in step with it"""
+        results.append({"document": doc_name, "status": status, "error": error,
+                        "resolution": resolution})
+        if status != "completed":
+            # A failed document is retried on the next run
+            manifest.pop(doc_name, None)
+            return
+        manifest[doc_name] = {"folder": sanitize_filename(doc_name), "source": fingerprints[doc_name],
+                              "options": options, "resolution": resolution}
+        if sum(1 for r in results if r['status'] == 'completed') % MANIFEST_SAVE_EVERY == 0:
+            save_manifest(output_path, manifest)
+
+    if concurrency <= 1:
+        for subdir, auto_dir, md_file in pending:
+            doc_name = subdir.name  # Use the original directory name
+            doc_name_clean = sanitize_filename(doc_name)  # Clean the name for file system
+
+            print(f"\n{'='*60}")
+            print(f"Processing document: {doc_name}")
+            if doc_name != doc_name_clean:
+                print(f"  (Sanitized to: {doc_name_clean})")
+            print(f"{'='*60}")
+
+            resolution = None
+            try:
+                headings, llm_hierarchy, resolution = analyze_document_headings(md_file, api_key, use_rules,
+                                                                                use_content_list, debug_reasoning)
+                write_document_output(doc_name, output_path / doc_name_clean, md_file, auto_dir,
+                                      headings, llm_hierarchy, materialize, layout)
+            except Exception as e:
+                print(f"  ✗ Failed processing {doc_name}: {e}")
+                record(doc_name, "failed", str(e), resolution)
+                continue
 
-        print(f"  Found {len(headings)} headings, calling LLM for hierarchy analysis...")
-
-        # Call LLM to determine hierarchy
-        llm_hierarchy = call_deepseek_for_hierarchy(headings, api_key)
-
-        # Read the full markdown content
-        with open(md_file, encoding='utf-8', errors='ignore') as f:
-            lines = f.readlines()
-
-        # Build heading hierarchy with content using LLM results
-        hierarchy = build_heading_hierarchy_with_llm(headings, llm_hierarchy, lines)
-
-        # Ensure the document folder exists before saving files
-        doc_folder.mkdir(parents=True, exist_ok=True)
-
-        # Save hierarchy analysis to JSON file for reference
-        hierarchy_json_file = doc_folder / "hierarchy_analysis.json"
-        print(f"  Saving hierarchy analysis to: {hierarchy_json_file}")
-
-        try:
-            with open(hierarchy_json_file, 'w', encoding='utf-8') as f:
-                json.dump({
-                    "document": doc_name,
-                    "total_headings": len(headings),
-                    "hierarchy": [
-                        {
-                            "index": h['index'],
-                            "level": h['level'],
-                            "title": h['title'],
-                            "reasoning": h['reasoning'],
-                            "parent_path": h['parent_path']
-                        }
-                        for h in hierarchy
-                    ]
-                }, f, ensure_ascii=False, indent=2)
-            print("  ✓ Saved hierarchy analysis to hierarchy_analysis.json")
-        except Exception as e:
-            print(f"  ⚠ Warning: Could not save hierarchy analysis: {e}")
-            print(f"     Folder: {doc_folder}")
-            print(f"     Exists: {doc_folder.exists()}")
-
-        # Create folder structure and save content
-        create_folder_structure_for_document(doc_folder, hierarchy, md_file, auto_dir)
-
-        print(f"  ✓ Completed processing {doc_name}")
+            print(f"  ✓ Completed processing {doc_name}")
+            record(doc_name, "completed", None, resolution)
+    else:
+        print(f"Processing {len(pending)} documents: {concurrency} concurrent LLM calls, "
+              f"{io_workers} I/O workers")
+
+        # LLM calls and disk work run in separate pools, so slow copies never hold an LLM slot
+        with ThreadPoolExecutor(max_workers=concurrency) as llm_pool, \
+                ThreadPoolExecutor(max_workers=io_workers) as io_pool:
+            llm_futures = {
+                llm_pool.submit(analyze_document_headings, md_file, api_key, use_rules,
+                                use_content_list, debug_reasoning): (subdir, auto_dir, md_file)
+                for subdir, auto_dir, md_file in pending
+            }
+            io_futures = {}
+            for future in as_completed(llm_futures):
+                subdir, auto_dir, md_file = llm_futures[future]
+                doc_name = subdir.name
+                try:
+                    headings, llm_hierarchy, resolution = future.result()
+                except Exception as e:
+                    print(f"  ✗ [{doc_name}] hierarchy analysis failed: {e}")
+                    record(doc_name, "failed", str(e), None)
+                    continue
+                io_future = io_pool.submit(write_document_output, doc_name,
+                                           output_path / sanitize_filename(doc_name),
+                                           md_file, auto_dir, headings, llm_hierarchy, materialize, layout)
+                io_futures[io_future] = (doc_name, resolution)
+
+            for future in as_completed(io_futures):
+                doc_name, resolution = io_futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"  ✗ [{doc_name}] writing output failed: {e}")
+                    record(doc_name, "failed", str(e), resolution)
+                    continue
+                print(f"  ✓ [{doc_name}] completed")
+                record(doc_name, "completed", None, resolution)
+
+    save_manifest(output_path, manifest)
+    counts = Counter(r['status'] for r in results)
+    failed = [r for r in results if r['status'] == 'failed']
+    print(f"\nProcessed {len(pending)} documents: {counts['completed']} completed, {len(failed)} failed; "
+          f"{counts['skipped']} unchanged skipped, {counts['pruned']} pruned")
+    for r in failed:
+        print(f"  ✗ {r['document']}: {r['error']}")
+    analyzed = [r for r in results if r['resolution'] is not None]
+    if analyzed:
+        local = sum(1 for r in analyzed if r['resolution'] in ('layout', 'rules'))
+        partial = sum(1 for r in analyzed if r['resolution'] in ('layout+llm', 'rules+llm'))
+        print(f"Resolved locally by layout/numbering rules: {local}/{len(analyzed)} documents "
+              f"({local / len(analyzed):.0%}), LLM for heading ranges only: {partial}")
+    calls = LLM_USAGE['calls'] - usage_before['calls']
+    if calls:
+        completion_tokens = LLM_USAGE['completion_tokens'] - usage_before['completion_tokens']
+        seconds = LLM_USAGE['seconds'] - usage_before['seconds']
+        print(f"LLM: {calls} calls, {completion_tokens} completion tokens, "
+              f"{seconds:.1f}s in calls ({seconds / calls:.1f}s per call)")
+    return results
 
 
 def main():
@@ -511,21 +1505,65 @@ def main():
             sys.exit(1)
 
     # Define source and output directories
-    source_dir = r"C:\Users\Qzj\Desktop\projrct\MinerU\Mineru_changed"
-    output_dir = r"C:\Users\Qzj\Desktop\projrct\MinerU\Dataset"
+    parser = argparse.ArgumentParser(description="使用 LLM 按标题层级组织 MinerU 输出")
+    parser.add_argument("--source-dir", default=r"C:\Users\Qzj\Desktop\projrct\MinerU\Mineru_changed",
+                        help="MinerU 输出目录")
+    parser.add_argument("--output-dir", default=r"C:\Users\Qzj\Desktop\projrct\MinerU\Dataset",
+                        help="Dataset 输出目录")
+    parser.add_argument("--concurrency", type=int, default=int(os.environ.get('STEP3_CONCURRENCY', '1')),
+                        help="同时进行 LLM 分析的文档数（默认 1，逐个处理）")
+    parser.add_argument("--io-workers", type=int, default=4,
+                        help="并发模式下建目录与复制文件的线程数")
+    parser.add_argument("--no-rules", action="store_true",
+                        help="不使用版面层级与编号规则推断层级，所有文档都调用 LLM")
+    parser.add_argument("--no-content-list", action="store_true",
+                        help="不读取 MinerU *_content_list.json，只从 Markdown 提取标题")
+    parser.add_argument("--debug-reasoning", action="store_true",
+                        default=os.environ.get('STEP3_DEBUG_REASONING', '') == '1',
+                        help="使用思维链提示，LLM 返回分析过程与每个标题的理由（更慢，仅用于调试）")
+    parser.add_argument("--materialize", choices=MATERIALIZE_STRATEGIES, default=DEFAULT_MATERIALIZE,
+                        help="PDF 与图片放入 Dataset 的方式：硬链接、reflink、符号链接或复制（默认 copy，"
+                             "不支持时回退为复制）；已是最新的文件按大小与修改时间跳过")
+    parser.add_argument("--full", action="store_true",
+                        help="忽略输出目录中的清单，重新处理所有文档（默认只处理新增或源文件变化的文档，"
+                             "并删除源文档已不存在的输出目录）")
+    parser.add_argument("--layout", choices=LAYOUTS, default=DEFAULT_LAYOUT,
+                        help="tree: 每个标题一个目录与 .md 文件（默认）；index: 只写 sections.jsonl 索引")
+    parser.add_argument("--render", nargs="+", metavar="DOC_FOLDER",
+                        help="按 sections.jsonl 为这些 Dataset 文档目录生成标题目录树，然后退出")
+    parser.add_argument("--sections", nargs="+", type=int, metavar="INDEX",
+                        help="与 --render 一起使用：只生成这些序号的标题")
+    args = parser.parse_args()
+
+    if args.render:
+        for doc_folder in args.render:
+            print(f"Rendering {doc_folder}")
+            written = render_section_tree(doc_folder, args.sections)
+            print(f"  ✓ {written} files written")
+        return
+    source_dir = args.source_dir
+    output_dir = args.output_dir
 
     print("\n" + "="*60)
     print("使用 LLM 智能层级划分开始组织文档")
     print("="*60)
     print(f"源目录: {source_dir}")
     print(f"输出目录: {output_dir}")
-    print("LLM: DeepSeek (使用 Chain of Thought 提示)")
+    print(f"LLM: DeepSeek ({'Chain of Thought 提示' if args.debug_reasoning else '紧凑提示'})")
     print("="*60 + "\n")
 
-    organize_document_by_headings(source_dir, output_dir, api_key)
+    results = organize_document_by_headings(source_dir, output_dir, api_key,
+                                            concurrency=args.concurrency, io_workers=args.io_workers,
+                                            use_rules=not args.no_rules,
+                                            use_content_list=not args.no_content_list,
+                                            debug_reasoning=args.debug_reasoning,
+                                            materialize=args.materialize,
+                                            incremental=not args.full,
+                                            layout=args.layout)
 
     print("\n" + "="*60)
-    print("✓ 所有文档处理完成!")
+    failed = sum(1 for r in results if r['status'] == 'failed')
+    print("✓ 所有文档处理完成!" if not failed else f"⚠ 处理完成，{failed} 个文档失败")
     print("="*60)
 
 
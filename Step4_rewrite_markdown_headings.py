@@ -7,9 +7,52 @@
 3. 或者手动修改了hierarchy_analysis.json，想要重新应用
 """
 
+import hashlib
 import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
 from pathlib import Path
 
+# 批量模式的默认线程数与机器可读总结文件名（写在Dataset目录下）
+DEFAULT_WORKERS = int(os.environ.get('STEP4_WORKERS', '1'))
+SUMMARY_NAME = 'step4_summary.json'
+
+
+def write_if_changed(output_path, content):
+    """
+    仅在内容变化时写入文件：先写同目录临时文件，再原子替换
+
+    内容按文本模式写出时的字节（换行符转为os.linesep）计算哈希，与现有文件相同则不写，
+    文件的修改时间保持不变。
+
+    Returns:
+        (是否写入, 新内容的sha256)
+    """
+    output_path = Path(output_path)
+    data = content.replace('\n', os.linesep).encode('utf-8', errors='ignore')
+    digest = hashlib.sha256(data).hexdigest()
+    if output_path.exists():
+        with open(output_path, 'rb') as f:
+            if hashlib.sha256(f.read()).hexdigest() == digest:
+                return False, digest
+
+    tmp_path = output_path.with_name(f".{output_path.name}.tmp")
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        if output_path.exists():
+            # 临时文件按默认权限创建，替换前沿用原文件的权限位
+            shutil.copymode(output_path, tmp_path)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if tmp_path.exists():
+            tmp_path.unlink()
+        raise
+    return True, digest
+
 
 def rewrite_markdown_headings(md_file_path, hierarchy, output_path=None):
     """
@@ -64,92 +107,123 @@ def rewrite_markdown_headings(md_file_path, hierarchy, output_path=None):
             # 非标题行，保持原样
             new_lines.append(line)
 
-    # 写入文件
-    with open(output_path, 'w', encoding='utf-8', errors='ignore') as f:
-        f.writelines(new_lines)
+    # 写入文件（原子替换；内容未变化时不写）
+    written, digest = write_if_changed(output_path, ''.join(new_lines))
 
     return {
         "rewritten": rewritten_count,
         "unchanged": unchanged_count,
-        "output_path": output_path
+        "output_path": output_path,
+        "written": written,
+        "sha256": digest
     }
 
 
-def process_single_document(doc_folder):
+def rewrite_document(doc_folder):
     """
-    处理单个文档文件夹
+    重写单个文档文件夹的markdown标题（不打印，供批量与并发模式使用）
 
     Args:
         doc_folder: 文档文件夹路径（Dataset下的子文件夹）
 
     Returns:
-        bool: 是否成功处理
+        dict: document, status（rewritten 已写入 / unchanged 内容未变化 / skipped 缺少文件 /
+        failed 出错）, markdown, rewritten, unchanged, seconds, error
     """
     doc_folder = Path(doc_folder)
+    started = time.perf_counter()
+    result = {"document": doc_folder.name, "status": "skipped", "markdown": None,
+              "headings": 0, "rewritten": 0, "unchanged": 0, "seconds": 0.0, "error": None}
+
+    def finish(status, error=None):
+        result["status"] = status
+        result["error"] = error
+        result["seconds"] = round(time.perf_counter() - started, 4)
+        return result
 
     # 查找hierarchy_analysis.json
     hierarchy_file = doc_folder / "hierarchy_analysis.json"
     if not hierarchy_file.exists():
-        print("  ✗ 未找到 hierarchy_analysis.json")
-        return False
+        return finish("skipped", "未找到 hierarchy_analysis.json")
 
     # 读取层级信息
     try:
         with open(hierarchy_file, encoding='utf-8') as f:
             hierarchy_data = json.load(f)
         hierarchy = hierarchy_data.get('hierarchy', [])
-        if not hierarchy:
-            print("  ✗ hierarchy_analysis.json 中没有层级信息")
-            return False
     except Exception as e:
-        print(f"  ✗ 读取 hierarchy_analysis.json 失败: {e}")
-        return False
-
-    # 查找md文件
-    md_files = list(doc_folder.glob("*.md"))
-    # 排除 README.md
-    md_files = [f for f in md_files if f.name.lower() != "readme.md"]
+        return finish("failed", f"读取 hierarchy_analysis.json 失败: {e}")
+    if not hierarchy:
+        return finish("skipped", "hierarchy_analysis.json 中没有层级信息")
 
+    # 查找md文件（排除 README.md）
+    md_files = [f for f in doc_folder.glob("*.md") if f.name.lower() != "readme.md"]
     if not md_files:
-        print("  ✗ 未找到markdown文件")
-        return False
+        return finish("skipped", "未找到markdown文件")
 
     md_file = md_files[0]
-    print(f"  找到markdown文件: {md_file.name}")
-    print(f"  层级信息: {len(hierarchy)} 个标题")
+    result["markdown"] = md_file.name
+    result["headings"] = len(hierarchy)
 
     # 重写markdown文件
     try:
-        result = rewrite_markdown_headings(md_file, hierarchy)
-        print("  ✓ 标题重写完成:")
-        print(f"    - 已修改: {result['rewritten']} 个标题")
-        print(f"    - 未改变: {result['unchanged']} 个标题")
-        return True
+        rewrite = rewrite_markdown_headings(md_file, hierarchy)
     except Exception as e:
-        print(f"  ✗ 重写失败: {e}")
+        return finish("failed", f"重写失败: {e}")
+    result["rewritten"] = rewrite["rewritten"]
+    result["unchanged"] = rewrite["unchanged"]
+    return finish("rewritten" if rewrite["written"] else "unchanged")
+
+
+def process_single_document(doc_folder):
+    """
+    处理单个文档文件夹
+
+    Args:
+        doc_folder: 文档文件夹路径（Dataset下的子文件夹）
+
+    Returns:
+        bool: 是否成功处理
+    """
+    result = rewrite_document(doc_folder)
+    if result["status"] in ("skipped", "failed"):
+        print(f"  ✗ {result['error']}")
         return False
 
+    print(f"  找到markdown文件: {result['markdown']}")
+    print(f"  层级信息: {result['headings']} 个标题")
+    print("  ✓ 标题重写完成:" if result["status"] == "rewritten" else "  ✓ 内容未变化，未写入文件:")
+    print(f"    - 已修改: {result['rewritten']} 个标题")
+    print(f"    - 未改变: {result['unchanged']} 个标题")
+    return True
+
 
-def process_all_documents(dataset_dir, dry_run=False):
+def process_all_documents(dataset_dir, dry_run=False, workers=DEFAULT_WORKERS, summary_path=None):
     """
     处理Dataset目录下的所有文档
 
     Args:
         dataset_dir: Dataset目录路径
         dry_run: 如果为True，只显示将要处理的文件，不实际修改
+        workers: 同时处理的文档数（线程池），1为逐个处理
+        summary_path: 机器可读总结（JSON）的路径，默认 Dataset目录/step4_summary.json；
+            预览模式不写
+
+    Returns:
+        dict: 总结（计数、总耗时与每个文档的结果）；目录不存在或为空时为None
     """
     dataset_path = Path(dataset_dir)
 
     if not dataset_path.exists():
         print(f"错误: Dataset目录不存在: {dataset_path}")
-        return
+        return None
 
     # 获取所有子文件夹
     doc_folders = [f for f in dataset_path.iterdir() if f.is_dir()]
 
     if not doc_folders:
         print("错误: Dataset目录下没有子文件夹")
-        return
+        return None
 
     print(f"\n{'='*80}")
     print("批量重写Markdown标题等级")
@@ -157,6 +231,8 @@ def process_all_documents(dataset_dir, dry_run=False):
     print(f"Dataset目录: {dataset_path}")
     print(f"找到 {len(doc_folders)} 个文档文件夹")
     print(f"模式: {'预览模式（不修改文件）' if dry_run else '执行模式（将修改文件）'}")
+    if not dry_run and workers > 1:
+        print(f"并发: {workers} 个线程")
     print(f"{'='*80}\n")
 
     if dry_run:
@@ -166,31 +242,68 @@ def process_all_documents(dataset_dir, dry_run=False):
     success_count = 0
     skip_count = 0
     fail_count = 0
-
-    for i, doc_folder in enumerate(doc_folders, 1):
-        print(f"[{i}/{len(doc_folders)}] 处理: {doc_folder.name}")
-
-        if dry_run:
-            # 预览模式：只检查文件是否存在
-            hierarchy_file = doc_folder / "hierarchy_analysis.json"
-            md_files = [f for f in doc_folder.glob("*.md") if f.name.lower() != "readme.md"]
-
-            if hierarchy_file.exists() and md_files:
-                print("  ✓ 准备就绪")
-                print(f"    - 层级文件: {hierarchy_file.name}")
-                print(f"    - Markdown: {md_files[0].name}")
-                success_count += 1
-            else:
-                print("  ✗ 跳过（缺少必要文件）")
-                skip_count += 1
-        else:
-            # 执行模式：实际处理
-            if process_single_document(doc_folder):
-                success_count += 1
+    started_at = datetime.now().isoformat(timespec='seconds')
+    started = time.perf_counter()
+    results = []
+
+    if not dry_run and workers > 1:
+        # 文档之间互不依赖；每个文档独立原子写入，结果按完成顺序打印
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(rewrite_document, doc_folder): doc_folder for doc_folder in doc_folders}
+            for i, future in enumerate(as_completed(futures), 1):
+                result = future.result()
+                results.append(result)
+                detail = result['error'] or f"已修改 {result['rewritten']} 个标题"
+                print(f"[{i}/{len(doc_folders)}] {result['document']}: {result['status']} "
+                      f"({detail}, {result['seconds']:.3f}s)")
+    else:
+        for i, doc_folder in enumerate(doc_folders, 1):
+            print(f"[{i}/{len(doc_folders)}] 处理: {doc_folder.name}")
+
+            if dry_run:
+                # 预览模式：只检查文件是否存在
+                hierarchy_file = doc_folder / "hierarchy_analysis.json"
+                md_files = [f for f in doc_folder.glob("*.md") if f.name.lower() != "readme.md"]
+
+                if hierarchy_file.exists() and md_files:
+                    print("  ✓ 准备就绪")
+                    print(f"    - 层级文件: {hierarchy_file.name}")
+                    print(f"    - Markdown: {md_files[0].name}")
+                    success_count += 1
+                else:
+                    print("  ✗ 跳过（缺少必要文件）")
+                    skip_count += 1
             else:
-                skip_count += 1
-
-        print()
+                # 执行模式：实际处理
+                result = rewrite_document(doc_folder)
+                results.append(result)
+                if result["status"] in ("skipped", "failed"):
+                    print(f"  ✗ {result['error']}")
+                else:
+                    print(f"  ✓ {'标题重写完成' if result['status'] == 'rewritten' else '内容未变化，未写入文件'}: "
+                          f"已修改 {result['rewritten']} 个标题, 未改变 {result['unchanged']} 个标题")
+
+            print()
+
+    elapsed = time.perf_counter() - started
+    summary = None
+    if not dry_run:
+        counts = {status: sum(1 for r in results if r['status'] == status)
+                  for status in ("rewritten", "unchanged", "skipped", "failed")}
+        success_count = counts["rewritten"] + counts["unchanged"]
+        skip_count = counts["skipped"]
+        fail_count = counts["failed"]
+        summary = {
+            "dataset_dir": str(dataset_path),
+            "started_at": started_at,
+            "workers": workers,
+            "elapsed_seconds": round(elapsed, 3),
+            "counts": counts,
+            "documents": sorted(results, key=lambda r: r["document"])
+        }
+        summary_file = Path(summary_path) if summary_path else dataset_path / SUMMARY_NAME
+        with open(summary_file, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
 
     # 总结
     print(f"{'='*80}")
@@ -201,10 +314,14 @@ def process_all_documents(dataset_dir, dry_run=False):
         print(f"  将跳过: {skip_count} 个")
         print("\n运行时不加 --dry-run 参数即可执行实际修改")
     else:
-        print(f"  成功: {success_count} 个")
+        print(f"  成功: {success_count} 个（已写入 {summary['counts']['rewritten']} 个，"
+              f"内容未变化 {summary['counts']['unchanged']} 个）")
         print(f"  跳过: {skip_count} 个")
         print(f"  失败: {fail_count} 个")
+        print(f"  耗时: {elapsed:.2f}s")
+        print(f"  总结: {summary_file}")
     print(f"{'='*80}")
+    return summary
 
 
 def main():
@@ -227,8 +344,11 @@ def main():
   # 处理单个文档
   python Step4_rewrite_markdown_headings.py --single "Dataset\\报告1"
 
+  # 8个线程并发处理，总结写到指定文件
+  python Step4_rewrite_markdown_headings.py --workers 8 --summary step4_summary.json
+
 注意：
-  - 程序会直接修改Dataset下的md文件
+  - 程序会直接修改Dataset下的md文件（先写临时文件再替换；内容不变的文件不会被改写）
   - 建议先用 --dry-run 预览
   - 或者先备份Dataset目录
         """
@@ -252,6 +372,19 @@ def main():
         help='只处理单个文档文件夹（提供文件夹路径）'
     )
 
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=DEFAULT_WORKERS,
+        help='同时处理的文档数（默认1，或环境变量STEP4_WORKERS）'
+    )
+
+    parser.add_argument(
+        '--summary',
+        type=str,
+        help=f'机器可读总结（JSON）的输出路径（默认：Dataset目录/{SUMMARY_NAME}）'
+    )
+
     args = parser.parse_args()
 
     if args.single:
@@ -278,7 +411,8 @@ def main():
             process_single_document(args.single)
     else:
         # 处理所有文档
-        process_all_documents(args.dataset_dir, dry_run=args.dry_run)
+        process_all_documents(args.dataset_dir, dry_run=args.dry_run, workers=args.workers,
+                              summary_path=args.summary)
 
 
 if __name__ == "__main__":
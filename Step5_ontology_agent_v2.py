@@ -142,12 +142,21 @@
 ═══════════════════════════════════════════════════════════════════════════════
 """
 
-import copy
+import gzip
 import json
+import math
 import os
 import re
-from datetime import datetime
+import threading
+import time
+import zlib
+from array import array
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from datetime import datetime, timedelta
 from pathlib import Path
+from types import SimpleNamespace
 from typing import Any
 
 from openai import OpenAI
@@ -160,17 +169,153 @@ MODEL = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
 API_KEY = os.getenv("DEEPSEEK_API_KEY", "")
 BASE_URL = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
 
+# 为 true 时 JSON 类字段与拆分规划使用流式请求并增量解析
+STREAMING = os.getenv("LLM_STREAMING", "false").lower() == "true"
+
+# 处理追踪文件格式：gzip（默认）/ zstd / plain / none（不写追踪）
+TRACE_COMPRESSION = os.getenv("STEP5_TRACE", "gzip").lower()
+# 为 true 时处理结束后仍写出完整的 <文档名>_memory.json 快照
+MEMORY_SNAPSHOT = os.getenv("STEP5_MEMORY_SNAPSHOT", "false").lower() == "true"
+
+# 本体论输出编码：pretty（默认，缩进 JSON）/ compact（紧凑 JSON，安装 orjson 时用 orjson）
+OUTPUT_FORMAT = os.getenv("STEP5_OUTPUT_FORMAT", "pretty").lower()
+# 本体论输出压缩：none（默认）/ gzip / zstd
+OUTPUT_COMPRESSION = os.getenv("STEP5_OUTPUT_COMPRESSION", "none").lower()
+# 为 true 时另存 msgpack 副本 <文档名>_ontology.msgpack（需要安装 msgpack）
+OUTPUT_MSGPACK = os.getenv("STEP5_OUTPUT_MSGPACK", "false").lower() == "true"
+
 if not API_KEY:
     raise ValueError("DEEPSEEK_API_KEY environment variable is required")
 
 client = OpenAI(api_key=API_KEY, base_url=BASE_URL)
 
 
+# ═══════════════════════════════════════════════════════════════════════════
+#                 文档模型 (单份源文本 + 偏移视图)
+# ═══════════════════════════════════════════════════════════════════════════
+
+
+class SourceDocument:
+    """
+    不可变的文档源文本与行偏移表
+
+    标题与 chunk 的内容都以 (start, end) 字符区间引用这份源文本，需要时才生成字符串，
+    避免同一份报告在记忆池中以标题内容、chunk 内容等形式保存多份副本。
+    行偏移表在首次按行取视图时才建立。
+    """
+
+    __slots__ = ("text", "_line_offsets")
+
+    def __init__(self, text: str):
+        self.text = text
+        self._line_offsets = None
+
+    @property
+    def line_offsets(self) -> array:
+        """line_offsets[i] 为第 i 行首字符的偏移；末尾追加 len(text)+1 作为哨兵"""
+        if self._line_offsets is None:
+            offsets = array("q", [0])
+            find = self.text.find
+            pos = find("\n")
+            while pos != -1:
+                offsets.append(pos + 1)
+                pos = find("\n", pos + 1)
+            offsets.append(len(self.text) + 1)
+            self._line_offsets = offsets
+        return self._line_offsets
+
+    @property
+    def line_count(self) -> int:
+        return len(self.line_offsets) - 1
+
+    def lines_view(self, start_line: int, end_line: int) -> "TextView":
+        """
+        第 start_line 行到第 end_line 行（不含）的内容视图，首尾空白已去除
+
+        等价于 "\\n".join(lines[start_line:end_line]).strip()
+        """
+        start = self.line_offsets[start_line]
+        end = min(self.line_offsets[end_line] - 1, len(self.text))
+        return self.view(start, end, strip=True)
+
+    def view(self, start: int, end: int, strip: bool = False) -> "TextView":
+        """[start, end) 区间的视图；strip 为 True 时收缩掉首尾空白"""
+        if strip:
+            text = self.text
+            while start < end and text[start].isspace():
+                start += 1
+            while end > start and text[end - 1].isspace():
+                end -= 1
+        return TextView(self, start, end)
+
+
+class TextView:
+    """源文本上的只读区间视图，str() 时才生成字符串"""
+
+    __slots__ = ("source", "start", "end")
+
+    def __init__(self, source: SourceDocument, start: int, end: int):
+        self.source = source
+        self.start = start
+        self.end = end
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def __str__(self) -> str:
+        return self.source.text[self.start : self.end]
+
+
+class ChunkView:
+    """多个 TextView 以分隔符拼接而成的惰性视图（DocumentSplitter 的 chunk 内容）"""
+
+    __slots__ = ("parts", "sep")
+
+    def __init__(self, parts: list[TextView], sep: str = "\n\n"):
+        self.parts = parts
+        self.sep = sep
+
+    def __len__(self) -> int:
+        if not self.parts:
+            return 0
+        return sum(len(p) for p in self.parts) + len(self.sep) * (len(self.parts) - 1)
+
+    def __str__(self) -> str:
+        return self.sep.join(str(p) for p in self.parts)
+
+
 # ═══════════════════════════════════════════════════════════════════════════
 #                       Memory Pool (记忆池)
 # ═══════════════════════════════════════════════════════════════════════════
 
 
+LOG_LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+LOG_LEVEL_NAMES = {value: name for name, value in LOG_LEVELS.items()}
+
+
+class LogEvent:
+    """一条结构化处理日志：所属阶段、级别、相对文档开始处理的耗时与消息"""
+
+    __slots__ = ("elapsed", "stage", "level", "message")
+
+    def __init__(self, elapsed: float, stage: str | None, level: int, message: str):
+        self.elapsed = elapsed
+        self.stage = stage
+        self.level = level
+        self.message = message
+
+    def to_dict(self, started_at: datetime) -> dict:
+        return {
+            "time": (started_at + timedelta(seconds=self.elapsed)).isoformat(
+                timespec="milliseconds"
+            ),
+            "elapsed_s": round(self.elapsed, 3),
+            "stage": self.stage,
+            "level": LOG_LEVEL_NAMES[self.level],
+            "message": self.message,
+        }
+
+
 class MemoryPool:
     """
     记忆池：用于在 Agent 各模块间传递和存储数据
@@ -179,8 +324,30 @@ class MemoryPool:
     1. 统一的数据存储接口
     2. 支持数据版本追溯
     3. 便于调试和日志记录
+
+    日志以 LogEvent 记录在 events 中，只有不低于 CONSOLE_LEVEL 的消息才输出到控制台
+    （环境变量 STEP5_LOG_LEVEL 或命令行 --log-level，默认 info）。
+    挂接 TraceWriter 后，日志、阶段切换与赋值同时实时写入追踪文件。
     """
 
+    CONSOLE_LEVEL = LOG_LEVELS.get(os.getenv("STEP5_LOG_LEVEL", "info").lower(), 20)
+    DOCUMENT_CONTENT_PREVIEW = 1000  # 保存时 document_content 只保留前 1000 字符
+    # 原地累加、不经过 set() 的统计项，结束追踪时写入最终值
+    IN_PLACE_KEYS = ("llm_usage", "route_stats", "stream_timing", "parse_stats")
+
+    __slots__ = (
+        "memory",
+        "events",
+        "stage",
+        "_started",
+        "_started_at",
+        "raw_archive",
+        "model_router",
+        "classify_coalescer",
+        "trace",
+        "dry_run",
+    )
+
     def __init__(self):
         self.memory = {
             "document_path": None,  # 文档路径
@@ -190,64 +357,1533 @@ class MemoryPool:
             "split_plan": None,  # 拆分方案
             "chunks": [],  # 拆分后的文档块
             "extracted_data": {},  # 提取的数据
-            "processing_log": [],  # 处理日志
+            "llm_usage": {},  # 各字段 LLM 调用的 token 预算与消耗
+            "route_stats": {},  # 各模型路由的调用次数、耗时与 token 消耗
+            "stream_timing": {},  # 流式请求的首 token / 首个结果 / 总耗时
+            "parse_stats": {  # JSON 解析失败/修复/重问计数
+                "parse_failures": 0,
+                "local_repairs": 0,
+                "reasks": 0,
+                "reask_successes": 0,
+                "defaulted": 0,
+            },
         }
+        self.events: list[LogEvent] = []  # 处理日志
+        self.stage = None  # 当前处理阶段，记录在每条日志中
+        self._started = time.monotonic()
+        self._started_at = datetime.now()
+        # 原始回复归档（RawResponseArchive）、模型路由器（ModelRouter）与
+        # 分类请求合并队列（ClassificationCoalescer），不参与记忆池序列化
+        self.raw_archive = None
+        self.model_router = None
+        self.classify_coalescer = None
+        self.trace = None  # TraceWriter
+        self.dry_run = None  # DryRunEstimator，试运行时不调用 LLM
 
     def set(self, key: str, value: Any):
         """存储数据到记忆池"""
         self.memory[key] = value
-        self.log(f"Memory updated: {key}")
+        if self.trace is not None:
+            self.trace.set(time.monotonic() - self._started, key, value)
+        self.log(f"Memory updated: {key}", level="debug")
 
     def get(self, key: str) -> Any:
         """从记忆池获取数据"""
         return self.memory.get(key)
 
-    def log(self, message: str):
+    def begin_stage(self, stage: str):
+        """进入新的处理阶段"""
+        if self.trace is not None:
+            t = round(time.monotonic() - self._started, 3)
+            if self.stage is not None:
+                self.trace.write("stage_end", t=t, stage=self.stage)
+            self.trace.write("stage_start", flush=True, t=t, stage=stage)
+        self.stage = stage
+
+    def log(self, message: str, level: str = "info"):
         """记录处理日志"""
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_entry = f"[{timestamp}] {message}"
-        self.memory["processing_log"].append(log_entry)
-        print(f"  📝 {message}")
+        level_value = LOG_LEVELS[level]
+        elapsed = time.monotonic() - self._started
+        self.events.append(LogEvent(elapsed, self.stage, level_value, message))
+        if self.trace is not None:
+            self.trace.write(
+                "log",
+                flush=level_value >= LOG_LEVELS["warning"],
+                t=round(elapsed, 3),
+                stage=self.stage,
+                level=level,
+                message=message,
+            )
+        if level_value >= MemoryPool.CONSOLE_LEVEL:
+            print(f"  📝 {message}")
+
+    def attach_trace(self, trace: "TraceWriter", **run_info):
+        """挂接追踪文件：写入运行信息与此前已赋值的数据"""
+        self.trace = trace
+        trace.write("run", time=self._started_at.isoformat(), **run_info)
+        for key, value in self.memory.items():
+            if key not in self.IN_PLACE_KEYS and value not in (None, [], {}):
+                trace.set(0.0, key, value)
+
+    def close_trace(self, success: bool):
+        """写入原地累加的统计项与结束事件，并关闭追踪文件"""
+        if self.trace is None:
+            return
+        t = round(time.monotonic() - self._started, 3)
+        for key in self.IN_PLACE_KEYS:
+            self.trace.set(t, key, self.memory[key])
+        if self.stage is not None:
+            self.trace.write("stage_end", t=t, stage=self.stage)
+        self.trace.write("end", t=t, success=success)
+        self.trace.close()
+        self.trace = None
+
+    @classmethod
+    def preview(cls, content: str) -> str:
+        """document_content 的保存形式：只保留开头部分"""
+        if len(content) > cls.DOCUMENT_CONTENT_PREVIEW:
+            return content[: cls.DOCUMENT_CONTENT_PREVIEW] + "...(truncated)"
+        return content
 
-    def _convert_to_serializable(self, obj):
+    @staticmethod
+    def _json_default(obj):
+        """json 序列化无法直接处理的对象：Path、文本视图等转换为字符串"""
+        return str(obj)
+
+    def save_memory(self, output_path: str):
         """
-        递归转换对象为可序列化格式
+        保存记忆池到文件（用于调试）
 
-        处理:
-        - Path 对象 → 字符串
-        - 其他不可序列化对象 → 字符串表示
+        逐个顶层键流式写入，不复制记忆池；document_content 只保留开头部分。
         """
-        if isinstance(obj, Path):
-            return str(obj)
-        if isinstance(obj, dict):
-            return {
-                key: self._convert_to_serializable(value) for key, value in obj.items()
+        encoder = json.JSONEncoder(
+            ensure_ascii=False, indent=2, default=self._json_default
+        )
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write("{")
+            for i, (key, value) in enumerate(self.memory.items()):
+                if key == "document_content" and isinstance(value, str):
+                    value = self.preview(value)
+                f.write(",\n  " if i else "\n  ")
+                f.write(json.dumps(key, ensure_ascii=False) + ": ")
+                for part in encoder.iterencode(value):
+                    f.write(part.replace("\n", "\n  "))
+            f.write(',\n  "processing_log": ')
+            for part in encoder.iterencode(
+                [event.to_dict(self._started_at) for event in self.events]
+            ):
+                f.write(part.replace("\n", "\n  "))
+            f.write("\n}\n")
+
+
+def open_compressed(path: Path, mode: str):
+    """
+    按扩展名打开文件：.gz 用 gzip，.zst 用 zstandard（可选依赖），其余为普通文件
+
+    mode 为 "rt" / "wt" / "rb" / "wb"，文本模式统一使用 UTF-8。
+    """
+    path = Path(path)
+    encoding = "utf-8" if "t" in mode else None
+    if path.suffix == ".gz":
+        return gzip.open(path, mode, encoding=encoding)
+    if path.suffix == ".zst":
+        try:
+            import zstandard
+        except ImportError as e:
+            raise RuntimeError(f"读写 {path.name} 需要安装 zstandard") from e
+        return zstandard.open(path, mode, encoding=encoding)
+    return open(path, mode, encoding=encoding)  # noqa: SIM115
+
+
+class TraceWriter:
+    """
+    处理过程追踪：以追加式 JSONL 实时写入事件，进程中途退出时已写入的部分仍可读取
+
+    文件: <输出目录>/<文档名>_trace.jsonl / .jsonl.gz / .jsonl.zst（STEP5_TRACE 选择）
+    事件:
+    - {"type": "run", "document": "...", "ontology_path": "...", "time": "..."}
+    - {"type": "stage_start" / "stage_end", "t": 秒, "stage": "..."}
+    - {"type": "log", "t": 秒, "stage": "...", "level": "info", "message": "..."}
+    - {"type": "set", "t": 秒, "key": "...", "value": ...}
+    - {"type": "llm", "t": 秒, "key": "字段标识", "route": ..., "completion_tokens": ...}
+    - {"type": "end", "t": 秒, "success": true}
+
+    本体论只在 run 事件中记录路径；需要旧版 <文档名>_memory.json 时用
+    rebuild_snapshot（命令行 --rebuild-memory）从追踪文件重建。
+    """
+
+    SUFFIXES = {"plain": ".jsonl", "gzip": ".jsonl.gz", "zstd": ".jsonl.zst"}
+    NAME_MARKER = "_trace"
+    REFERENCE_KEYS = {"ontology"}  # 只记录引用，不写入值
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._fh = open_compressed(self.path, "wt")
+
+    @classmethod
+    def path_for(cls, output_dir: Path, stem: str, compression: str) -> Path:
+        return Path(output_dir) / f"{stem}{cls.NAME_MARKER}{cls.SUFFIXES[compression]}"
+
+    def write(self, record_type: str, flush: bool = False, **fields):
+        """写入一条事件；flush 为 True 时立即刷新到磁盘（压缩流会在此处形成同步点）"""
+        if self._fh is None:
+            return
+        record = {"type": record_type, **fields}
+        self._fh.write(
+            json.dumps(record, ensure_ascii=False, default=MemoryPool._json_default)
+            + "\n"
+        )
+        if flush:
+            self._fh.flush()
+
+    def set(self, t: float, key: str, value: Any):
+        """记录记忆池的一次赋值"""
+        if key in self.REFERENCE_KEYS:
+            value = None
+        elif key == "document_content" and isinstance(value, str):
+            value = MemoryPool.preview(value)
+        self.write("set", t=round(t, 3), key=key, value=value)
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    @staticmethod
+    def read(path: Path) -> list[dict]:
+        """读取追踪文件全部事件（进程中断导致的不完整尾部会被忽略）"""
+        records = []
+        try:
+            with open_compressed(path, "rt") as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        break
+        except (EOFError, OSError, zlib.error):
+            pass
+        return records
+
+    @staticmethod
+    def rebuild_snapshot(trace_path: Path, output_path: Path | None = None) -> Path:
+        """
+        从追踪文件重建旧版 <文档名>_memory.json
+
+        Args:
+            trace_path: 追踪文件路径
+            output_path: 输出路径，默认与追踪文件同目录
+
+        Returns:
+            生成的快照路径
+        """
+        trace_path = Path(trace_path)
+        if output_path is None:
+            stem = trace_path.name.split(TraceWriter.NAME_MARKER)[0]
+            output_path = trace_path.with_name(f"{stem}_memory.json")
+
+        memory_pool = MemoryPool()
+        for record in TraceWriter.read(trace_path):
+            record_type = record["type"]
+            if record_type == "run":
+                memory_pool._started_at = datetime.fromisoformat(record["time"])
+                ontology_path = Path(record.get("ontology_path") or "")
+                if ontology_path.is_file():
+                    with open(ontology_path, encoding="utf-8") as f:
+                        memory_pool.memory["ontology"] = json.load(f)
+            elif (
+                record_type == "set" and record["key"] not in TraceWriter.REFERENCE_KEYS
+            ):
+                memory_pool.memory[record["key"]] = record["value"]
+            elif record_type == "log":
+                memory_pool.events.append(
+                    LogEvent(
+                        record["t"],
+                        record["stage"],
+                        LOG_LEVELS[record["level"]],
+                        record["message"],
+                    )
+                )
+        memory_pool.save_memory(str(output_path))
+        return output_path
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#                   LLM 调用层 (Token 预算 + 统一调用入口)
+# ═══════════════════════════════════════════════════════════════════════════
+
+
+class TokenBudgetService:
+    """
+    按字段学习的 max_tokens 预算服务
+
+    根据历史运行中每个字段实际消耗的 completion tokens，取高分位数并加上余量作为
+    本次请求的 max_tokens，避免所有字段统一预留 2000 tokens。
+
+    统计数据保存在输出目录的 _token_usage_stats.json 中，跨运行累积：
+    {"字段名": [completion_tokens, ...], ...}
+    """
+
+    STATS_FILENAME = "_token_usage_stats.json"
+    PERCENTILE = 0.95  # 取 P95
+    MARGIN_RATIO = 0.25  # 在分位数基础上额外预留 25%
+    MARGIN_MIN = 32  # 至少额外预留的 tokens
+    MIN_SAMPLES = 5  # 样本数不足时使用默认值
+    MAX_SAMPLES = 200  # 每个字段最多保留的历史样本
+    MIN_BUDGET = 32
+    RETRY_CEILING = 8192  # 截断重试时的最大预算
+
+    def __init__(self):
+        self.stats_path = None
+        self.samples: dict[str, list[int]] = {}
+        self._lock = threading.Lock()
+
+    def load(self, stats_dir: Path):
+        """从输出目录加载历史统计（同一目录只加载一次）"""
+        stats_path = Path(stats_dir) / self.STATS_FILENAME
+        if stats_path == self.stats_path:
+            return
+        with self._lock:
+            self.stats_path = stats_path
+            self.samples = {}
+            if stats_path.exists():
+                try:
+                    with open(stats_path, encoding="utf-8") as f:
+                        self.samples = json.load(f)
+                except (OSError, json.JSONDecodeError) as e:
+                    print(f"   ⚠ token 统计文件读取失败，使用默认预算: {e}")
+
+    def save(self):
+        """保存统计到文件"""
+        if self.stats_path is None:
+            return
+        with self._lock, open(self.stats_path, "w", encoding="utf-8") as f:
+            json.dump(self.samples, f, ensure_ascii=False)
+
+    def budget_for(self, key: str, default: int) -> int:
+        """
+        计算字段的 max_tokens 预算
+
+        Args:
+            key: 字段标识
+            default: 默认预算（同时也是学习预算的上限）
+
+        Returns:
+            max_tokens
+        """
+        with self._lock:
+            samples = sorted(self.samples.get(key, []))
+        if len(samples) < self.MIN_SAMPLES:
+            return default
+
+        rank = min(len(samples) - 1, math.ceil(self.PERCENTILE * len(samples)) - 1)
+        high = samples[rank]
+        budget = high + max(self.MARGIN_MIN, int(high * self.MARGIN_RATIO))
+        return max(min(self.MIN_BUDGET, default), min(budget, default))
+
+    def expected(self, key: str) -> int | None:
+        """字段历史 completion tokens 的中位数，没有历史时返回 None"""
+        with self._lock:
+            samples = sorted(self.samples.get(key, []))
+        if not samples:
+            return None
+        return samples[len(samples) // 2]
+
+    def retry_budget(self, budget: int, default: int) -> int:
+        """截断后重试使用的更大预算"""
+        if budget < default:
+            return default
+        return min(budget * 2, self.RETRY_CEILING)
+
+    def record(self, key: str, completion_tokens: int):
+        """记录一次完成的 completion tokens"""
+        with self._lock:
+            samples = self.samples.setdefault(key, [])
+            samples.append(completion_tokens)
+            if len(samples) > self.MAX_SAMPLES:
+                del samples[: len(samples) - self.MAX_SAMPLES]
+
+
+token_budget = TokenBudgetService()
+
+
+class RequestHedger:
+    """
+    LLM 请求对冲：削减长尾延迟
+
+    按路由实时记录最近的调用耗时；开启后（LLM_HEDGE=true），若一次调用超过该路由
+    耗时的 PERCENTILE 分位数仍未返回，则再发起一次相同请求，先返回者胜出，落后的
+    请求结果被丢弃（已发出的 HTTP 请求无法中途撤回，其 token 计入额外开销）。
+
+    对冲次数不超过调用总数的 MAX_RATE；stats 记录对冲次数、对冲胜出次数、
+    额外消耗的 tokens，以及对冲胜出时相对原请求节省的时间。
+    """
+
+    PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+    MAX_RATE = float(os.getenv("LLM_HEDGE_MAX_RATE", "0.1"))
+    MIN_SAMPLES = 20  # 样本不足时不对冲
+    MAX_SAMPLES = 200  # 每个路由保留的最近耗时样本
+    MAX_WORKERS = 16
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._executor = None
+        self.latencies = {}  # {路由: deque[耗时秒数]}
+        self.stats = {
+            "calls": 0,
+            "hedged": 0,
+            "hedge_wins": 0,
+            "extra_completion_tokens": 0,
+            "latency_saved_s": 0.0,
+        }
+
+    def threshold(self, route: str) -> float | None:
+        """返回路由当前的对冲阈值（秒），样本不足时返回 None"""
+        with self._lock:
+            samples = sorted(self.latencies.get(route, ()))
+        if len(samples) < self.MIN_SAMPLES:
+            return None
+        return samples[min(int(len(samples) * self.PERCENTILE), len(samples) - 1)]
+
+    def _observe(self, route: str, latency: float):
+        with self._lock:
+            samples = self.latencies.setdefault(route, deque(maxlen=self.MAX_SAMPLES))
+            samples.append(latency)
+
+    def call(self, route: str, request_fn):
+        """
+        执行一次 LLM 请求，必要时对冲
+
+        Args:
+            route: 路由名称（按路由统计耗时）
+            request_fn: 无参函数，发送请求并返回 response
+
+        Returns:
+            先返回的 response
+        """
+        with self._lock:
+            self.stats["calls"] += 1
+            allow_hedge = (
+                self.enabled
+                and self.stats["hedged"] + 1 <= self.stats["calls"] * self.MAX_RATE
+            )
+        threshold = self.threshold(route) if allow_hedge else None
+
+        started = time.monotonic()
+        if threshold is None:
+            response = request_fn()
+            self._observe(route, time.monotonic() - started)
+            return response
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.MAX_WORKERS, thread_name_prefix="llm-hedge"
+                )
+            executor = self._executor
+
+        primary = executor.submit(request_fn)
+        try:
+            response = primary.result(timeout=threshold)
+            self._observe(route, time.monotonic() - started)
+            return response
+        except FuturesTimeoutError:
+            pass
+
+        with self._lock:
+            self.stats["hedged"] += 1
+        hedge = executor.submit(request_fn)
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    winner_latency = time.monotonic() - started
+                    self._observe(route, winner_latency)
+                    for loser in pending:
+                        loser.cancel()
+                        loser.add_done_callback(
+                            lambda f, latency=winner_latency, hedge_won=(future is hedge): (
+                                self._settle_loser(f, started, latency, hedge_won)
+                            )
+                        )
+                    if future is hedge:
+                        with self._lock:
+                            self.stats["hedge_wins"] += 1
+                    return future.result()
+        # 两个请求都失败，抛出原请求的异常
+        return primary.result()
+
+    def _settle_loser(
+        self, future, started: float, winner_latency: float, hedge_won: bool
+    ):
+        """落后请求结束后统计额外 token 消耗与节省的时间"""
+        if future.cancelled() or future.exception() is not None:
+            return
+        usage = getattr(future.result(), "usage", None)
+        with self._lock:
+            if usage is not None:
+                self.stats["extra_completion_tokens"] += usage.completion_tokens or 0
+            if hedge_won:
+                self.stats["latency_saved_s"] += (
+                    time.monotonic() - started - winner_latency
+                )
+
+
+request_hedger = RequestHedger(
+    enabled=os.getenv("LLM_HEDGE", "false").lower() == "true"
+)
+
+
+class CircuitOpenError(RuntimeError):
+    """依赖服务熔断中：快速失败，文档应稍后重试而不是写入默认值"""
+
+
+class CircuitBreaker:
+    """
+    熔断器：保护单个依赖（LLM 路由，以及 Django 任务中的 MinerU 服务）
+
+    在最近 window 次调用中，失败或慢调用（超过 slow_call_seconds）占比达到
+    failure_rate 时熔断（open），open_seconds 秒内直接拒绝请求；之后进入半开
+    （half_open）状态放行一个探测请求，成功则恢复（closed），失败则再次熔断。
+
+    构造参数缺省时使用类属性（LLM_BREAKER_* 环境变量）。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    WINDOW = int(os.getenv("LLM_BREAKER_WINDOW", "20"))
+    MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", "5"))
+    FAILURE_RATE = float(os.getenv("LLM_BREAKER_FAILURE_RATE", "0.5"))
+    SLOW_CALL_S = float(os.getenv("LLM_BREAKER_SLOW_CALL_S", "120"))
+    OPEN_S = float(os.getenv("LLM_BREAKER_OPEN_S", "60"))
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float | None = None,
+        slow_call_seconds: float | None = None,
+        open_seconds: float | None = None,
+        window: int | None = None,
+        min_calls: int | None = None,
+    ):
+        self.name = name
+        self.failure_rate = self.FAILURE_RATE if failure_rate is None else failure_rate
+        self.slow_call_seconds = (
+            self.SLOW_CALL_S if slow_call_seconds is None else slow_call_seconds
+        )
+        self.open_seconds = self.OPEN_S if open_seconds is None else open_seconds
+        self.min_calls = self.MIN_CALLS if min_calls is None else min_calls
+        self.state = self.CLOSED
+        self._lock = threading.Lock()
+        self._outcomes = deque(
+            maxlen=self.WINDOW if window is None else window
+        )  # True 表示失败或慢调用
+        self._opened_at = 0.0
+        self._probing = False
+        self._probe_thread = None
+
+    def allow(self) -> bool:
+        """是否放行本次请求"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self._probing:
+                return False
+            self._probing = True
+            self._probe_thread = threading.get_ident()
+            return True
+
+    def release(self):
+        """
+        放弃当前线程持有的半开探测而不记录结果
+
+        用于与依赖服务无关的失败（如本地文件不存在），否则探测名额不会归还，
+        后续请求会一直被拒绝
+        """
+        with self._lock:
+            if self._probing and self._probe_thread == threading.get_ident():
+                self._probing = False
+
+    def check(self):
+        """
+        放行检查
+
+        Raises:
+            CircuitOpenError: 熔断中时抛出
+        """
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} 服务熔断中，请稍后重试")
+
+    def record(self, success: bool, latency: float):
+        """记录一次调用结果（超过慢调用阈值时按失败计）"""
+        failed = not success or latency > self.slow_call_seconds
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probing = False
+                if failed:
+                    self._trip()
+                else:
+                    self.state = self.CLOSED
+                    self._outcomes.clear()
+                    print(f"   ✓ {self.name} 熔断恢复")
+                return
+            self._outcomes.append(failed)
+            if (
+                len(self._outcomes) >= self.min_calls
+                and sum(self._outcomes) / len(self._outcomes) >= self.failure_rate
+            ):
+                self._trip()
+
+    def record_success(self, latency: float):
+        """记录一次成功调用"""
+        self.record(True, latency)
+
+    def record_failure(self):
+        """记录一次失败调用"""
+        self.record(False, 0.0)
+
+    def _trip(self):
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        print(f"   ⚠ {self.name} 熔断 {self.open_seconds:.0f}s")
+
+
+class RawResponseArchive:
+    """
+    原始 LLM 回复归档：每个文档一个 gzip 压缩的追加式 JSONL 文件
+
+    文件: <输出目录>/<文档名>_raw.jsonl.gz
+    记录:
+    - {"type": "run", "document": "...", "model": "...", "time": "..."}  每次运行的起始记录
+    - {"type": "response", "key": "字段标识", "text": "原始回复", ...}
+
+    重解析（reparse）时以回放模式打开，LLMGateway 按 key 顺序返回归档中最近一次
+    运行的原始回复而不再调用 LLM，从而用当前的解析逻辑重建 *_ontology.json。
+    """
+
+    SUFFIX = "_raw.jsonl.gz"
+
+    def __init__(self, path: Path, replay: bool = False):
+        self.path = Path(path)
+        self.replay = replay
+        self._fh = None
+        self._responses: dict[str, deque] = {}
+        if replay:
+            for record in self.latest_run(self.path)[1]:
+                self._responses.setdefault(record["key"], deque()).append(
+                    record["text"]
+                )
+
+    def open(self, document_path: Path):
+        """以追加方式打开归档，并写入本次运行的起始记录"""
+        if self.replay:
+            return
+        self._fh = gzip.open(self.path, "at", encoding="utf-8")  # noqa: SIM115
+        self._write(
+            {
+                "type": "run",
+                "document": str(document_path),
+                "model": MODEL,
+                "time": datetime.now().isoformat(),
             }
-        if isinstance(obj, list):
-            return [self._convert_to_serializable(item) for item in obj]
-        if isinstance(obj, (str, int, float, bool, type(None))):
-            return obj
-        # 其他类型转换为字符串
-        return str(obj)
+        )
 
-    def save_memory(self, output_path: str):
-        """保存记忆池到文件（用于调试）"""
-        # 创建可序列化的副本
-        serializable_memory = copy.deepcopy(self.memory)
-
-        # 转换所有不可序列化对象
-        serializable_memory = self._convert_to_serializable(serializable_memory)
-
-        # 截断过长的内容
-        if serializable_memory.get("document_content"):
-            content = serializable_memory["document_content"]
-            if isinstance(content, str) and len(content) > 1000:
-                serializable_memory["document_content"] = (
-                    content[:1000] + "...(truncated)"
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def _write(self, record: dict):
+        self._fh.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._fh.flush()
+
+    def append(self, key: str, text: str, **meta):
+        """追加一条原始回复"""
+        if self._fh is None:
+            return
+        self._write({"type": "response", "key": key, "text": text, **meta})
+
+    def next_response(self, key: str) -> str:
+        """回放模式：按顺序取出 key 对应的下一条原始回复"""
+        queue = self._responses.get(key)
+        if not queue:
+            raise KeyError(f"归档中没有字段 '{key}' 的原始回复")
+        return queue.popleft()
+
+    @staticmethod
+    def read(path: Path) -> list[dict]:
+        """读取归档全部记录（进程中断导致的不完整尾部会被忽略）"""
+        records = []
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        break
+        except (EOFError, OSError, zlib.error):
+            pass
+        return records
+
+    @staticmethod
+    def latest_run(path: Path) -> tuple[dict | None, list[dict]]:
+        """返回最近一次运行的起始记录及其回复记录"""
+        header, responses = None, []
+        for record in RawResponseArchive.read(path):
+            if record.get("type") == "run":
+                header, responses = record, []
+            elif record.get("type") == "response":
+                responses.append(record)
+        return header, responses
+
+
+class ModelRouter:
+    """
+    按提取策略/字段把请求路由到不同的模型与端点
+
+    路由表可写在本体论的 model_routing 中，或通过环境变量 LLM_ROUTING_CONFIG
+    指向一个 JSON 文件（本体论中的配置优先）：
+
+    {
+      "routes": {
+        "fast":   {"model": "deepseek-chat", "base_url": "...", "api_key_env": "FAST_LLM_API_KEY",
+                   "fallbacks": ["default"]},
+        "strong": {"model": "deepseek-reasoner", "fallbacks": ["default"]}
+      },
+      "strategies": {"copy_exact": "fast", "classify_with_options": "fast",
+                     "cross_chunk_summarize": "strong"},
+      "fields": {"__split_plan__": "strong", "责任人员": "strong"}
+    }
+
+    "default" 路由始终存在，对应 MODEL / BASE_URL；字段路由优先于策略路由。
+    路由调用失败或熔断时按 fallbacks 依次尝试，最后回退到 default。
+    """
+
+    DEFAULT_ROUTE = "default"
+
+    def __init__(self, config: dict | None = None):
+        config = config or {}
+        self.routes = {self.DEFAULT_ROUTE: {"model": MODEL}}
+        self.routes.update(config.get("routes", {}))
+        self.strategy_routes = config.get("strategies", {})
+        self.field_routes = config.get("fields", {})
+        self._clients = {}
+        self._lock = threading.Lock()
+        self.stats: dict[str, dict] = {}
+        self.breakers: dict[str, CircuitBreaker] = {}
+
+    @classmethod
+    def from_ontology(cls, ontology: dict) -> "ModelRouter":
+        """从环境变量配置文件与本体论 model_routing 构建路由器"""
+        config = {"routes": {}, "strategies": {}, "fields": {}}
+        config_path = os.getenv("LLM_ROUTING_CONFIG")
+        sources = []
+        if config_path:
+            with open(config_path, encoding="utf-8") as f:
+                sources.append(json.load(f))
+        sources.append(ontology.get("model_routing", {}))
+        for source in sources:
+            for section in config:
+                config[section].update(source.get(section, {}))
+        return cls(config)
+
+    def resolve(self, key: str, strategy: str | None = None) -> list[str]:
+        """
+        解析请求应使用的路由链
+
+        Args:
+            key: 字段标识（"#" 之后的后缀会被忽略，如 "字段#reask"）
+            strategy: 提取策略
+
+        Returns:
+            [主路由, 备用路由..., "default"]
+        """
+        field = key.split("#", 1)[0]
+        primary = self.field_routes.get(field) or self.strategy_routes.get(strategy)
+        if primary not in self.routes:
+            primary = self.DEFAULT_ROUTE
+
+        chain = [primary]
+        for name in self.routes[primary].get("fallbacks", []):
+            if name in self.routes and name not in chain:
+                chain.append(name)
+        if self.DEFAULT_ROUTE not in chain:
+            chain.append(self.DEFAULT_ROUTE)
+        return chain
+
+    def client_for(self, route: str):
+        """获取路由对应的 OpenAI 客户端（default 路由使用模块级 client）"""
+        if route == self.DEFAULT_ROUTE:
+            return client
+        with self._lock:
+            if route not in self._clients:
+                cfg = self.routes[route]
+                api_key = (
+                    os.getenv(cfg["api_key_env"]) if "api_key_env" in cfg else None
+                )
+                self._clients[route] = OpenAI(
+                    api_key=api_key or API_KEY, base_url=cfg.get("base_url", BASE_URL)
                 )
+            return self._clients[route]
+
+    def model_for(self, route: str) -> str:
+        return self.routes[route].get("model", MODEL)
+
+    def breaker_for(self, route: str) -> CircuitBreaker:
+        """获取路由的熔断器"""
+        with self._lock:
+            if route not in self.breakers:
+                self.breakers[route] = CircuitBreaker(f"路由 '{route}'")
+            return self.breakers[route]
+
+    @staticmethod
+    def _empty_stats() -> dict:
+        return {
+            "calls": 0,
+            "errors": 0,
+            "latency_s": 0.0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+        }
+
+    def record(
+        self,
+        route: str,
+        memory_pool: MemoryPool,
+        latency: float,
+        usage=None,
+        error: bool = False,
+    ):
+        """累计路由的调用次数、错误数、耗时和 token 消耗（全局 + 当前文档）"""
+        doc_stats = memory_pool.get("route_stats")
+        with self._lock:
+            for stats in (
+                self.stats.setdefault(route, self._empty_stats()),
+                doc_stats.setdefault(route, self._empty_stats()),
+            ):
+                stats["calls"] += 1
+                stats["latency_s"] = round(stats["latency_s"] + latency, 3)
+                if error:
+                    stats["errors"] += 1
+                if usage is not None:
+                    stats["prompt_tokens"] += usage.prompt_tokens or 0
+                    stats["completion_tokens"] += usage.completion_tokens or 0
+
+
+class IncrementalJSONParser:
+    """
+    流式回复的增量 JSON 解析器
+
+    逐段喂入文本，每当顶层数组的一个元素（或顶层对象的一个键值对）完整闭合时立即
+    回调 on_item，使下游无需等待整个回复；顶层括号闭合后 done 为 True，调用方可以
+    提前终止生成。顶层结构之前的说明文字或 ```json 标记会被忽略。
+    """
+
+    def __init__(self, on_item=None):
+        self.on_item = on_item
+        self.done = False
+        self.items = 0
+        self._container = None  # "[" 或 "{"
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._member = []
+
+    def feed(self, text: str):
+        for ch in text:
+            if self.done:
+                return
+            self._feed_char(ch)
+
+    def _feed_char(self, ch: str):
+        if self._container is None:
+            if ch in "[{":
+                self._container = ch
+                self._depth = 1
+            return
+
+        if self._in_string:
+            self._member.append(ch)
+            if self._escaped:
+                self._escaped = False
+            elif ch == "\\":
+                self._escaped = True
+            elif ch == '"':
+                self._in_string = False
+            return
+
+        if ch == '"':
+            self._in_string = True
+        elif ch in "[{":
+            self._depth += 1
+        elif ch in "]}":
+            self._depth -= 1
+            if self._depth == 0:
+                self._emit()
+                self.done = True
+                return
+        elif ch == "," and self._depth == 1:
+            self._emit()
+            return
+        self._member.append(ch)
+
+    def _emit(self):
+        member = "".join(self._member).strip()
+        self._member = []
+        if not member:
+            return
+        try:
+            if self._container == "[":
+                item = json.loads(member)
+            else:
+                item = next(iter(json.loads("{" + member + "}").items()))
+        except (json.JSONDecodeError, StopIteration):
+            return
+        self.items += 1
+        if self.on_item is not None:
+            self.on_item(item)
 
-        with open(output_path, "w", encoding="utf-8") as f:
-            json.dump(serializable_memory, f, ensure_ascii=False, indent=2)
+
+class DryRunEstimator:
+    """
+    试运行估算：LLMGateway 不发送请求，只记录将要发送的 prompt 并估算消耗
+
+    - prompt tokens 按字符估算：中文字符约 CJK_TOKENS_PER_CHAR，其他字符约 OTHER_TOKENS_PER_CHAR
+    - completion tokens 取该字段历史消耗的中位数（_token_usage_stats.json），
+      没有历史时按 max_tokens 的 DEFAULT_COMPLETION_RATIO 估算
+    - 单次耗时按 LATENCY_BASE_S + completion tokens / OUTPUT_TOKENS_PER_S 估算
+    - 返回 replies 中预设的回复（如本地拆分方案），否则返回 STUB_REPLY，
+      使后续流程照常走完且不触发重问
+    - 指定 dump_path 时把每次请求的完整消息写入 JSONL，便于检查 prompt
+    """
+
+    CJK_TOKENS_PER_CHAR = 0.6
+    OTHER_TOKENS_PER_CHAR = 0.3
+    DEFAULT_COMPLETION_RATIO = 0.25
+    LATENCY_BASE_S = 1.0
+    OUTPUT_TOKENS_PER_S = 40.0
+    CJK_PATTERN = re.compile(r"[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]")
+    STUB_REPLY = "[]"
+
+    def __init__(self, dump_path: Path | None = None):
+        self.replies: dict[str, str] = {}
+        self.calls: list[dict] = []
+        self.dump_path = dump_path
+        self._dump = open(dump_path, "w", encoding="utf-8") if dump_path else None  # noqa: SIM115
+
+    @classmethod
+    def estimate_tokens(cls, text: str) -> int:
+        """按字符类别估算 token 数"""
+        cjk = len(cls.CJK_PATTERN.findall(text))
+        return math.ceil(
+            cjk * cls.CJK_TOKENS_PER_CHAR
+            + (len(text) - cjk) * cls.OTHER_TOKENS_PER_CHAR
+        )
+
+    def record(
+        self, messages: list[dict], key: str, strategy: str | None, max_tokens: int
+    ) -> str:
+        """记录一次将要发送的请求，返回代替 LLM 回复的文本"""
+        expected = token_budget.expected(key)
+        completion_tokens = (
+            expected
+            if expected is not None
+            else math.ceil(max_tokens * self.DEFAULT_COMPLETION_RATIO)
+        )
+        call = {
+            "key": key,
+            "strategy": strategy or key,
+            "max_tokens": max_tokens,
+            "prompt_tokens": sum(self.estimate_tokens(m["content"]) for m in messages),
+            "completion_tokens": completion_tokens,
+            "from_history": expected is not None,
+            "latency_s": self.LATENCY_BASE_S
+            + completion_tokens / self.OUTPUT_TOKENS_PER_S,
+        }
+        self.calls.append(call)
+        if self._dump is not None:
+            self._dump.write(
+                json.dumps({**call, "messages": messages}, ensure_ascii=False) + "\n"
+            )
+        return self.replies.get(key, self.STUB_REPLY)
+
+    def close(self):
+        if self._dump is not None:
+            self._dump.close()
+            self._dump = None
+
+    def summary(self) -> dict:
+        """单篇文档的估算结果"""
+        by_strategy = {}
+        for call in self.calls:
+            stats = by_strategy.setdefault(
+                call["strategy"],
+                {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0},
+            )
+            stats["calls"] += 1
+            stats["prompt_tokens"] += call["prompt_tokens"]
+            stats["completion_tokens"] += call["completion_tokens"]
+        return {
+            "calls": len(self.calls),
+            "prompt_tokens": sum(c["prompt_tokens"] for c in self.calls),
+            "completion_tokens": sum(c["completion_tokens"] for c in self.calls),
+            "completion_from_history": sum(1 for c in self.calls if c["from_history"]),
+            "latency_s": round(sum(c["latency_s"] for c in self.calls), 1),
+            "by_strategy": by_strategy,
+        }
+
+    @staticmethod
+    def aggregate(estimates: list[dict], concurrency: int = 1) -> dict:
+        """
+        汇总多篇文档的估算
+
+        同一文档内的请求顺序执行，文档之间按 concurrency 并发，
+        预计总耗时取 总耗时 / 并发数 与单篇最长耗时中的较大者。
+        """
+        by_strategy = {}
+        for estimate in estimates:
+            for strategy, stats in estimate["by_strategy"].items():
+                total = by_strategy.setdefault(
+                    strategy, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+                )
+                for field, value in stats.items():
+                    total[field] += value
+        latencies = [e["latency_s"] for e in estimates] or [0.0]
+        return {
+            "documents": len(estimates),
+            "calls": sum(e["calls"] for e in estimates),
+            "prompt_tokens": sum(e["prompt_tokens"] for e in estimates),
+            "completion_tokens": sum(e["completion_tokens"] for e in estimates),
+            "concurrency": concurrency,
+            "wall_time_s": round(
+                max(sum(latencies) / max(concurrency, 1), max(latencies)), 1
+            ),
+            "by_strategy": by_strategy,
+        }
+
+
+class LLMGateway:
+    """
+    LLM 统一调用入口
+
+    - 按字段从 TokenBudgetService 获取 max_tokens
+    - finish_reason == "length" 时以更大预算重试一次
+    - 在记忆池 llm_usage 中记录每次调用的预算、消耗与耗时
+    - 原始回复写入 RawResponseArchive；回放模式下直接返回归档内容，不调用 LLM
+    - 试运行时交给 DryRunEstimator 记录 prompt 并估算消耗，不调用 LLM
+    - 通过 ModelRouter 按策略/字段选择模型，失败时依次尝试备用路由
+    - 传入 on_item 且开启 LLM_STREAMING 时以流式请求，并增量解析 JSON
+    - 非流式请求经 RequestHedger 执行，超过耗时分位数时发起对冲请求
+    """
+
+    @staticmethod
+    def chat(
+        messages: list[dict],
+        key: str,
+        memory_pool: MemoryPool,
+        default_max_tokens: int = 2000,
+        temperature: float = 0.0,
+        strategy: str | None = None,
+        on_item=None,
+        **kwargs,
+    ) -> str:
+        """
+        发送对话请求并返回回复文本
+
+        Args:
+            messages: 对话消息
+            key: 字段标识（用于预算学习、路由和统计）
+            memory_pool: 记忆池
+            default_max_tokens: 没有足够历史数据时使用的 max_tokens
+            temperature: 采样温度
+            strategy: 提取策略（用于模型路由）
+            on_item: 回复为 JSON 时，每个顶层元素/键值对解析完成后的回调
+            **kwargs: 透传给 chat.completions.create 的其他参数
+
+        Returns:
+            回复文本
+        """
+        archive = memory_pool.raw_archive
+        if archive is not None and archive.replay:
+            text = archive.next_response(key)
+            if on_item is not None:
+                IncrementalJSONParser(on_item).feed(text)
+            return text
+
+        router = memory_pool.model_router or ModelRouter()
+        max_tokens = token_budget.budget_for(key, default_max_tokens)
+        if memory_pool.dry_run is not None:
+            return memory_pool.dry_run.record(messages, key, strategy, max_tokens)
+        retried = False
+        routes = router.resolve(key, strategy)
+        route_index = 0
+        use_stream = STREAMING and on_item is not None
+        request_started = time.monotonic()
+
+        while True:
+            route = routes[route_index]
+            breaker = router.breaker_for(route)
+            if not breaker.allow():
+                # 路由熔断中：不等待超时，直接尝试下一个路由
+                if route_index + 1 >= len(routes):
+                    raise CircuitOpenError(f"LLM 路由 '{route}' 熔断中")
+                route_index += 1
+                continue
+            started = time.monotonic()
+            request = {
+                "model": router.model_for(route),
+                "messages": messages,
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+                **kwargs,
+            }
+            try:
+                if use_stream:
+                    text, finish_reason, usage = LLMGateway._stream_completion(
+                        router.client_for(route), request, key, memory_pool, on_item
+                    )
+                else:
+                    response = request_hedger.call(
+                        route,
+                        lambda route=route, request=request: router.client_for(
+                            route
+                        ).chat.completions.create(**request),
+                    )
+                    choice = response.choices[0]
+                    text = choice.message.content or ""
+                    finish_reason = choice.finish_reason
+                    usage = response.usage
+            except Exception as e:
+                breaker.record(False, time.monotonic() - started)
+                router.record(
+                    route, memory_pool, time.monotonic() - started, error=True
+                )
+                if route_index + 1 >= len(routes):
+                    raise
+                route_index += 1
+                memory_pool.log(
+                    f"    路由 '{route}' 调用失败 ({e})，改用 '{routes[route_index]}'",
+                    level="warning",
+                )
+                continue
+            breaker.record(True, time.monotonic() - started)
+            router.record(route, memory_pool, time.monotonic() - started, usage)
+            completion_tokens = usage.completion_tokens if usage else None
+            usage_estimated = getattr(usage, "estimated", False)
+
+            if finish_reason == "length" and not retried:
+                new_budget = token_budget.retry_budget(max_tokens, default_max_tokens)
+                memory_pool.log(
+                    f"    输出被截断 (max_tokens={max_tokens})，以 {new_budget} 重试",
+                    level="warning",
+                )
+                max_tokens = new_budget
+                retried = True
+                continue
+            break
+
+        # 只记录未截断的完整输出，避免截断值拉低预算
+        if completion_tokens is not None and finish_reason != "length":
+            token_budget.record(key, completion_tokens)
+
+        usage = {
+            "route": route,
+            "max_tokens": max_tokens,
+            "completion_tokens": completion_tokens,
+            "usage_estimated": usage_estimated,
+            "finish_reason": finish_reason,
+            "retried": retried,
+            "latency_s": round(time.monotonic() - request_started, 3),
+        }
+        memory_pool.get("llm_usage")[key] = usage
+        if memory_pool.trace is not None:
+            memory_pool.trace.write(
+                "llm",
+                flush=True,
+                t=round(time.monotonic() - memory_pool._started, 3),
+                key=key,
+                **usage,
+            )
+
+        if archive is not None:
+            archive.append(
+                key,
+                text,
+                route=route,
+                model=router.model_for(route),
+                finish_reason=finish_reason,
+            )
+        return text
+
+    @staticmethod
+    def _stream_completion(
+        route_client, request: dict, key: str, memory_pool: MemoryPool, on_item
+    ) -> tuple[str, str | None, Any]:
+        """
+        流式请求：边接收边增量解析，顶层 JSON 闭合后立即关闭流、停止生成
+
+        提前关闭时收不到 include_usage 附带在最后一个 chunk 中的 usage，
+        改按已发送的消息与已接收的文本估算，并标记 estimated=True
+
+        Returns:
+            (回复文本, finish_reason, usage)
+        """
+        started = time.monotonic()
+        timing = {"first_token_s": None, "first_item_s": None}
+
+        def handle_item(item):
+            if timing["first_item_s"] is None:
+                timing["first_item_s"] = round(time.monotonic() - started, 3)
+            on_item(item)
+
+        parser = IncrementalJSONParser(handle_item)
+        parts = []
+        finish_reason = None
+        usage = None
+        cut_off = False
+        stream = route_client.chat.completions.create(
+            stream=True, stream_options={"include_usage": True}, **request
+        )
+        try:
+            for chunk in stream:
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                delta = choice.delta.content or ""
+                if delta:
+                    if timing["first_token_s"] is None:
+                        timing["first_token_s"] = round(time.monotonic() - started, 3)
+                    parts.append(delta)
+                    parser.feed(delta)
+                if choice.finish_reason:
+                    finish_reason = choice.finish_reason
+                if parser.done and not finish_reason:
+                    # 顶层 JSON 已闭合，后续只可能是解释文字，提前结束生成
+                    finish_reason = "stop"
+                    cut_off = True
+                    break
+        finally:
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+
+        text = "".join(parts)
+        if usage is None:
+            usage = SimpleNamespace(
+                prompt_tokens=sum(
+                    DryRunEstimator.estimate_tokens(m["content"])
+                    for m in request["messages"]
+                ),
+                completion_tokens=DryRunEstimator.estimate_tokens(text),
+                estimated=True,
+            )
+
+        memory_pool.get("stream_timing")[key] = {
+            **timing,
+            "total_s": round(time.monotonic() - started, 3),
+            "items": parser.items,
+            "cut_off": cut_off,
+        }
+        return text, finish_reason, usage
+
+
+class JSONResponseParser:
+    """
+    LLM 回复的 JSON 解析与本地修复
+
+    解析顺序：
+    1. 直接 json.loads
+    2. 提取 ```json 代码块
+    3. 正则截取首尾括号之间的内容
+    4. 本地修复（去除尾逗号、转义字符串内的裸引号/换行、补齐未闭合的括号）
+    """
+
+    CODE_BLOCK_PATTERN = re.compile(r"```(?:json)?\s*\n?(.*?)\n?```", re.DOTALL)
+    BRACKET_PATTERNS = {
+        "array": re.compile(r"\[.*\]", re.DOTALL),
+        "object": re.compile(r"\{.*\}", re.DOTALL),
+        None: re.compile(r"[\[\{].*[\]\}]", re.DOTALL),
+    }
+    TRAILING_COMMA_PATTERN = re.compile(r",\s*([\]}])")
+    CLOSERS = {"[": "]", "{": "}"}
+
+    @staticmethod
+    def parse(text: str, expect: str | None = None) -> Any:
+        """
+        按原有的三级回退解析 JSON
+
+        Args:
+            text: LLM 回复文本
+            expect: "array" / "object" / None，决定正则截取的括号类型
+
+        Returns:
+            解析结果
+
+        Raises:
+            ValueError: 全部方式解析失败
+        """
+        candidates = [text]
+        code_block_match = JSONResponseParser.CODE_BLOCK_PATTERN.search(text)
+        if code_block_match:
+            candidates.append(code_block_match.group(1))
+        pattern = JSONResponseParser.BRACKET_PATTERNS.get(
+            expect, JSONResponseParser.BRACKET_PATTERNS[None]
+        )
+        json_match = pattern.search(text)
+        if json_match:
+            candidates.append(json_match.group())
+
+        for candidate in candidates:
+            try:
+                return json.loads(candidate)
+            except json.JSONDecodeError:
+                continue
+        raise ValueError("无法解析 JSON")
+
+    @staticmethod
+    def repair(text: str) -> str:
+        """
+        本地修复常见的 JSON 格式错误
+
+        Args:
+            text: 原始文本
+
+        Returns:
+            修复后的文本（不保证一定合法）
+        """
+        code_block_match = JSONResponseParser.CODE_BLOCK_PATTERN.search(text)
+        if code_block_match:
+            text = code_block_match.group(1)
+        starts = [i for i in (text.find("["), text.find("{")) if i >= 0]
+        if starts:
+            text = text[min(starts) :]
+        text = text.strip()
+
+        out = []
+        stack = []
+        in_string = False
+        escaped = False
+        length = len(text)
+        for i, ch in enumerate(text):
+            if in_string:
+                if escaped:
+                    escaped = False
+                    out.append(ch)
+                elif ch == "\\":
+                    escaped = True
+                    out.append(ch)
+                elif ch == '"':
+                    # 后面紧跟结构符号才视为字符串结束，否则是未转义的内部引号
+                    j = i + 1
+                    while j < length and text[j] in " \t\r\n":
+                        j += 1
+                    if j >= length or text[j] in ",:}]":
+                        in_string = False
+                        out.append(ch)
+                    else:
+                        out.append('\\"')
+                elif ch == "\n":
+                    out.append("\\n")
+                elif ch == "\r":
+                    continue
+                else:
+                    out.append(ch)
+                continue
+
+            if ch == '"':
+                in_string = True
+            elif ch in "[{":
+                stack.append(ch)
+            elif ch in "]}":
+                if stack and JSONResponseParser.CLOSERS[stack[-1]] == ch:
+                    stack.pop()
+                else:
+                    continue  # 多余的闭合括号
+            out.append(ch)
+            if not stack and ch in "]}":
+                break  # 顶层结构已闭合，忽略其后的解释文字
+
+        if in_string:
+            if escaped:
+                out.pop()
+            out.append('"')
+        repaired = "".join(out).rstrip()
+        repaired = repaired.rstrip(",:")
+        repaired += "".join(JSONResponseParser.CLOSERS[b] for b in reversed(stack))
+        return JSONResponseParser.TRAILING_COMMA_PATTERN.sub(r"\1", repaired)
+
+    @staticmethod
+    def parse_with_repair(
+        text: str, memory_pool: MemoryPool, expect: str | None = None
+    ) -> tuple[Any, bool]:
+        """
+        解析 JSON，失败时尝试本地修复，并更新记忆池中的 parse_stats 计数
+
+        Args:
+            text: LLM 回复文本
+            memory_pool: 记忆池
+            expect: "array" / "object" / None
+
+        Returns:
+            (解析结果, 是否成功)
+        """
+        try:
+            return JSONResponseParser.parse(text, expect), True
+        except ValueError:
+            pass
+
+        stats = memory_pool.get("parse_stats")
+        stats["parse_failures"] += 1
+        try:
+            result = json.loads(JSONResponseParser.repair(text))
+        except json.JSONDecodeError:
+            return None, False
+
+        stats["local_repairs"] += 1
+        memory_pool.log("    JSON 本地修复成功", level="debug")
+        return result, True
+
+
+class ClassificationCoalescer:
+    """
+    跨文档的分类请求合并队列
+
+    批量并发处理时，每个文档都会单独发起「事故等级」「事故性质」等极小的分类请求。
+    合并队列在 WINDOW_S 时间窗内收集各文档线程提交的请求，合并为一个带编号的多项
+    prompt 一次发送，再把各项答案分发回原线程。批量答案缺失或不在选项内的项返回
+    None，由提交方退回单项请求。
+
+    不启动后台线程：开启批次的提交者担任该批次的发送方，只发送自己开启的批次，
+    其余提交者等待结果。批次在窗口期结束或满 MAX_BATCH 项时关闭，之后的提交者
+    开启新批次，因此发送方不会被其他批次占用。
+    """
+
+    BATCH_KEY = "__classify_batch__"
+    WINDOW_S = 0.2
+    MAX_BATCH = 16
+    CONTENT_LIMIT = 3000
+
+    def __init__(self, window_s: float = WINDOW_S, max_batch: int = MAX_BATCH):
+        self.window_s = window_s
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._open_batch = None
+        self.stats = {"batches": 0, "items": 0, "fallbacks": 0}
+
+    def submit(
+        self, content: str, field_name: str, options: list[str], memory_pool: MemoryPool
+    ) -> str | None:
+        """
+        提交一个分类请求并阻塞到结果返回
+
+        Returns:
+            选中的选项；批量答案无效时返回 None
+        """
+        item = {
+            "content": content,
+            "field_name": field_name,
+            "options": options,
+            "memory_pool": memory_pool,
+            "done": threading.Event(),
+            "result": None,
+        }
+        with self._lock:
+            batch = self._open_batch
+            is_leader = batch is None
+            if is_leader:
+                batch = self._open_batch = {"items": [], "full": threading.Event()}
+            batch["items"].append(item)
+            if len(batch["items"]) >= self.max_batch:
+                self._open_batch = None
+                batch["full"].set()
+
+        if is_leader:
+            self._send(batch)
+        item["done"].wait()
+        return item["result"]
+
+    def _send(self, batch: dict):
+        """发送方：等待窗口期结束（或批次满员）后关闭并发送自己开启的批次"""
+        batch["full"].wait(self.window_s)
+        with self._lock:
+            if self._open_batch is batch:
+                self._open_batch = None
+        items = batch["items"]
+        try:
+            self._dispatch(items)
+        except Exception as e:
+            items[0]["memory_pool"].log(f"    合并分类请求失败 - {e}", level="warning")
+            with self._lock:
+                self.stats["fallbacks"] += len(items)
+        finally:
+            for item in items:
+                item["done"].set()
+
+    def _dispatch(self, batch: list[dict]):
+        """发送一个合并请求并把答案写回各项"""
+        if len(batch) == 1:
+            return  # 窗口内只有一项，直接由提交方单独请求
+        with self._lock:
+            self.stats["batches"] += 1
+            self.stats["items"] += len(batch)
+
+        lines = []
+        for i, item in enumerate(batch, 1):
+            lines.append(
+                f"【第{i}项】字段：{item['field_name']}\n"
+                f"预定义选项：{', '.join(item['options'])}\n"
+                f"文本内容：\n{item['content'][: self.CONTENT_LIMIT]}"
+            )
+        prompt = (
+            "以下是若干条相互独立的分类任务。对每一项，从该项的预定义选项中选择最匹配的一项；"
+            "文本中没有明确说明时，根据描述推断最合理的选项。\n\n"
+            + "\n\n".join(lines)
+            + '\n\n请返回一个JSON对象，键为项目编号，值为选中的选项本身，例如 {"1": "一般事故", "2": "责任事故"}。'
+        )
+
+        # 合并请求不属于任何单个文档，用临时记忆池承载调用记录
+        batch_pool = MemoryPool()
+        batch_pool.model_router = batch[0]["memory_pool"].model_router
+        reply = LLMGateway.chat(
+            messages=[
+                {
+                    "role": "system",
+                    "content": "你是专业的信息提取助手。只返回JSON对象，不要添加解释。",
+                },
+                {"role": "user", "content": prompt},
+            ],
+            key=self.BATCH_KEY,
+            memory_pool=batch_pool,
+            default_max_tokens=20 * len(batch) + 20,
+            strategy="classify_with_options",
+            response_format={"type": "json_object"},
+        )
+        answers, ok = JSONResponseParser.parse_with_repair(
+            reply, batch_pool, expect="object"
+        )
+        if not ok or not isinstance(answers, dict):
+            answers = {}
+
+        for i, item in enumerate(batch, 1):
+            answer = answers.get(str(i))
+            if isinstance(answer, str):
+                item["result"] = InformationExtractor._match_option(
+                    answer, item["options"]
+                )
+            if item["result"] is None:
+                with self._lock:
+                    self.stats["fallbacks"] += 1
 
 
 # ═══════════════════════════════════════════════════════════════════════════
@@ -259,10 +1895,21 @@ class HeaderExtractor:
     """
     标题提取器：从 Markdown 文件中提取标题层级结构
 
+    单次线性扫描源文本，只访问标题行、代码围栏行与 <table> 标签；代码围栏
+    （``` / ~~~）与 HTML 表格内以 # 开头的行不视为标题。
+
     输入: Markdown 文件内容
-    输出: [{level: 1, title: "...", content: "...", start_line: 0, end_line: 10}, ...]
+    输出: [{level: 1, title: "...", content: TextView, start_line: 0, end_line: 10,
+            char_start: 0, char_end: 120}, ...]
     """
 
+    # 行首（允许空白）的标题或代码围栏，以及任意位置的表格起止标签
+    SCAN_PATTERN = re.compile(
+        r"^[^\S\n]*(?:(?P<fence>```|~~~)|(?P<hashes>#+)(?P<title>[^\n]*))"
+        r"|(?P<table_open><table\b)|(?P<table_close></table>)",
+        re.MULTILINE | re.IGNORECASE,
+    )
+
     @staticmethod
     def extract(md_content: str, memory_pool: MemoryPool) -> list[dict]:
         """
@@ -277,20 +1924,49 @@ class HeaderExtractor:
         """
         memory_pool.log("HeaderExtractor: 开始提取标题层级")
 
-        lines = md_content.split("\n")
-        headers = []
-        current_header = None
-        first_header_line = None  # 记录第一个标题的行号
-
-        # 先找到第一个标题的位置
-        for i, line in enumerate(lines):
-            if line.strip().startswith("#"):
-                first_header_line = i
-                break
+        # 标题内容以源文本区间视图保存，不复制文本
+        source = SourceDocument(md_content)
+        count_newlines = md_content.count
+
+        # (行号, 行首偏移, 层级, 标题)
+        found = []
+        fence = None  # 当前所在代码围栏的标记
+        table_depth = 0
+        line_no = 0
+        last_pos = 0
+
+        for match in HeaderExtractor.SCAN_PATTERN.finditer(md_content):
+            kind = match.lastgroup  # "fence" / "title" / "table_open" / "table_close"
+            if kind == "fence":
+                marker = match.group("fence")
+                if fence is None:
+                    fence = marker
+                elif fence == marker:
+                    fence = None
+            elif fence is not None:
+                continue
+            elif kind == "table_open":
+                table_depth += 1
+            elif kind == "table_close":
+                table_depth = max(table_depth - 1, 0)
+            elif table_depth == 0:
+                pos = match.start()
+                line_no += count_newlines("\n", last_pos, pos)
+                last_pos = pos
+                found.append(
+                    (
+                        line_no,
+                        pos,
+                        len(match.group("hashes")),
+                        match.group("title").strip(),
+                    )
+                )
 
+        headers = []
         # 如果第一个标题之前有内容，创建一个虚拟的"文档开头"标题
-        if first_header_line is not None and first_header_line > 0:
-            preamble_content = "\n".join(lines[0:first_header_line]).strip()
+        if found and found[0][0] > 0:
+            first_pos = found[0][1]
+            preamble_content = source.view(0, first_pos - 1, strip=True)
             if preamble_content:  # 只有非空内容才添加
                 headers.append(
                     {
@@ -298,7 +1974,9 @@ class HeaderExtractor:
                         "level": 0,
                         "title": "文档开头（基本信息）",
                         "start_line": 0,
-                        "end_line": first_header_line - 1,
+                        "end_line": found[0][0] - 1,
+                        "char_start": 0,
+                        "char_end": first_pos - 1,
                         "content": preamble_content,
                     }
                 )
@@ -306,44 +1984,152 @@ class HeaderExtractor:
                     "HeaderExtractor: 检测到文档开头有基本信息（不在标题层级下）"
                 )
 
-        for i, line in enumerate(lines):
-            line_stripped = line.strip()
+        total_lines = count_newlines("\n") + 1
+        for i, (start_line, pos, level, title) in enumerate(found):
+            if i + 1 < len(found):
+                end_line = found[i + 1][0] - 1
+                end = found[i + 1][1] - 1  # 不含下一标题前的换行符
+            else:
+                end_line = total_lines - 1
+                end = len(md_content)
+            headers.append(
+                {
+                    "index": len(headers),
+                    "level": level,
+                    "title": title,
+                    "start_line": start_line,
+                    "end_line": end_line,
+                    "char_start": pos,
+                    "char_end": end,
+                    "content": source.view(pos, end, strip=True),
+                }
+            )
+
+        memory_pool.log(f"HeaderExtractor: 提取到 {len(headers)} 个标题")
+        memory_pool.set("headers", headers)
+
+        return headers
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#                CategoryPresenceDetector (类别存在性检测器)
+# ═══════════════════════════════════════════════════════════════════════════
+
+
+class CategoryPresenceDetector:
+    """
+    类别存在性检测器：在调用 LLM 之前，廉价地判断文档是否包含某个本体论类别
+
+    判定依据（任一命中即视为存在）：
+    1. 标题命中: 类别名称/关键词/presence_terms 出现在某个标题中
+    2. 正文命中: 同上检测词出现在文档正文中
+
+    全部未命中的类别视为"缺失"，InformationExtractor 会直接写入默认空值，
+    不再为该类别的任何字段调用 LLM。
+
+    不参与检测（始终视为存在）的类别：
+    - 本体论中配置 always_extract: true 的类别
+    - 含有 cross_chunk_summarize 等综合推断策略字段的类别（原文中通常没有字面标签）
+
+    本体论中可按类别配置 presence_terms 作为额外的检测词（如 "勘察单位" 的同义说法）。
+    """
+
+    # 关键词前的编号，如 "10." "10.1" "（一）"
+    NUMBERING_PATTERN = re.compile(
+        r"^\s*(?:\d+(?:\.\d+)*\.?|[（(][一二三四五六七八九十\d]+[)）])\s*"
+    )
+    # 用于把 "设备租赁（安拆）单位" 拆分为多个检测词
+    TERM_SPLIT_PATTERN = re.compile(r"[（）()、，,；;：:/\s]+")
+    MIN_TERM_LENGTH = 2
+    # 拆分后过于宽泛、几乎必然命中的词
+    GENERIC_TERMS = {"单位", "情况", "机构", "名称"}
+    # 需要综合全文推断的策略，字面检测不可靠，这类类别不做跳过
+    EXEMPT_STRATEGIES = {"cross_chunk_summarize"}
+
+    @staticmethod
+    def _terms_for_category(category_name: str, category_def: dict) -> list[str]:
+        """
+        生成类别的检测词列表
+
+        Args:
+            category_name: 类别名称
+            category_def: 类别定义
+
+        Returns:
+            去重后的检测词列表（长词在前）
+        """
+        raw_terms = [category_name]
+        raw_terms.extend(category_def.get("keywords", []))
+
+        terms = set(category_def.get("presence_terms", []))
+        for raw in raw_terms:
+            stripped = CategoryPresenceDetector.NUMBERING_PATTERN.sub("", raw).strip()
+            terms.add(stripped)
+            terms.update(CategoryPresenceDetector.TERM_SPLIT_PATTERN.split(stripped))
+
+        terms = {
+            t
+            for t in terms
+            if len(t) >= CategoryPresenceDetector.MIN_TERM_LENGTH
+            and t not in CategoryPresenceDetector.GENERIC_TERMS
+        }
+        return sorted(terms, key=len, reverse=True)
+
+    @staticmethod
+    def detect(md_content: str, memory_pool: MemoryPool) -> dict:
+        """
+        检测各本体论类别是否在文档中出现
+
+        Args:
+            md_content: Markdown 文件内容
+            memory_pool: 记忆池
 
-            # 检查是否是标题行
-            if line_stripped.startswith("#"):
-                # 保存上一个标题
-                if current_header:
-                    current_header["end_line"] = i - 1
-                    current_header["content"] = "\n".join(
-                        lines[current_header["start_line"] : i]
-                    ).strip()
-                    headers.append(current_header)
+        Returns:
+            {类别名称: {"present": bool, "source": "header"/"content"/"config"/None,
+                        "matched_term": str|None}}
+        """
+        memory_pool.log("CategoryPresenceDetector: 开始检测类别存在性")
 
-                # 创建新标题
-                level = len(line_stripped) - len(line_stripped.lstrip("#"))
-                title = line_stripped.lstrip("#").strip()
+        headers = memory_pool.get("headers") or []
+        ontology = memory_pool.get("ontology")
+        header_titles = "\n".join(h["title"] for h in headers)
 
-                current_header = {
-                    "index": len(headers),
-                    "level": level,
-                    "title": title,
-                    "start_line": i,
-                    "end_line": None,
-                    "content": "",
-                }
+        presence = {}
+        for category_name, category_def in ontology["ontology_structure"].items():
+            decision = {"present": False, "source": None, "matched_term": None}
 
-        # 保存最后一个标题
-        if current_header:
-            current_header["end_line"] = len(lines) - 1
-            current_header["content"] = "\n".join(
-                lines[current_header["start_line"] :]
-            ).strip()
-            headers.append(current_header)
+            exempt = category_def.get("always_extract") or any(
+                field_def.get("extraction_strategy")
+                in CategoryPresenceDetector.EXEMPT_STRATEGIES
+                for field_def in category_def.get("fields", {}).values()
+            )
+            if exempt:
+                decision.update(present=True, source="config")
+                presence[category_name] = decision
+                continue
 
-        memory_pool.log(f"HeaderExtractor: 提取到 {len(headers)} 个标题")
-        memory_pool.set("headers", headers)
+            terms = CategoryPresenceDetector._terms_for_category(
+                category_name, category_def
+            )
+            for source, haystack in (
+                ("header", header_titles),
+                ("content", md_content),
+            ):
+                matched = next((t for t in terms if t in haystack), None)
+                if matched:
+                    decision.update(present=True, source=source, matched_term=matched)
+                    break
+
+            presence[category_name] = decision
+
+        absent = [name for name, d in presence.items() if not d["present"]]
+        memory_pool.log(
+            f"CategoryPresenceDetector: {len(presence) - len(absent)} 个类别存在, "
+            f"{len(absent)} 个类别缺失" + (f" ({', '.join(absent)})" if absent else "")
+        )
+        memory_pool.set("category_presence", presence)
 
-        return headers
+        return presence
 
 
 # ═══════════════════════════════════════════════════════════════════════════
@@ -360,12 +2146,14 @@ class SplitPlanner:
     """
 
     @staticmethod
-    def plan(memory_pool: MemoryPool) -> dict:
+    def plan(memory_pool: MemoryPool, on_chunk=None) -> dict:
         """
         生成拆分方案
 
         Args:
             memory_pool: 记忆池
+            on_chunk: 流式模式下每个 chunk 规划完成时的回调 (chunk_id, chunk_info)，
+                调用方可以据此提前合并该 chunk，无需等待整个方案
 
         Returns:
             拆分方案
@@ -436,9 +2224,25 @@ class SplitPlanner:
 **重要：只返回JSON，不要有其他解释文字。**
 """
 
+        def on_item(item):
+            # 流式模式下每个 chunk 规划完成即交给调用方，无需等待整个方案
+            chunk_name, chunk_def = item
+            if not isinstance(chunk_def, dict):
+                return
+            memory_pool.log(
+                f"  规划: {chunk_name} -> {chunk_def.get('ontology_category')} "
+                f"(标题 {chunk_def.get('header_indices')})",
+                level="debug",
+            )
+            if (
+                on_chunk is not None
+                and "ontology_category" in chunk_def
+                and isinstance(chunk_def.get("header_indices"), list)
+            ):
+                on_chunk(chunk_name, chunk_def)
+
         try:
-            response = client.chat.completions.create(
-                model=MODEL,
+            content_str = LLMGateway.chat(
                 messages=[
                     {
                         "role": "system",
@@ -446,28 +2250,19 @@ class SplitPlanner:
                     },
                     {"role": "user", "content": prompt},
                 ],
+                key="__split_plan__",
+                memory_pool=memory_pool,
+                default_max_tokens=2000,
                 temperature=0.1,
-                max_tokens=2000,
+                on_item=on_item,
             )
 
-            content_str = response.choices[0].message.content
-
             # 解析 JSON
-            try:
-                split_plan = json.loads(content_str)
-            except json.JSONDecodeError:
-                # 尝试提取 JSON 部分
-                code_block_match = re.search(
-                    r"```(?:json)?\s*\n?(.*?)\n?```", content_str, re.DOTALL
-                )
-                if code_block_match:
-                    split_plan = json.loads(code_block_match.group(1))
-                else:
-                    json_match = re.search(r"\{.*\}", content_str, re.DOTALL)
-                    if json_match:
-                        split_plan = json.loads(json_match.group())
-                    else:
-                        raise ValueError("无法解析 LLM 返回的拆分方案")
+            split_plan, ok = JSONResponseParser.parse_with_repair(
+                content_str, memory_pool, expect="object"
+            )
+            if not ok:
+                raise ValueError("无法解析 LLM 返回的拆分方案")
 
             memory_pool.log(f"SplitPlanner: 生成了 {len(split_plan)} 个拆分chunk")
             memory_pool.set("split_plan", split_plan)
@@ -475,9 +2270,54 @@ class SplitPlanner:
             return split_plan
 
         except Exception as e:
-            memory_pool.log(f"SplitPlanner: 错误 - {e}")
+            memory_pool.log(f"SplitPlanner: 错误 - {e}", level="error")
             raise
 
+    @staticmethod
+    def local_plan(headers: list[dict], ontology: dict) -> dict:
+        """
+        不调用 LLM 的本地拆分方案（用于试运行估算）
+
+        标题包含类别检测词时归入该类别，否则跟随上一个标题的类别；
+        没有匹配到任何标题的类别按整篇文档估算，结果偏保守。
+
+        Args:
+            headers: 标题列表
+            ontology: 本体论
+
+        Returns:
+            与 plan 格式相同的拆分方案
+        """
+        categories = ontology["ontology_structure"]
+        terms = {
+            name: CategoryPresenceDetector._terms_for_category(name, info)
+            for name, info in categories.items()
+        }
+        assigned = {name: [] for name in categories}
+        current = None
+        for h in headers:
+            scores = {
+                name: sum(1 for term in category_terms if term in h["title"])
+                for name, category_terms in terms.items()
+            }
+            best = max(scores, key=scores.get, default=None)
+            if best is not None and scores[best] > 0:
+                current = best
+            if current is not None:
+                assigned[current].append(h["index"])
+
+        all_indices = [h["index"] for h in headers]
+        return {
+            f"chunk_{name}": {
+                "ontology_category": name,
+                "header_indices": indices or all_indices,
+                "reason": "本地检测词匹配"
+                if indices
+                else "未匹配到标题，按整篇文档估算",
+            }
+            for name, indices in assigned.items()
+        }
+
 
 # ═══════════════════════════════════════════════════════════════════════════
 #                   3️⃣ DocumentSplitter (文档拆分器)
@@ -493,12 +2333,40 @@ class DocumentSplitter:
     """
 
     @staticmethod
-    def split(memory_pool: MemoryPool) -> list[dict]:
+    def build_chunk(chunk_id: str, chunk_info: dict, headers: list[dict]) -> dict:
+        """按拆分方案中的一项合并标题内容，生成文档块"""
+        content_parts = []
+        headers_included = []
+
+        for idx in chunk_info["header_indices"]:
+            if isinstance(idx, int) and 0 <= idx < len(headers):
+                header = headers[idx]
+                content_parts.append(header["content"])
+                headers_included.append(
+                    {
+                        "index": header["index"],
+                        "level": header["level"],
+                        "title": header["title"],
+                    }
+                )
+
+        return {
+            "chunk_id": chunk_id,
+            "ontology_category": chunk_info["ontology_category"],
+            "content": ChunkView(content_parts),  # 惰性拼接，使用时再生成字符串
+            "headers_included": headers_included,
+            "char_count": sum(len(part) for part in content_parts),
+        }
+
+    @staticmethod
+    def split(memory_pool: MemoryPool, prebuilt: dict | None = None) -> list[dict]:
         """
         执行文档拆分
 
         Args:
             memory_pool: 记忆池
+            prebuilt: 流式规划期间已合并的文档块 {chunk_id: (chunk_info, chunk)}，
+                与最终方案一致的项直接复用
 
         Returns:
             文档块列表
@@ -507,40 +2375,19 @@ class DocumentSplitter:
 
         split_plan = memory_pool.get("split_plan")
         headers = memory_pool.get("headers")
+        prebuilt = prebuilt or {}
 
         chunks = []
 
         for chunk_id, chunk_info in split_plan.items():
-            ontology_category = chunk_info["ontology_category"]
-            header_indices = chunk_info["header_indices"]
-
-            # 合并指定索引的标题内容
-            content_parts = []
-            headers_included = []
-
-            for idx in header_indices:
-                if 0 <= idx < len(headers):
-                    header = headers[idx]
-                    content_parts.append(header["content"])
-                    headers_included.append(
-                        {
-                            "index": header["index"],
-                            "level": header["level"],
-                            "title": header["title"],
-                        }
-                    )
-
-            chunk = {
-                "chunk_id": chunk_id,
-                "ontology_category": ontology_category,
-                "content": "\n\n".join(content_parts),
-                "headers_included": headers_included,
-                "char_count": sum(len(part) for part in content_parts),
-            }
+            streamed_info, chunk = prebuilt.get(chunk_id, (None, None))
+            if streamed_info != chunk_info:
+                # 未流式合并，或最终方案经修复后与流式结果不同
+                chunk = DocumentSplitter.build_chunk(chunk_id, chunk_info, headers)
 
             chunks.append(chunk)
             memory_pool.log(
-                f"DocumentSplitter: 创建chunk '{chunk_id}' (类别: {ontology_category}, {chunk['char_count']} 字符)"
+                f"DocumentSplitter: 创建chunk '{chunk_id}' (类别: {chunk['ontology_category']}, {chunk['char_count']} 字符)"
             )
 
         memory_pool.set("chunks", chunks)
@@ -586,7 +2433,9 @@ class InformationExtractor:
         Returns:
             责任人员列表
         """
-        memory_pool.log("    跨chunk提取责任人员，综合人员伤亡情况和责任认定")
+        memory_pool.log(
+            "    跨chunk提取责任人员，综合人员伤亡情况和责任认定", level="debug"
+        )
 
         # 收集人员伤亡情况内容
         casualties_content = InformationExtractor._collect_cross_chunk_content(
@@ -638,8 +2487,7 @@ class InformationExtractor:
 返回格式：[{{"姓名": "原文值1", "性别": "原文值", ...}}, {{"姓名": "原文值2", ...}}, ...]"""
 
         try:
-            response = client.chat.completions.create(
-                model=MODEL,
+            result_str = LLMGateway.chat(
                 messages=[
                     {
                         "role": "system",
@@ -647,35 +2495,28 @@ class InformationExtractor:
                     },
                     {"role": "user", "content": prompt},
                 ],
-                temperature=0.0,
-                max_tokens=3000,
-            )
-
-            result_str = response.choices[0].message.content.strip()
+                key="责任人员",
+                memory_pool=memory_pool,
+                default_max_tokens=3000,
+                strategy="cross_chunk_structured_list_extract",
+            ).strip()
 
             # 解析 JSON
-            try:
-                result = json.loads(result_str)
-            except json.JSONDecodeError:
-                # 尝试提取 JSON 部分
-                code_block_match = re.search(
-                    r"```(?:json)?\s*\n?(.*?)\n?```", result_str, re.DOTALL
-                )
-                if code_block_match:
-                    result = json.loads(code_block_match.group(1))
-                else:
-                    json_match = re.search(r"\[.*\]", result_str, re.DOTALL)
-                    if json_match:
-                        result = json.loads(json_match.group())
-                    else:
-                        memory_pool.log("    警告: 无法解析JSON结果")
-                        result = []
+            result, ok = JSONResponseParser.parse_with_repair(
+                result_str, memory_pool, expect="array"
+            )
+            if not ok:
+                memory_pool.log("    警告: 无法解析JSON结果", level="warning")
+                memory_pool.get("parse_stats")["defaulted"] += 1
+                result = []
 
-            memory_pool.log(f"    提取到 {len(result)} 个责任人员")
+            memory_pool.log(f"    提取到 {len(result)} 个责任人员", level="debug")
             return result
 
+        except CircuitOpenError:
+            raise  # 熔断时整篇文档稍后重试，不写入默认值
         except Exception as e:
-            memory_pool.log(f"    错误: 责任人员提取失败 - {e}")
+            memory_pool.log(f"    错误: 责任人员提取失败 - {e}", level="error")
             return []
 
     @staticmethod
@@ -694,6 +2535,18 @@ class InformationExtractor:
         Returns:
             选中的选项
         """
+        archive = memory_pool.raw_archive
+        coalescer = memory_pool.classify_coalescer
+        if coalescer is not None and not (archive is not None and archive.replay):
+            result = coalescer.submit(content, field_name, options, memory_pool)
+            if result is not None:
+                memory_pool.log(f"    分类结果: {result} (合并请求)", level="debug")
+                memory_pool.get("llm_usage")[field_name] = {"coalesced": True}
+                if archive is not None:
+                    archive.append(field_name, result, coalesced=True)
+                return result
+            memory_pool.log("    未合并或合并结果无效，单独分类", level="warning")
+
         prompt = f"""从以下文本中识别「{field_name}」，并从预定义选项中选择最匹配的一项。
 
 预定义选项：{", ".join(options)}
@@ -710,8 +2563,7 @@ class InformationExtractor:
 只返回选中的选项："""
 
         try:
-            response = client.chat.completions.create(
-                model=MODEL,
+            result = LLMGateway.chat(
                 messages=[
                     {
                         "role": "system",
@@ -719,28 +2571,39 @@ class InformationExtractor:
                     },
                     {"role": "user", "content": prompt},
                 ],
-                temperature=0.0,
-                max_tokens=50,
-            )
-
-            result = response.choices[0].message.content.strip()
+                key=field_name,
+                memory_pool=memory_pool,
+                default_max_tokens=50,
+                strategy="classify_with_options",
+            ).strip()
 
             # 验证结果是否在选项中
-            for option in options:
-                if option in result:
-                    memory_pool.log(f"    分类结果: {option}")
-                    return option
+            option = InformationExtractor._match_option(result, options)
+            if option is not None:
+                memory_pool.log(f"    分类结果: {option}", level="debug")
+                return option
 
             # 如果没有匹配，返回第一个选项作为默认值
             memory_pool.log(
-                f"    警告: 分类结果 '{result}' 不在预定义选项中，使用默认值: {options[0]}"
+                f"    警告: 分类结果 '{result}' 不在预定义选项中，使用默认值: {options[0]}",
+                level="warning",
             )
             return options[0]
 
+        except CircuitOpenError:
+            raise  # 熔断时整篇文档稍后重试，不写入默认值
         except Exception as e:
-            memory_pool.log(f"    错误: 分类失败 - {e}")
+            memory_pool.log(f"    错误: 分类失败 - {e}", level="error")
             return options[0]  # 返回默认值
 
+    @staticmethod
+    def _match_option(result: str, options: list[str]) -> str | None:
+        """返回回复中包含的第一个预定义选项，没有则返回 None"""
+        for option in options:
+            if option in result:
+                return option
+        return None
+
     @staticmethod
     def _collect_cross_chunk_content(
         source_categories: list[str], memory_pool: MemoryPool
@@ -765,7 +2628,7 @@ class InformationExtractor:
                     collected_content.append(f"【{category}】\n{chunk['content']}")
 
         if not collected_content:
-            memory_pool.log("    警告: 未找到任何源类别的内容")
+            memory_pool.log("    警告: 未找到任何源类别的内容", level="warning")
             return ""
 
         # 合并内容，限制总长度
@@ -774,7 +2637,8 @@ class InformationExtractor:
 
         if len(merged_content) > max_length:
             memory_pool.log(
-                f"    提示: 内容过长({len(merged_content)}字符)，截取前{max_length}字符"
+                f"    提示: 内容过长({len(merged_content)}字符)，截取前{max_length}字符",
+                level="debug",
             )
             merged_content = merged_content[:max_length]
 
@@ -798,11 +2662,14 @@ class InformationExtractor:
 
         extracted_data = {}
         processed_categories = set()  # 记录已处理的类别
+        presence = memory_pool.get("category_presence") or {}
+        skipped_categories = []
+        llm_calls_saved = 0
 
         for chunk in chunks:
             chunk_id = chunk["chunk_id"]
             ontology_category = chunk["ontology_category"]
-            content = chunk["content"]
+            content = str(chunk["content"])
 
             # 如果该类别已经处理过，跳过（避免重复提取）
             if ontology_category in processed_categories:
@@ -819,7 +2686,27 @@ class InformationExtractor:
             category_def = ontology["ontology_structure"].get(ontology_category)
             if not category_def:
                 memory_pool.log(
-                    f"InformationExtractor: 警告 - 未找到本体论类别 '{ontology_category}'"
+                    f"InformationExtractor: 警告 - 未找到本体论类别 '{ontology_category}'",
+                    level="warning",
+                )
+                continue
+
+            # 类别缺失：直接写入默认空值，不调用 LLM
+            if not presence.get(ontology_category, {"present": True})["present"]:
+                category_data = {
+                    field_name: {
+                        "value": InformationExtractor._default_value(field_def),
+                        "reference": "",
+                    }
+                    for field_name, field_def in category_def["fields"].items()
+                }
+                extracted_data[ontology_category] = category_data
+                processed_categories.add(ontology_category)
+                skipped_categories.append(ontology_category)
+                llm_calls_saved += len(category_data)
+                memory_pool.log(
+                    f"InformationExtractor: 类别 '{ontology_category}' 未在文档中出现，"
+                    f"跳过 {len(category_data)} 次 LLM 调用"
                 )
                 continue
 
@@ -831,7 +2718,8 @@ class InformationExtractor:
                 extraction_strategy = field_def["extraction_strategy"]
 
                 memory_pool.log(
-                    f"  提取字段: {field_name} (策略: {extraction_strategy})"
+                    f"  提取字段: {field_name} (策略: {extraction_strategy})",
+                    level="debug",
                 )
 
                 # 根据策略提取
@@ -848,9 +2736,96 @@ class InformationExtractor:
             extracted_data[ontology_category] = category_data
             processed_categories.add(ontology_category)  # 标记为已处理
 
+        memory_pool.set(
+            "presence_skip",
+            {
+                "skipped_categories": skipped_categories,
+                "llm_calls_saved": llm_calls_saved,
+            },
+        )
         memory_pool.set("extracted_data", extracted_data)
         return extracted_data
 
+    @staticmethod
+    def _reask_json_field(
+        field_name: str,
+        field_type: str,
+        messages: list[dict],
+        memory_pool: MemoryPool,
+        extraction_strategy: str | None = None,
+        fallback: list | dict | None = None,
+    ) -> Any:
+        """
+        JSON 解析与本地修复都失败时，以 JSON 模式重新请求该字段
+
+        Args:
+            field_name: 字段名称
+            field_type: "array" / "object"
+            messages: 原始请求消息
+            memory_pool: 记忆池
+            extraction_strategy: 提取策略（用于模型路由）
+            fallback: 重新请求也失败时使用的部分结果（流式解析已得到的元素）
+
+        Returns:
+            解析结果，失败时返回 fallback，没有则返回该类型的默认空值
+        """
+        stats = memory_pool.get("parse_stats")
+        stats["reasks"] += 1
+        memory_pool.log(
+            f"    JSON 解析失败，以 JSON 模式重新请求字段: {field_name}",
+            level="warning",
+        )
+
+        # json_object 模式要求顶层为对象，数组结果包在 result 键下
+        reask_messages = messages[:-1] + [
+            {
+                "role": "user",
+                "content": messages[-1]["content"]
+                + '\n\n请以合法 JSON 对象返回，格式为 {"result": 提取结果}，不要添加任何其他文字。',
+            }
+        ]
+        try:
+            reply = LLMGateway.chat(
+                messages=reask_messages,
+                key=f"{field_name}#reask",
+                memory_pool=memory_pool,
+                default_max_tokens=2000,
+                strategy=extraction_strategy,
+                response_format={"type": "json_object"},
+            )
+            data = json.loads(reply)
+            result = data.get("result", data) if isinstance(data, dict) else data
+            expected = list if field_type == "array" else dict
+            if isinstance(result, expected):
+                stats["reask_successes"] += 1
+                return result
+            memory_pool.log(
+                f"    警告: 重新请求的结果类型不符 ({type(result).__name__})",
+                level="warning",
+            )
+        except CircuitOpenError:
+            raise  # 熔断时整篇文档稍后重试，不写入默认值
+        except Exception as e:
+            memory_pool.log(f"    警告: 重新请求失败 - {e}", level="warning")
+
+        if fallback:
+            memory_pool.log(
+                f"    警告: 使用流式解析得到的 {len(fallback)} 个元素（可能不完整）",
+                level="warning",
+            )
+            return fallback
+        stats["defaulted"] += 1
+        return [] if field_type == "array" else {}
+
+    @staticmethod
+    def _default_value(field_def: dict) -> Any:
+        """字段未提取到时的默认空值"""
+        if field_def["type"] == "array":
+            return []
+        if field_def["type"] == "object":
+            return {}
+        return ""
+
     @staticmethod
     def _extract_field(
         field_name: str,
@@ -877,7 +2852,9 @@ class InformationExtractor:
         reference_content = content  # 保留完整原文作为参考来源
 
         if not strategy_def:
-            memory_pool.log(f"    警告: 未找到提取策略 '{extraction_strategy}'")
+            memory_pool.log(
+                f"    警告: 未找到提取策略 '{extraction_strategy}'", level="warning"
+            )
             return {"value": None, "reference": reference_content}
 
         # 特殊处理：分类型字段（事故等级和事故性质）
@@ -896,7 +2873,10 @@ class InformationExtractor:
                     content, field_name, options, memory_pool
                 )
             else:
-                memory_pool.log(f"    警告: 分类字段 '{field_name}' 没有定义选项列表")
+                memory_pool.log(
+                    f"    警告: 分类字段 '{field_name}' 没有定义选项列表",
+                    level="warning",
+                )
                 result = ""
             return {"value": result, "reference": reference_content}
 
@@ -910,13 +2890,16 @@ class InformationExtractor:
         # 检查是否需要跨chunk提取
         if "source_categories" in field_def:
             source_categories = field_def["source_categories"]
-            memory_pool.log(f"    跨chunk提取，源类别: {', '.join(source_categories)}")
+            memory_pool.log(
+                f"    跨chunk提取，源类别: {', '.join(source_categories)}",
+                level="debug",
+            )
             content = InformationExtractor._collect_cross_chunk_content(
                 source_categories, memory_pool
             )
             reference_content = content
             if not content:
-                memory_pool.log("    警告: 未收集到任何内容")
+                memory_pool.log("    警告: 未收集到任何内容", level="warning")
                 # 返回默认值
                 if field_def["type"] == "array":
                     default_value = []
@@ -956,57 +2939,58 @@ class InformationExtractor:
             prompt = field_description + prompt
 
         try:
-            response = client.chat.completions.create(
-                model=MODEL,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "你是专业的信息提取助手。严格复制原文内容，不要改写或总结。只返回提取结果，不要添加解释。",
-                    },
-                    {"role": "user", "content": prompt},
-                ],
+            messages = [
+                {
+                    "role": "system",
+                    "content": "你是专业的信息提取助手。严格复制原文内容，不要改写或总结。只返回提取结果，不要添加解释。",
+                },
+                {"role": "user", "content": prompt},
+            ]
+            field_type = field_def["type"]
+            # 流式模式下逐个收集已完整解析的元素，修复与重问都失败时作为兜底
+            streamed_items = []
+            result_str = LLMGateway.chat(
+                messages=messages,
+                key=field_name,
+                memory_pool=memory_pool,
+                default_max_tokens=2000,
                 temperature=0.0,  # 温度设为0，确保一致性
-                max_tokens=2000,
-            )
-
-            result_str = response.choices[0].message.content.strip()
+                strategy=extraction_strategy,
+                on_item=streamed_items.append
+                if field_type in ["array", "object"]
+                else None,
+            ).strip()
 
             # 根据字段类型解析结果
-            field_type = field_def["type"]
-
             if field_type in ["array", "object"]:
-                # 尝试解析 JSON
-                try:
-                    result = json.loads(result_str)
-                except json.JSONDecodeError:
-                    # 尝试提取 JSON 部分
-                    code_block_match = re.search(
-                        r"```(?:json)?\s*\n?(.*?)\n?```", result_str, re.DOTALL
+                # 解析 JSON（含本地修复），仍失败则只针对该字段重问一次，
+                # 重问也失败时才退回流式解析已得到的部分元素
+                result, ok = JSONResponseParser.parse_with_repair(
+                    result_str, memory_pool
+                )
+                if not ok:
+                    result = InformationExtractor._reask_json_field(
+                        field_name,
+                        field_type,
+                        messages,
+                        memory_pool,
+                        extraction_strategy,
+                        fallback=streamed_items
+                        if field_type == "array"
+                        else dict(streamed_items),
                     )
-                    if code_block_match:
-                        result = json.loads(code_block_match.group(1))
-                    else:
-                        json_match = re.search(r"[\[\{].*[\]\}]", result_str, re.DOTALL)
-                        if json_match:
-                            result = json.loads(json_match.group())
-                        else:
-                            memory_pool.log("    警告: 无法解析JSON结果")
-                            result = [] if field_type == "array" else {}
             else:
                 # 字符串或文本类型
                 result = result_str
 
             return {"value": result, "reference": reference_content}
 
+        except CircuitOpenError:
+            raise  # 熔断时整篇文档稍后重试，不写入默认值
         except Exception as e:
-            memory_pool.log(f"    错误: 提取失败 - {e}")
+            memory_pool.log(f"    错误: 提取失败 - {e}", level="error")
             # 返回默认值
-            if field_def["type"] == "array":
-                default_value = []
-            elif field_def["type"] == "object":
-                default_value = {}
-            else:
-                default_value = ""
+            default_value = InformationExtractor._default_value(field_def)
             return {"value": default_value, "reference": reference_content}
 
 
@@ -1020,17 +3004,115 @@ class OntologySerializer:
     序列化器：按本体论结构组织数据并序列化为 JSON
 
     输入: 提取的数据
-    输出: 符合本体论结构的 JSON 文件
+    输出: <文档名>_ontology.json[.gz|.zst]，可选 msgpack 副本 <文档名>_ontology.msgpack
+
+    编码由 STEP5_OUTPUT_FORMAT（pretty / compact）选择，压缩由
+    STEP5_OUTPUT_COMPRESSION（none / gzip / zstd）选择，msgpack 副本由
+    STEP5_OUTPUT_MSGPACK 开启。load 按扩展名读取以上任一种文件。
     """
 
+    COMPRESSION_SUFFIXES = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+    MSGPACK_SUFFIX = ".msgpack"
+
+    @classmethod
+    def output_name(cls, stem: str, compression: str | None = None) -> str:
+        """本体论输出文件名"""
+        compression = compression or OUTPUT_COMPRESSION
+        return f"{stem}_ontology.json{cls.COMPRESSION_SUFFIXES[compression]}"
+
+    @classmethod
+    def sidecar_path(cls, output_path: str) -> Path:
+        """与输出文件对应的 msgpack 副本路径"""
+        output_path = Path(output_path)
+        return output_path.with_name(
+            output_path.name.split(".json")[0] + cls.MSGPACK_SUFFIX
+        )
+
+    @staticmethod
+    def encode(data: dict, output_format: str | None = None) -> bytes:
+        """
+        编码为 UTF-8 JSON
+
+        pretty 与原有输出逐字节一致；compact 去掉缩进与空白，安装 orjson 时用其编码。
+        """
+        if (output_format or OUTPUT_FORMAT) != "compact":
+            return json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+        try:
+            import orjson
+        except ImportError:
+            return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode(
+                "utf-8"
+            )
+        return orjson.dumps(data)
+
+    @staticmethod
+    def write(
+        data: dict,
+        output_path: str,
+        output_format: str | None = None,
+        msgpack_sidecar: bool | None = None,
+    ):
+        """
+        写出本体论数据（压缩方式由扩展名决定）
+
+        Args:
+            data: 本体论数据
+            output_path: 输出路径
+            output_format: pretty / compact，默认取 STEP5_OUTPUT_FORMAT
+            msgpack_sidecar: 是否同时写 msgpack 副本，默认取 STEP5_OUTPUT_MSGPACK
+        """
+        with open_compressed(output_path, "wb") as f:
+            f.write(OntologySerializer.encode(data, output_format))
+
+        if msgpack_sidecar is None:
+            msgpack_sidecar = OUTPUT_MSGPACK
+        if msgpack_sidecar:
+            import msgpack
+
+            with open(OntologySerializer.sidecar_path(output_path), "wb") as f:
+                f.write(msgpack.packb(data, use_bin_type=True))
+
+    @staticmethod
+    def load(path: str) -> dict:
+        """读取本体论输出（.json / .json.gz / .json.zst / .msgpack）"""
+        path = Path(path)
+        if path.suffix == OntologySerializer.MSGPACK_SUFFIX:
+            import msgpack
+
+            with open(path, "rb") as f:
+                return msgpack.unpackb(f.read(), raw=False)
+        with open_compressed(path, "rb") as f:
+            return json.loads(f.read())
+
+    @staticmethod
+    def value_chars(obj: Any) -> int:
+        """统计字段值的字符数（不含 reference）"""
+        if isinstance(obj, dict):
+            total = 0
+            if "value" in obj:
+                total += OntologySerializer.value_chars(obj["value"])
+            for k, v in obj.items():
+                if k in ("value", "reference"):
+                    continue
+                total += OntologySerializer.value_chars(v)
+            return total
+        if isinstance(obj, list):
+            return sum(OntologySerializer.value_chars(x) for x in obj)
+        if isinstance(obj, str):
+            return len(obj)
+        return 0
+
     @staticmethod
-    def serialize(memory_pool: MemoryPool, output_path: str):
+    def serialize(memory_pool: MemoryPool, output_path: str) -> dict:
         """
         序列化为 JSON
 
         Args:
             memory_pool: 记忆池
             output_path: 输出路径
+
+        Returns:
+            写出的本体论数据
         """
         memory_pool.log("OntologySerializer: 开始序列化数据")
 
@@ -1062,11 +3144,10 @@ class OntologySerializer:
                 # 如果没有提取到，创建空结构
                 final_json[category_name] = {}
 
-        # 保存为 JSON 文件
-        with open(output_path, "w", encoding="utf-8") as f:
-            json.dump(final_json, f, ensure_ascii=False, indent=2)
+        OntologySerializer.write(final_json, output_path)
 
         memory_pool.log(f"OntologySerializer: 已保存到 {output_path}")
+        return final_json
 
 
 # ═══════════════════════════════════════════════════════════════════════════
@@ -1096,6 +3177,9 @@ class OntologyAgent:
         """
         self.ontology_path = Path(ontology_path)
         self.ontology = self._load_ontology()
+        self.model_router = ModelRouter.from_ontology(self.ontology)
+        # 仅在多文档并发处理时启用（见 process_all_documents）
+        self.classify_coalescer = None
 
     def _load_ontology(self) -> dict:
         """加载本体论"""
@@ -1107,32 +3191,75 @@ class OntologyAgent:
         print(f"   类别数: {len(ontology['ontology_structure'])}")
         return ontology
 
-    def process_document(self, md_file_path: str, output_dir: str) -> dict:
+    def process_document(
+        self,
+        md_file_path: str,
+        output_dir: str,
+        reparse: bool = False,
+        dry_run: bool = False,
+    ) -> dict:
         """
         处理单个文档
 
         Args:
             md_file_path: Markdown 文件路径
             output_dir: 输出目录
+            reparse: 为 True 时回放 <文档名>_raw.jsonl.gz 中的原始回复，不调用 LLM
+            dry_run: 为 True 时只估算调用次数与 tokens（见 estimate_document）
 
         Returns:
             处理结果
         """
+        if dry_run:
+            return self.estimate_document(md_file_path, output_dir)
+
         md_path = Path(md_file_path)
         output_path = Path(output_dir)
         output_path.mkdir(exist_ok=True, parents=True)
 
         print(f"\n{'=' * 80}")
-        print(f"处理文档: {md_path.name}")
+        print(f"{'重解析' if reparse else '处理'}文档: {md_path.name}")
         print(f"{'=' * 80}")
 
+        # 加载该输出目录下的历史 token 统计
+        token_budget.load(output_path)
+
         # 初始化记忆池
         memory_pool = MemoryPool()
         memory_pool.set("document_path", md_path)
         memory_pool.set("ontology", self.ontology)
+        memory_pool.model_router = self.model_router
+        memory_pool.classify_coalescer = self.classify_coalescer
+        success = False
+
+        archive_path = output_path / f"{md_path.stem}{RawResponseArchive.SUFFIX}"
+        if reparse and not archive_path.exists():
+            print(f"\n✗ 未找到原始回复归档: {archive_path.name}")
+            return {
+                "success": False,
+                "document": str(md_path),
+                "error": f"原始回复归档不存在: {archive_path.name}",
+            }
 
         try:
+            # 打开原始回复归档（重解析时为回放模式）
+            memory_pool.raw_archive = RawResponseArchive(archive_path, replay=reparse)
+            memory_pool.raw_archive.open(md_path)
+
+            # 打开处理追踪（事件实时追加写入）
+            if TRACE_COMPRESSION != "none":
+                trace_path = TraceWriter.path_for(
+                    output_path, md_path.stem, TRACE_COMPRESSION
+                )
+                memory_pool.attach_trace(
+                    TraceWriter(trace_path),
+                    document=str(md_path),
+                    ontology_path=str(self.ontology_path.resolve()),
+                    reparse=reparse,
+                )
+
             # 读取文档
+            memory_pool.begin_stage("load")
             memory_pool.log("读取文档内容")
             with open(md_path, encoding="utf-8", errors="ignore") as f:
                 md_content = f.read()
@@ -1141,63 +3268,109 @@ class OntologyAgent:
 
             # 1️⃣ 提取标题层级
             print("\n1️⃣  提取标题层级")
+            memory_pool.begin_stage("headers")
             headers = HeaderExtractor.extract(md_content, memory_pool)
             print(f"   ✓ 提取到 {len(headers)} 个标题")
 
+            # 检测缺失的本体论类别（缺失类别不调用 LLM）
+            memory_pool.begin_stage("presence")
+            presence = CategoryPresenceDetector.detect(md_content, memory_pool)
+            absent = [name for name, d in presence.items() if not d["present"]]
+            print(f"   ✓ 缺失类别: {len(absent)} 个")
+
             # 2️⃣ LLM 规划拆分方案
             print("\n2️⃣  LLM 规划拆分方案")
-            split_plan = SplitPlanner.plan(memory_pool)
+            memory_pool.begin_stage("split_plan")
+            streamed_chunks = {}
+
+            def group_chunk(chunk_id, chunk_info):
+                # 流式规划时每个 chunk 到达即合并其标题内容
+                streamed_chunks[chunk_id] = (
+                    chunk_info,
+                    DocumentSplitter.build_chunk(chunk_id, chunk_info, headers),
+                )
+
+            split_plan = SplitPlanner.plan(memory_pool, on_chunk=group_chunk)
             print(f"   ✓ 生成 {len(split_plan)} 个拆分chunk")
 
             # 3️⃣ 执行文档拆分
             print("\n3️⃣  执行文档拆分")
-            chunks = DocumentSplitter.split(memory_pool)
+            memory_pool.begin_stage("split")
+            chunks = DocumentSplitter.split(memory_pool, prebuilt=streamed_chunks)
             print(f"   ✓ 拆分完成，共 {len(chunks)} 个chunk")
             for chunk in chunks:
                 print(f"      - {chunk['chunk_id']}: {chunk['char_count']:,} 字符")
 
             # 4️⃣ 提取信息
             print("\n4️⃣  提取信息 (严格复制原文)")
+            memory_pool.begin_stage("extract")
             extracted_data = InformationExtractor.extract(memory_pool)
             print(f"   ✓ 提取完成，共 {len(extracted_data)} 个类别")
+            parse_stats = memory_pool.get("parse_stats")
+            if parse_stats["parse_failures"]:
+                print(
+                    f"   ✓ JSON 解析失败 {parse_stats['parse_failures']} 次: "
+                    f"本地修复 {parse_stats['local_repairs']}, "
+                    f"重问 {parse_stats['reasks']} (成功 {parse_stats['reask_successes']}), "
+                    f"使用默认值 {parse_stats['defaulted']}"
+                )
+            presence_skip = memory_pool.get("presence_skip")
+            if presence_skip["skipped_categories"]:
+                print(
+                    f"   ✓ 跳过缺失类别 {len(presence_skip['skipped_categories'])} 个，"
+                    f"节省 {presence_skip['llm_calls_saved']} 次 LLM 调用"
+                )
+            for route, stats in memory_pool.get("route_stats").items():
+                print(
+                    f"   ✓ 路由 {route} ({self.model_router.model_for(route)}): "
+                    f"{stats['calls']} 次调用, {stats['errors']} 次失败, "
+                    f"耗时 {stats['latency_s']:.1f}s, "
+                    f"tokens {stats['prompt_tokens']}+{stats['completion_tokens']}"
+                )
+            stream_timing = memory_pool.get("stream_timing")
+            if stream_timing:
+                first_items = [
+                    t["first_item_s"]
+                    for t in stream_timing.values()
+                    if t["first_item_s"] is not None
+                ]
+                total = sum(t["total_s"] for t in stream_timing.values())
+                print(
+                    f"   ✓ 流式请求 {len(stream_timing)} 次: "
+                    f"首个结果平均 {sum(first_items) / max(len(first_items), 1):.2f}s, "
+                    f"总耗时平均 {total / len(stream_timing):.2f}s, "
+                    f"提前结束 {sum(1 for t in stream_timing.values() if t['cut_off'])} 次"
+                )
 
             # 5️⃣ 序列化为 JSON
             print("\n5️⃣  序列化为 JSON")
-            json_path = f"{md_path.stem}_ontology.json"
+            memory_pool.begin_stage("serialize")
+            json_path = OntologySerializer.output_name(md_path.stem)
             json_output_path = output_path / json_path
-            OntologySerializer.serialize(memory_pool, str(json_output_path))
+            final_json = OntologySerializer.serialize(
+                memory_pool, str(json_output_path)
+            )
             print(f"   ✓ 保存到: {json_output_path.name}")
 
-            # stats: count source chars and output value chars (skip reference)
-            def _sum_value_len(obj):
-                if isinstance(obj, dict):
-                    total = 0
-                    if "value" in obj:
-                        total += _sum_value_len(obj["value"])
-                    for k, v in obj.items():
-                        if k in ("value", "reference"):
-                            continue
-                        total += _sum_value_len(v)
-                    return total
-                if isinstance(obj, list):
-                    return sum(_sum_value_len(x) for x in obj)
-                if isinstance(obj, str):
-                    return len(obj)
-                return 0
+            # 统计：源文档字符数与输出字段值字符数（不含 reference，直接取内存结构）
+            payload = {k: v for k, v in final_json.items() if k != "_metadata"}
+            print(
+                f"   stats: src_chars={len(memory_pool.get('document_content'))}, "
+                f"output_value_chars={OntologySerializer.value_chars(payload)}"
+            )
 
-            try:
-                src_len = len(md_path.read_text(encoding="utf-8"))
-                output_data = json.load(open(json_output_path, encoding="utf-8"))
-                payload = {k: v for k, v in output_data.items() if k != "_metadata"}
-                value_len = _sum_value_len(payload)
-                print(f"   stats: src_chars={src_len}, output_value_chars={value_len}")
-            except Exception as e:
-                print(f"   stats calculation failed: {e}")
+            # 保存 token 统计，供后续运行学习预算
+            if not reparse:
+                token_budget.save()
 
-            # 保存记忆池（用于调试）
-            memory_output_path = output_path / f"{md_path.stem}_memory.json"
-            memory_pool.save_memory(str(memory_output_path))
-            print(f"   ✓ 记忆池已保存: {memory_output_path.name}")
+            # 完整记忆池快照仅在显式开启或未写追踪时保存（可由追踪文件重建）
+            if MEMORY_SNAPSHOT or memory_pool.trace is None:
+                memory_output_path = output_path / f"{md_path.stem}_memory.json"
+                memory_pool.save_memory(str(memory_output_path))
+                print(f"   ✓ 记忆池已保存: {memory_output_path.name}")
+            else:
+                print(f"   ✓ 处理追踪已写入: {memory_pool.trace.path.name}")
+            success = True
 
             print(f"\n{'=' * 80}")
             print("✓ 处理完成")
@@ -1209,8 +3382,19 @@ class OntologyAgent:
                 "output": str(json_path),
             }
 
+        except CircuitOpenError as e:
+            # 依赖熔断：不输出默认值填充的结果，标记文档稍后重试
+            memory_pool.log(f"处理中止: {e}", level="error")
+            print(f"\n⏸ 依赖服务熔断，文档稍后重试: {e}")
+            return {
+                "success": False,
+                "document": str(md_path),
+                "error": str(e),
+                "retry_later": True,
+            }
+
         except Exception as e:
-            memory_pool.log(f"处理失败: {e}")
+            memory_pool.log(f"处理失败: {e}", level="error")
             print(f"\n✗ 处理失败: {e}")
             import traceback
 
@@ -1218,13 +3402,142 @@ class OntologyAgent:
 
             return {"success": False, "document": str(md_path), "error": str(e)}
 
-    def process_all_documents(self, dataset_dir: str, output_dir: str):
+        finally:
+            if memory_pool.raw_archive is not None:
+                memory_pool.raw_archive.close()
+            memory_pool.close_trace(success)
+
+    def estimate_document(
+        self, md_file_path: str, output_dir: str | None = None
+    ) -> dict:
+        """
+        试运行：估算单个文档的 LLM 调用次数、tokens 与耗时，不调用 LLM、不写结果
+
+        运行标题提取、类别检测、本地拆分方案（SplitPlanner.local_plan）与信息提取，
+        LLMGateway 只渲染并记录每个将要发送的 prompt。指定 output_dir 时
+        prompt 写入 <文档名>_prompts.jsonl，并读取该目录的历史 token 统计。
+
+        Args:
+            md_file_path: Markdown 文件路径
+            output_dir: 输出目录
+
+        Returns:
+            {"success", "document", "dry_run": True, "estimate": {...}}
+        """
+        md_path = Path(md_file_path)
+        dump_path = None
+        if output_dir is not None:
+            output_path = Path(output_dir)
+            output_path.mkdir(exist_ok=True, parents=True)
+            token_budget.load(output_path)
+            dump_path = output_path / f"{md_path.stem}_prompts.jsonl"
+
+        print(f"\n试运行估算: {md_path.name}")
+        memory_pool = MemoryPool()
+        memory_pool.set("document_path", md_path)
+        memory_pool.set("ontology", self.ontology)
+        memory_pool.model_router = self.model_router
+        memory_pool.dry_run = DryRunEstimator(dump_path)
+
+        try:
+            memory_pool.begin_stage("load")
+            with open(md_path, encoding="utf-8", errors="ignore") as f:
+                md_content = f.read()
+            memory_pool.set("document_content", md_content)
+
+            memory_pool.begin_stage("headers")
+            headers = HeaderExtractor.extract(md_content, memory_pool)
+            memory_pool.begin_stage("presence")
+            CategoryPresenceDetector.detect(md_content, memory_pool)
+
+            # 拆分方案的 prompt 照常渲染计数，回复替换为本地方案
+            memory_pool.begin_stage("split_plan")
+            memory_pool.dry_run.replies["__split_plan__"] = json.dumps(
+                SplitPlanner.local_plan(headers, self.ontology), ensure_ascii=False
+            )
+            SplitPlanner.plan(memory_pool)
+
+            memory_pool.begin_stage("split")
+            DocumentSplitter.split(memory_pool)
+            memory_pool.begin_stage("extract")
+            InformationExtractor.extract(memory_pool)
+
+            estimate = memory_pool.dry_run.summary()
+            print(
+                f"   ✓ 预计 {estimate['calls']} 次调用, "
+                f"tokens {estimate['prompt_tokens']}+{estimate['completion_tokens']}, "
+                f"顺序耗时约 {estimate['latency_s']:.0f}s"
+            )
+            return {
+                "success": True,
+                "document": str(md_path),
+                "dry_run": True,
+                "estimate": estimate,
+            }
+
+        except Exception as e:
+            print(f"   ✗ 估算失败: {e}")
+            return {"success": False, "document": str(md_path), "error": str(e)}
+
+        finally:
+            memory_pool.dry_run.close()
+
+    def reparse(self, output_dir: str) -> list[dict]:
+        """
+        根据输出目录中的原始回复归档，用当前解析逻辑重建所有 *_ontology.json
+
+        不调用 LLM；源 Markdown 路径取自归档中最近一次运行的起始记录。
+
+        Args:
+            output_dir: 输出目录（包含 *_raw.jsonl.gz）
+
+        Returns:
+            各文档的处理结果
+        """
+        output_path = Path(output_dir)
+        archives = sorted(output_path.glob(f"*{RawResponseArchive.SUFFIX}"))
+        print(f"\n找到 {len(archives)} 个原始回复归档")
+
+        results = []
+        for archive_path in archives:
+            header, _ = RawResponseArchive.latest_run(archive_path)
+            if header is None or not Path(header["document"]).exists():
+                print(f"  ✗ 跳过 {archive_path.name}: 源文档不存在")
+                results.append(
+                    {
+                        "success": False,
+                        "document": header["document"] if header else None,
+                        "error": "源文档不存在",
+                    }
+                )
+                continue
+            results.append(
+                self.process_document(
+                    header["document"], str(output_path), reparse=True
+                )
+            )
+
+        success_count = sum(1 for r in results if r["success"])
+        print(
+            f"\n重解析完成: 成功 {success_count} 个, 失败 {len(results) - success_count} 个"
+        )
+        return results
+
+    def process_all_documents(
+        self,
+        dataset_dir: str,
+        output_dir: str,
+        workers: int = 1,
+        dry_run: bool = False,
+    ):
         """
         批量处理 Dataset 目录下的所有文档
 
         Args:
             dataset_dir: Dataset 目录路径
             output_dir: 输出目录
+            workers: 并发处理的文档数；大于 1 时启用跨文档分类请求合并
+            dry_run: 为 True 时只估算整批的调用次数、tokens 与按 workers 并发的耗时
         """
         dataset_path = Path(dataset_dir)
         output_path = Path(output_dir)
@@ -1245,25 +3558,45 @@ class OntologyAgent:
         success_count = 0
         fail_count = 0
 
-        for i, doc_folder in enumerate(doc_folders, 1):
-            print(f"\n[{i}/{len(doc_folders)}]")
-
+        md_files = []
+        for doc_folder in doc_folders:
             # 查找 md 文件
-            md_files = [
+            candidates = [
                 f for f in doc_folder.glob("*.md") if f.name.lower() != "readme.md"
             ]
-
-            if not md_files:
-                print("  ✗ 未找到 markdown 文件")
+            if not candidates:
+                print(f"  ✗ 未找到 markdown 文件: {doc_folder.name}")
                 fail_count += 1
                 continue
+            md_files.append(candidates[0])
+
+        def process(indexed_md):
+            i, md_file = indexed_md
+            print(f"\n[{i}/{len(md_files)}]")
+            return self.process_document(
+                str(md_file), str(output_path), dry_run=dry_run
+            )
 
-            md_file = md_files[0]
+        if dry_run:
+            # 估算只在本地运行，顺序执行即可；并发数只用于预计耗时
+            doc_results = [process(item) for item in enumerate(md_files, 1)]
+            self._report_estimate(doc_results, output_path, workers)
+            return
 
-            # 处理文档
-            result = self.process_document(str(md_file), str(output_path))
+        coalescer = None
+        if workers > 1:
+            coalescer = self.classify_coalescer = ClassificationCoalescer()
+            try:
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    doc_results = list(pool.map(process, enumerate(md_files, 1)))
+            finally:
+                # 合并队列只在本次并发批量处理期间有效，之后的单文档处理直接请求
+                self.classify_coalescer = None
+        else:
+            doc_results = [process(item) for item in enumerate(md_files, 1)]
+
+        for result in doc_results:
             results.append(result)
-
             if result["success"]:
                 success_count += 1
             else:
@@ -1279,7 +3612,66 @@ class OntologyAgent:
         print(f"{'=' * 80}")
         print(f"  成功: {success_count} 个")
         print(f"  失败: {fail_count} 个")
+        retry_later = [r["document"] for r in results if r.get("retry_later")]
+        if retry_later:
+            print(
+                f"  其中因依赖熔断待重试: {len(retry_later)} 个（汇总中 retry_later=true）"
+            )
         print(f"  汇总文件: {summary_path.name}")
+        for route, stats in self.model_router.stats.items():
+            avg_latency = stats["latency_s"] / stats["calls"] if stats["calls"] else 0
+            print(
+                f"  路由 {route}: {stats['calls']} 次调用, 平均耗时 {avg_latency:.2f}s, "
+                f"tokens {stats['prompt_tokens']}+{stats['completion_tokens']}"
+            )
+        if request_hedger.enabled:
+            stats = request_hedger.stats
+            print(
+                f"  请求对冲: {stats['hedged']}/{stats['calls']} 次调用触发对冲, "
+                f"对冲胜出 {stats['hedge_wins']} 次, 节省 {stats['latency_saved_s']:.1f}s, "
+                f"额外消耗 {stats['extra_completion_tokens']} completion tokens"
+            )
+        if coalescer is not None:
+            stats = coalescer.stats
+            print(
+                f"  分类请求合并: {stats['items']} 项合并为 {stats['batches']} 次调用, "
+                f"单独回退 {stats['fallbacks']} 项"
+            )
+        print(f"{'=' * 80}")
+
+    @staticmethod
+    def _report_estimate(doc_results: list[dict], output_path: Path, workers: int):
+        """汇总试运行估算，写入 _dry_run_estimate.json"""
+        estimate = DryRunEstimator.aggregate(
+            [r["estimate"] for r in doc_results if r["success"]], workers
+        )
+        estimate["failed"] = [r["document"] for r in doc_results if not r["success"]]
+        estimate_path = output_path / "_dry_run_estimate.json"
+        with open(estimate_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"total": estimate, "documents": doc_results},
+                f,
+                ensure_ascii=False,
+                indent=2,
+            )
+
+        print(f"\n{'=' * 80}")
+        print("试运行估算完成")
+        print(f"{'=' * 80}")
+        print(
+            f"  文档: {estimate['documents']} 个（失败 {len(estimate['failed'])} 个）"
+        )
+        print(
+            f"  预计调用: {estimate['calls']} 次, "
+            f"tokens {estimate['prompt_tokens']}+{estimate['completion_tokens']}"
+        )
+        for strategy, stats in sorted(estimate["by_strategy"].items()):
+            print(
+                f"    {strategy}: {stats['calls']} 次, "
+                f"tokens {stats['prompt_tokens']}+{stats['completion_tokens']}"
+            )
+        print(f"  预计耗时: {estimate['wall_time_s']:.0f}s（并发 {workers}）")
+        print(f"  汇总文件: {estimate_path.name}")
         print(f"{'=' * 80}")
 
 
@@ -1290,17 +3682,68 @@ class OntologyAgent:
 
 def main():
     """主程序入口"""
+    import argparse
 
     # 配置路径
     ONTOLOGY_PATH = r"C:\Users\Qzj\Desktop\projrct\MinerU\ontology_v2.json"
     DATASET_DIR = r"C:\Users\Qzj\Desktop\projrct\MinerU\Dataset"
     OUTPUT_DIR = r"C:\Users\Qzj\Desktop\projrct\MinerU\ontology_output_v2"
 
+    parser = argparse.ArgumentParser(description="本体论驱动的事故报告信息提取")
+    parser.add_argument("--ontology", default=ONTOLOGY_PATH, help="本体论文件路径")
+    parser.add_argument("--dataset-dir", default=DATASET_DIR, help="Dataset目录路径")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="输出目录路径")
+    parser.add_argument(
+        "--reparse",
+        action="store_true",
+        help="根据输出目录中的原始回复归档重建 *_ontology.json，不调用 LLM",
+    )
+    parser.add_argument(
+        "--log-level",
+        choices=list(LOG_LEVELS),
+        help="控制台日志级别（默认取环境变量 STEP5_LOG_LEVEL，否则为 info）",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="并发处理的文档数（大于 1 时合并分类请求）",
+    )
+    parser.add_argument(
+        "--rebuild-memory",
+        nargs="+",
+        metavar="TRACE",
+        help="由 *_trace.jsonl[.gz|.zst] 重建旧版 *_memory.json 后退出",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="不调用 LLM，输出每篇文档的 prompt 与整批调用次数/tokens/耗时估算",
+    )
+    args = parser.parse_args()
+    if args.log_level:
+        MemoryPool.CONSOLE_LEVEL = LOG_LEVELS[args.log_level]
+
+    if args.rebuild_memory:
+        for trace_path in args.rebuild_memory:
+            snapshot_path = TraceWriter.rebuild_snapshot(trace_path)
+            print(f"✓ 已重建: {snapshot_path}")
+        return
+
     # 创建 Agent
-    agent = OntologyAgent(ontology_path=ONTOLOGY_PATH)
+    agent = OntologyAgent(ontology_path=args.ontology)
+
+    if args.reparse:
+        agent.reparse(output_dir=args.output_dir)
+        return
 
     # 批量处理所有文档
-    agent.process_all_documents(dataset_dir=DATASET_DIR, output_dir=OUTPUT_DIR)
+    agent.process_all_documents(
+        dataset_dir=args.dataset_dir,
+        output_dir=args.output_dir,
+        workers=args.workers,
+        dry_run=args.dry_run,
+    )
 
 
 if __name__ == "__main__":
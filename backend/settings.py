@@ -203,9 +203,22 @@ DEEPSEEK_MODEL = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
 # ===== MinerU Service 配置 =====
 MINERU_API_URL = os.getenv("MINERU_API_URL", "http://127.0.0.1:8000")
 MINERU_TIMEOUT = int(os.getenv("MINERU_TIMEOUT", "180"))  # 3分钟超时
+MINERU_BREAKER_FAILURE_RATE = float(os.getenv("MINERU_BREAKER_FAILURE_RATE", "0.5"))
+MINERU_BREAKER_SLOW_CALL_SECONDS = float(
+    os.getenv("MINERU_BREAKER_SLOW_CALL_SECONDS", str(MINERU_TIMEOUT * 0.8))
+)
+MINERU_BREAKER_OPEN_SECONDS = float(os.getenv("MINERU_BREAKER_OPEN_SECONDS", "60"))
+
+# ===== 依赖熔断后的重试 =====
+SERVICE_RETRY_DELAY = int(os.getenv("SERVICE_RETRY_DELAY", "120"))  # 秒
+SERVICE_MAX_DEFERRALS = int(os.getenv("SERVICE_MAX_DEFERRALS", "10"))
 
 # ===== 文件上传配置 =====
 MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", str(50 * 1024 * 1024)))  # 50MB
 
 # ===== 默认本体论路径 =====
 DEFAULT_ONTOLOGY_PATH = "ontology_v2.json"
+
+# ===== 项目消耗估算 =====
+# 单次估算请求最多逐篇试运行的文档数，其余按PDF大小外推
+ONTOLOGY_ESTIMATE_MAX_DOCUMENTS = int(os.getenv("ONTOLOGY_ESTIMATE_MAX_DOCUMENTS", "20"))
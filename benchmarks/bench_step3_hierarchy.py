@@ -0,0 +1,122 @@
+"""
+Step3 标题层级构建基准测试
+
+- 旧实现：每个标题向前回溯查找父标题（O(n²)），并逐个标题重新拼接正文
+- 当前实现：栈式父标题解析 + 按行偏移一次切分全部正文
+- 两者输出须完全一致
+
+用法:
+    python benchmarks/bench_step3_hierarchy.py --headings 5000
+"""
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from Step3_organize_by_headings_llm import build_heading_hierarchy_with_llm  # noqa: E402
+
+
+def legacy_extract_content(lines, start_line, end_line):
+    """旧实现：逐个标题拼接正文"""
+    content_lines = []
+    for i in range(start_line + 1, end_line):
+        if i < len(lines):
+            content_lines.append(lines[i].rstrip())
+    return "\n".join(content_lines).strip()
+
+
+def legacy_build_hierarchy(headings, llm_hierarchy, lines):
+    """旧实现：每个标题向前回溯查找父标题"""
+    hierarchy = []
+    llm_map = {item["index"]: item for item in llm_hierarchy}
+    for i, heading in enumerate(headings):
+        next_heading_line = (
+            headings[i + 1]["line_number"] if i + 1 < len(headings) else len(lines)
+        )
+        content = legacy_extract_content(
+            lines, heading["line_number"], next_heading_line
+        )
+        llm_info = llm_map.get(i, {"level": 1, "reasoning": "未找到LLM结果"})
+        current_level = llm_info["level"]
+
+        parent_path = []
+        for j in range(i - 1, -1, -1):
+            prev_level = hierarchy[j]["level"]
+            if prev_level < current_level:
+                parent_path.insert(0, hierarchy[j]["title"])
+                current_level = prev_level
+                if prev_level == 1:
+                    break
+
+        hierarchy.append(
+            {
+                "level": llm_info["level"],
+                "title": heading["content"],
+                "content": content,
+                "parent_path": parent_path,
+                "reasoning": llm_info.get("reasoning", ""),
+                "index": i,
+                "page_idx": heading.get("page_idx"),
+            }
+        )
+    return hierarchy
+
+
+def build_document(heading_count, paragraphs, seed=0):
+    """生成含指定标题数的合成文档，层级在 1-4 之间随机游走"""
+    rng = random.Random(seed)
+    paragraph = "施工单位在基坑作业过程中发生坍塌事故，造成人员伤亡。" * 3
+    lines, headings, llm_hierarchy = [], [], []
+    level = 1
+    for i in range(heading_count):
+        level = max(1, min(4, level + rng.choice((-2, -1, 0, 1, 1))))
+        title = f"{i + 1} 事故情况"
+        headings.append({"content": title, "line_number": len(lines)})
+        llm_hierarchy.append({"index": i, "level": level, "reasoning": ""})
+        lines.append(f"{'#' * level} {title}\n")
+        for _ in range(paragraphs):
+            lines.append("\n")
+            lines.append(f"{paragraph}  \n")
+    return headings, llm_hierarchy, lines
+
+
+def best_of(func, args, repeat):
+    """多次运行取最短耗时"""
+    best, result = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Step3 标题层级构建基准测试")
+    parser.add_argument("--headings", type=int, default=5000, help="合成文档标题数")
+    parser.add_argument("--paragraphs", type=int, default=3, help="每个标题下的段落数")
+    parser.add_argument("--repeat", type=int, default=3, help="重复次数（取最短耗时）")
+    args = parser.parse_args()
+
+    headings, llm_hierarchy, lines = build_document(args.headings, args.paragraphs)
+    print(f"文档: {len(headings):,} 个标题, {len(lines):,} 行")
+
+    inputs = (headings, llm_hierarchy, lines)
+    legacy_elapsed, legacy = best_of(legacy_build_hierarchy, inputs, args.repeat)
+    current_elapsed, current = best_of(
+        build_heading_hierarchy_with_llm, inputs, args.repeat
+    )
+    if legacy != current:
+        sys.exit("输出不一致：当前实现与旧实现的层级结构不同")
+
+    print(f"  旧实现（回溯查找）: {legacy_elapsed:.3f}s")
+    print(f"  当前实现（栈 + 偏移切分）: {current_elapsed:.3f}s")
+    print(f"  加速比: {legacy_elapsed / current_elapsed:.1f}x, 输出一致")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Step3 层级分析提示词基准测试（需要 DEEPSEEK_API_KEY，会真实调用 API）
+
+- 紧凑提示（编号行 + [[序号, 层级], ...]）与思维链提示（analysis + 每个标题的 reasoning）
+  各调用一次，比较 completion tokens、耗时与两者给出的层级一致率
+- 默认使用 Mineru_changed 下的所有 Markdown，只取标题，不走编号规则与窗口拆分
+
+用法:
+    DEEPSEEK_API_KEY=sk-... python benchmarks/bench_step3_prompt.py [--md 文件.md ...]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import Step3_organize_by_headings_llm as step3  # noqa: E402
+
+
+def measure(headings, api_key, debug_reasoning):
+    """调用一次层级分析，返回 (层级列表, completion tokens, 耗时秒数)"""
+    before = dict(step3.LLM_USAGE)
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = step3.call_deepseek_for_hierarchy(
+            headings, api_key, debug_reasoning=debug_reasoning
+        )
+    levels = {item["index"]: item.get("level") for item in result}
+    return (
+        [levels.get(i) for i in range(len(headings))],
+        step3.LLM_USAGE["completion_tokens"] - before["completion_tokens"],
+        step3.LLM_USAGE["seconds"] - before["seconds"],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Step3 层级分析提示词基准测试")
+    parser.add_argument(
+        "--md", nargs="*", help="Markdown 文件（默认 Mineru_changed 下全部）"
+    )
+    args = parser.parse_args()
+
+    api_key = os.environ.get("DEEPSEEK_API_KEY")
+    if not api_key:
+        sys.exit("需要设置 DEEPSEEK_API_KEY")
+
+    md_files = (
+        [Path(p) for p in args.md]
+        if args.md
+        else sorted(ROOT.glob("Mineru_changed/*/auto/*.md"))
+    )
+    totals = {False: [0, 0.0], True: [0, 0.0]}
+    for md_file in md_files:
+        headings = step3.extract_all_headings_from_md(md_file)
+        if not headings:
+            continue
+        print(f"{md_file.parent.parent.name}: {len(headings)} 个标题")
+        runs = {}
+        for debug_reasoning, label in ((True, "思维链提示"), (False, "紧凑提示")):
+            levels, tokens, seconds = measure(headings, api_key, debug_reasoning)
+            runs[debug_reasoning] = levels
+            totals[debug_reasoning][0] += tokens
+            totals[debug_reasoning][1] += seconds
+            print(f"  {label}: {tokens:,} completion tokens, {seconds:.1f}s")
+        agree = sum(1 for a, b in zip(runs[True], runs[False], strict=True) if a == b)
+        print(f"  层级一致: {agree}/{len(headings)}")
+
+    (cot_tokens, cot_seconds), (compact_tokens, compact_seconds) = (
+        totals[True],
+        totals[False],
+    )
+    if compact_tokens and compact_seconds:
+        print(
+            f"合计: 思维链 {cot_tokens:,} tokens / {cot_seconds:.1f}s, "
+            f"紧凑 {compact_tokens:,} tokens / {compact_seconds:.1f}s "
+            f"(tokens {cot_tokens / compact_tokens:.1f}x, 耗时 {cot_seconds / compact_seconds:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Step5 文档模型基准测试
+
+- HeaderExtractor 单独处理大文档（含代码围栏与 HTML 表格）的耗时
+- HeaderExtractor + DocumentSplitter 的耗时与内存峰值（tracemalloc），并与把标题/chunk
+  内容全部生成字符串（旧实现的保存方式）时的内存峰值对比
+
+用法:
+    python benchmarks/bench_step5_document.py --size-mb 10
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DEEPSEEK_API_KEY", "benchmark")  # 仅用于导入，不调用 LLM
+
+from Step5_ontology_agent_v2 import DocumentSplitter, HeaderExtractor, MemoryPool  # noqa: E402
+
+
+def build_document(size_mb: float) -> str:
+    """生成指定大小的合成事故报告 Markdown"""
+    paragraph = (
+        "2023年5月14日，施工单位在基坑作业过程中发生坍塌事故，造成人员伤亡。" * 4
+    )
+    # 代码围栏与表格中的 # 行不应被识别为标题
+    fenced = "```\n# 注释行\n```\n<table><tr><td>\n# 单元格\n</td></tr></table>\n"
+    parts = ["某市安全生产委员会\n事故调查报告\n"]
+    size = 0
+    i = 0
+    while size < size_mb * 1024 * 1024:
+        section = f"# 第{i}章 事故情况\n\n{paragraph}\n\n## {i}.1 经过\n\n{paragraph}\n{fenced}"
+        parts.append(section)
+        size += len(section.encode("utf-8"))
+        i += 1
+    return "".join(parts)
+
+
+def time_header_extraction(md_content: str, repeat: int = 3) -> tuple[float, int]:
+    """HeaderExtractor 单独运行的最短耗时与标题数"""
+    best = None
+    for _ in range(repeat):
+        memory_pool = MemoryPool()
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            headers = HeaderExtractor.extract(md_content, memory_pool)
+            elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(headers)
+
+
+def run_pipeline(md_content: str, materialize: bool) -> tuple[float, int, int]:
+    """
+    运行标题提取与拆分
+
+    Returns:
+        (耗时秒数, 内存峰值字节数, 标题数)
+    """
+    memory_pool = MemoryPool()
+    tracemalloc.start()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        headers = HeaderExtractor.extract(md_content, memory_pool)
+        memory_pool.set(
+            "split_plan",
+            {
+                f"chunk_{i}": {
+                    "ontology_category": "事故基本情况",
+                    "header_indices": [i, i + 1],
+                }
+                for i in range(0, len(headers), 2)
+            },
+        )
+        chunks = DocumentSplitter.split(memory_pool)
+        if materialize:
+            # 模拟旧实现：每个标题与 chunk 都持有独立的字符串副本
+            kept = [str(h["content"]) for h in headers] + [
+                str(c["content"]) for c in chunks
+            ]
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if materialize:
+        del kept
+    return elapsed, peak, len(headers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Step5 文档模型基准测试")
+    parser.add_argument("--size-mb", type=float, default=10, help="合成文档大小（MB）")
+    args = parser.parse_args()
+
+    md_content = build_document(args.size_mb)
+    print(
+        f"文档: {len(md_content):,} 字符 ({len(md_content.encode('utf-8')) / 1024 / 1024:.1f} MB)"
+    )
+
+    elapsed, header_count = time_header_extraction(md_content)
+    print(f"  HeaderExtractor: {header_count:,} 个标题, 耗时 {elapsed:.3f}s")
+
+    for label, materialize in (("视图（当前实现）", False), ("全部生成字符串", True)):
+        elapsed, peak, header_count = run_pipeline(md_content, materialize)
+        print(
+            f"  {label}: {header_count:,} 个标题, 耗时 {elapsed:.3f}s, "
+            f"内存峰值 {peak / 1024 / 1024:.1f} MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
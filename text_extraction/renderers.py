@@ -0,0 +1,32 @@
+"""
+自定义渲染器
+"""
+
+from importlib.util import find_spec
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.settings import api_settings
+
+
+class MessagePackRenderer(BaseRenderer):
+    """MessagePack 渲染器（Accept: application/msgpack 或 ?format=msgpack）"""
+
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        import msgpack
+
+        if data is None:
+            return b""
+        return msgpack.packb(data, use_bin_type=True)
+
+
+def content_renderers() -> list:
+    """文件内容接口可协商的渲染器：默认渲染器，安装 msgpack 时追加 MessagePack"""
+    renderers = list(api_settings.DEFAULT_RENDERER_CLASSES)
+    if find_spec("msgpack") is not None:
+        renderers.append(MessagePackRenderer)
+    return renderers
@@ -2,15 +2,25 @@
 Service层 - 业务逻辑封装
 """
 
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
 from .file_storage import FileStorageService
-from .mineru_service import MinerUConversionResult, MinerUError, MinerUService
-from .ontology_service import OntologyError, OntologyService
+from .mineru_service import (
+    MinerUConversionResult,
+    MinerUError,
+    MinerUService,
+    MinerUUnavailableError,
+)
+from .ontology_service import OntologyError, OntologyService, OntologyUnavailableError
 
 __all__ = [
     "FileStorageService",
     "MinerUService",
     "MinerUConversionResult",
     "MinerUError",
+    "MinerUUnavailableError",
     "OntologyService",
     "OntologyError",
+    "OntologyUnavailableError",
+    "CircuitBreaker",
+    "CircuitOpenError",
 ]
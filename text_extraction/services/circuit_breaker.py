@@ -0,0 +1,9 @@
+"""
+熔断器 - 保护外部依赖服务（MinerU 等）
+
+实现与 Step5 的 LLM 路由共用，见 Step5_ontology_agent_v2.CircuitBreaker
+"""
+
+from Step5_ontology_agent_v2 import CircuitBreaker, CircuitOpenError
+
+__all__ = ["CircuitBreaker", "CircuitOpenError"]
@@ -4,6 +4,8 @@ MinerU服务 - PDF转Markdown
 
 import logging
 import os
+import threading
+import time
 import uuid
 from pathlib import Path
 
@@ -11,6 +13,8 @@ import requests
 from django.conf import settings
 from pydantic import BaseModel, Field
 
+from .circuit_breaker import CircuitBreaker
+
 logger = logging.getLogger(__name__)
 
 
@@ -20,6 +24,32 @@ class MinerUError(Exception):
     pass
 
 
+class MinerUUnavailableError(MinerUError):
+    """MinerU服务熔断中，文档应稍后重试"""
+
+    pass
+
+
+_breaker = None
+_breaker_lock = threading.Lock()
+
+
+def get_mineru_breaker() -> CircuitBreaker:
+    """获取进程内共享的 MinerU 熔断器"""
+    global _breaker
+    with _breaker_lock:
+        if _breaker is None:
+            _breaker = CircuitBreaker(
+                "MinerU",
+                failure_rate=settings.MINERU_BREAKER_FAILURE_RATE,
+                slow_call_seconds=settings.MINERU_BREAKER_SLOW_CALL_SECONDS,
+                open_seconds=settings.MINERU_BREAKER_OPEN_SECONDS,
+                window=10,
+                min_calls=3,
+            )
+        return _breaker
+
+
 class MinerUConversionResult(BaseModel):
     """MinerU PDF转Markdown转换结果"""
 
@@ -38,6 +68,7 @@ class MinerUService:
     def __init__(self):
         self.api_url = settings.MINERU_API_URL
         self.timeout = settings.MINERU_TIMEOUT
+        self.breaker = get_mineru_breaker()
 
     def convert_pdf_to_markdown(
         self, pdf_path: str, output_path: str, mode: str = "ocr"
@@ -54,8 +85,11 @@ class MinerUService:
             MinerUConversionResult: 转换结果数据模型
 
         Raises:
+            MinerUUnavailableError: MinerU服务熔断中时抛出（未发起请求）
             MinerUError: 转换失败时抛出
         """
+        if not self.breaker.allow():
+            raise MinerUUnavailableError("MinerU服务熔断中，请稍后重试")
 
         try:
             logger.info(f"开始转换PDF: {pdf_path} -> {output_path}, 模式: {mode}")
@@ -87,6 +121,7 @@ class MinerUService:
                 }
 
                 # 发起 POST 请求
+                started = time.monotonic()
                 response = requests.post(
                     f"{self.api_url}/file_parse",
                     files=files,
@@ -94,6 +129,7 @@ class MinerUService:
                     timeout=self.timeout,
                 )
                 response.raise_for_status()
+                self.breaker.record_success(time.monotonic() - started)
 
             # 解析响应
             api_response = response.json()
@@ -139,11 +175,16 @@ class MinerUService:
             raise MinerUError(error_msg) from e
 
         except requests.exceptions.Timeout as e:
+            self.breaker.record_failure()
             error_msg = f"MinerU服务超时（{self.timeout}秒）: {str(e)}"
             logger.error(error_msg)
             raise MinerUError(error_msg) from e
 
         except requests.exceptions.HTTPError as e:
+            if e.response.status_code >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success(time.monotonic() - started)
             error_msg = (
                 f"MinerU服务返回错误: HTTP {e.response.status_code} - {e.response.text}"
             )
@@ -151,6 +192,7 @@ class MinerUService:
             raise MinerUError(error_msg) from e
 
         except requests.exceptions.RequestException as e:
+            self.breaker.record_failure()
             error_msg = f"MinerU服务请求失败: {str(e)}"
             logger.error(error_msg)
             raise MinerUError(error_msg) from e
@@ -159,3 +201,7 @@ class MinerUService:
             error_msg = f"MinerU转换失败: {str(e)}"
             logger.error(error_msg, exc_info=True)
             raise MinerUError(error_msg) from e
+
+        finally:
+            # 未记录结果的失败（文件不存在、响应解析错误等）不计入熔断，但要归还半开探测
+            self.breaker.release()
@@ -10,7 +10,7 @@ from pathlib import Path
 
 from django.conf import settings
 
-from Step5_ontology_agent_v2 import OntologyAgent
+from Step5_ontology_agent_v2 import DryRunEstimator, OntologyAgent, OntologySerializer
 
 logger = logging.getLogger(__name__)
 
@@ -26,9 +26,24 @@ class OntologyError(Exception):
     pass
 
 
+class OntologyUnavailableError(OntologyError):
+    """LLM服务熔断中，文档应稍后重试"""
+
+    pass
+
+
 class OntologyService:
     """本体论信息提取服务"""
 
+    # 没有可参照的已转换文档时，按 PDF 大小估算的粗略基线（每 MB，单篇顺序执行）
+    BASELINE_PER_MB = {
+        "calls": 40,
+        "prompt_tokens": 80000,
+        "completion_tokens": 8000,
+        "wall_time_s": 240.0,
+    }
+    BASELINE_DEFAULT_BYTES = 1024 * 1024  # 大小未知（旧记录 size=0）时按 1MB 计
+
     def __init__(self):
         self.deepseek_api_key = settings.DEEPSEEK_API_KEY
         self.deepseek_base_url = settings.DEEPSEEK_BASE_URL
@@ -52,6 +67,7 @@ class OntologyService:
             提取结果字典
 
         Raises:
+            OntologyUnavailableError: LLM服务熔断导致提取中止时抛出
             OntologyError: 提取失败时抛出
         """
         try:
@@ -78,6 +94,8 @@ class OntologyService:
             # 验证结果
             if not result.get("success"):
                 error = result.get("error", "Unknown error")
+                if result.get("retry_later"):
+                    raise OntologyUnavailableError(f"本体论提取中止: {error}")
                 raise OntologyError(f"本体论提取失败: {error}")
 
             output_path = result.get("output")
@@ -102,6 +120,108 @@ class OntologyService:
             logger.error(error_msg)
             raise OntologyError(error_msg) from e
 
+    def estimate_extraction(
+        self,
+        markdown_paths: list[str],
+        ontology_path: str,
+        pending_count: int = 0,
+        concurrency: int = 1,
+        markdown_sizes: list[int] | None = None,
+        pending_sizes: list[int] | None = None,
+        max_documents: int | None = None,
+    ) -> dict:
+        """
+        试运行估算一批文档的LLM调用次数、tokens与耗时（不调用LLM）
+
+        只对前 max_documents 篇已有Markdown的文档逐篇试运行，其余文档与尚未转换的
+        文档一起外推：有PDF大小时按大小比例，否则按篇数；没有任何可参照的文档时
+        按 BASELINE_PER_MB 估算。
+
+        Args:
+            markdown_paths: 已有Markdown的文档路径
+            ontology_path: 本体论定义文件完整路径
+            pending_count: 尚无Markdown的文档数（未提供 pending_sizes 时使用）
+            concurrency: 文档并发数，用于预计耗时
+            markdown_sizes: 与 markdown_paths 对应的PDF大小（字节）
+            pending_sizes: 尚无Markdown的文档的PDF大小（字节）
+            max_documents: 最多逐篇试运行的文档数，默认 settings.ONTOLOGY_ESTIMATE_MAX_DOCUMENTS
+
+        Returns:
+            估算结果字典
+
+        Raises:
+            OntologyError: 本体论文件不存在时抛出
+        """
+        if not os.path.exists(ontology_path):
+            raise OntologyError(f"本体论文件不存在: {ontology_path}")
+
+        if max_documents is None:
+            max_documents = settings.ONTOLOGY_ESTIMATE_MAX_DOCUMENTS
+        if markdown_sizes is None:
+            markdown_sizes = [0] * len(markdown_paths)
+        if pending_sizes is None:
+            pending_sizes = [0] * pending_count
+
+        # 超出上限的文档不逐篇试运行，避免大项目长时间占用请求线程
+        sampled = markdown_paths[:max_documents]
+        agent = OntologyAgent(ontology_path=ontology_path)
+        results = [agent.estimate_document(path) for path in sampled]
+        estimate = DryRunEstimator.aggregate(
+            [r["estimate"] for r in results if r["success"]], concurrency
+        )
+        estimate["failed"] = [r["document"] for r in results if not r["success"]]
+        estimate["pending"] = len(pending_sizes)
+
+        unestimated_sizes = markdown_sizes[len(sampled) :] + pending_sizes
+        estimate["extrapolated"] = len(unestimated_sizes)
+        if unestimated_sizes:
+            estimated_sizes = [
+                size
+                for result, size in zip(
+                    results, markdown_sizes[: len(sampled)], strict=True
+                )
+                if result["success"]
+            ]
+            estimate["projected"] = self._project(
+                estimate, estimated_sizes, unestimated_sizes, concurrency
+            )
+        return estimate
+
+    @classmethod
+    def _project(
+        cls,
+        estimate: dict,
+        estimated_sizes: list[int],
+        unestimated_sizes: list[int],
+        concurrency: int,
+    ) -> dict:
+        """外推包含未逐篇估算文档在内的总消耗"""
+        fields = ("calls", "prompt_tokens", "completion_tokens", "wall_time_s")
+        documents = estimate["documents"]
+        if documents:
+            # 有PDF大小时按大小比例外推，否则按篇数
+            known_bytes = sum(estimated_sizes)
+            if known_bytes and all(unestimated_sizes):
+                scale = (known_bytes + sum(unestimated_sizes)) / known_bytes
+            else:
+                scale = (documents + len(unestimated_sizes)) / documents
+            totals = {field: estimate[field] * scale for field in fields}
+        else:
+            megabytes = (
+                sum(size or cls.BASELINE_DEFAULT_BYTES for size in unestimated_sizes)
+                / 1024
+                / 1024
+            )
+            totals = {field: cls.BASELINE_PER_MB[field] * megabytes for field in fields}
+            totals["wall_time_s"] /= max(concurrency, 1)
+
+        projected = {
+            field: round(totals[field])
+            for field in ("calls", "prompt_tokens", "completion_tokens")
+        }
+        projected["wall_time_s"] = round(totals["wall_time_s"], 1)
+        return projected
+
     def validate_ontology_file(self, ontology_path: str) -> bool:
         """
         验证本体论文件格式是否正确
@@ -127,3 +247,36 @@ class OntologyService:
         except Exception as e:
             logger.warning(f"本体论文件验证失败: {str(e)}")
             return False
+
+    @staticmethod
+    def load_output(output_path: str, prefer_msgpack: bool = False) -> dict:
+        """
+        读取本体论提取结果（.json / .json.gz / .json.zst）
+
+        Args:
+            output_path: 结果文件完整路径
+            prefer_msgpack: 存在 msgpack 副本时优先读取副本
+
+        Returns:
+            本体论数据
+        """
+        if prefer_msgpack:
+            sidecar = OntologySerializer.sidecar_path(output_path)
+            if sidecar.exists():
+                return OntologySerializer.load(sidecar)
+        return OntologySerializer.load(output_path)
+
+    @staticmethod
+    def save_output(output_path: str, data: dict) -> None:
+        """
+        覆盖本体论提取结果，保持原有压缩方式，并同步已有的 msgpack 副本
+
+        Args:
+            output_path: 结果文件完整路径
+            data: 本体论数据
+        """
+        OntologySerializer.write(
+            data,
+            output_path,
+            msgpack_sidecar=OntologySerializer.sidecar_path(output_path).exists(),
+        )
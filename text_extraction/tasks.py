@@ -7,20 +7,31 @@ import os
 from pathlib import Path
 
 from celery import shared_task
+from django.conf import settings
 
 from .models import File
-from .services import FileStorageService, MinerUService, OntologyService
+from .services import (
+    FileStorageService,
+    MinerUService,
+    MinerUUnavailableError,
+    OntologyService,
+    OntologyUnavailableError,
+)
 
 logger = logging.getLogger(__name__)
 
 
 @shared_task(bind=True, max_retries=0)
-def process_pdf_task(self, file_id: int) -> dict:
+def process_pdf_task(
+    self, file_id: int, deferrals: int = 0, skip_mineru: bool = False
+) -> dict:
     """
     处理PDF文件的异步任务
 
     Args:
         file_id: File模型ID
+        deferrals: 因依赖服务熔断已推迟的次数
+        skip_mineru: 已有MinerU输出的Markdown时跳过转换（本体论提取熔断后重试）
 
     Returns:
         处理结果字典
@@ -54,25 +65,36 @@ def process_pdf_task(self, file_id: int) -> dict:
         # 确保输出目录存在
         storage_service.ensure_dir(mineru_full_path)
 
-        # 3. 调用MinerU转换PDF
-        logger.info("调用MinerU服务...")
-        # 传递相对路径
-        mineru_result = mineru_service.convert_pdf_to_markdown(
-            pdf_path=pdf_full_path,
-            output_path=mineru_full_path,
-            mode="ocr",
+        # 3. 调用MinerU转换PDF（本体论提取熔断后的重试复用已转换的Markdown）
+        existing_markdown = (
+            storage_service.get_full_path(file_obj.mineru_output_path)
+            if skip_mineru and file_obj.mineru_output_path
+            else None
         )
-
-        # 更新MinerU输出路径
-        file_obj.mineru_output_path = os.path.join(
-            mineru_relative_path,
-            mineru_result.output_path,
-        )
-        file_obj.save(update_fields=["mineru_output_path", "updated_at"])
-
-        # 5. 获取MinerU生成的Markdown文件路径（这是文件而非目录）
-        # 绝对路径
-        markdown_file_path = os.path.join(mineru_full_path, mineru_result.output_path)
+        if existing_markdown and os.path.exists(existing_markdown):
+            logger.info("复用已转换的Markdown: %s", existing_markdown)
+            markdown_file_path = existing_markdown
+        else:
+            logger.info("调用MinerU服务...")
+            # 传递相对路径
+            mineru_result = mineru_service.convert_pdf_to_markdown(
+                pdf_path=pdf_full_path,
+                output_path=mineru_full_path,
+                mode="ocr",
+            )
+
+            # 更新MinerU输出路径
+            file_obj.mineru_output_path = os.path.join(
+                mineru_relative_path,
+                mineru_result.output_path,
+            )
+            file_obj.save(update_fields=["mineru_output_path", "updated_at"])
+
+            # 5. 获取MinerU生成的Markdown文件路径（这是文件而非目录）
+            # 绝对路径
+            markdown_file_path = os.path.join(
+                mineru_full_path, mineru_result.output_path
+            )
         if not os.path.exists(markdown_file_path):
             raise Exception(f"MinerU输出的Markdown文件不存在: {markdown_file_path}")
 
@@ -124,6 +146,22 @@ def process_pdf_task(self, file_id: int) -> dict:
         logger.error(error_msg)
         return {"status": "error", "message": error_msg}
 
+    except (MinerUUnavailableError, OntologyUnavailableError) as e:
+        if deferrals < settings.SERVICE_MAX_DEFERRALS:
+            # 本体论提取熔断时MinerU转换已完成，重试不再重新OCR
+            return _defer_pdf_task(
+                file_obj,
+                deferrals,
+                str(e),
+                skip_mineru=isinstance(e, OntologyUnavailableError),
+            )
+        error_msg = f"文件处理失败（依赖服务持续熔断）: {str(e)}"
+        logger.error(error_msg)
+        file_obj.status = File.Status.FAILED
+        file_obj.error_message = error_msg
+        file_obj.save(update_fields=["status", "error_message", "updated_at"])
+        return {"status": "error", "message": error_msg}
+
     except Exception as e:
         error_msg = f"文件处理失败: {str(e)}"
         logger.error(error_msg, exc_info=True)
@@ -138,3 +176,36 @@ def process_pdf_task(self, file_id: int) -> dict:
             logger.error(f"无法更新文件状态: {str(save_error)}")
 
         return {"status": "error", "message": error_msg}
+
+
+def _defer_pdf_task(
+    file_obj: File, deferrals: int, reason: str, skip_mineru: bool = False
+) -> dict:
+    """
+    依赖服务熔断时推迟处理：文件重置为待处理并延迟重新入队，不写入默认值结果
+
+    Args:
+        file_obj: File对象
+        deferrals: 已推迟的次数
+        reason: 熔断原因
+        skip_mineru: 重试时复用已转换的Markdown，不再调用MinerU
+
+    Returns:
+        处理结果字典
+    """
+    message = f"依赖服务熔断，{settings.SERVICE_RETRY_DELAY}秒后重试: {reason}"
+    logger.warning(f"文件 ID={file_obj.id} {message}")
+    file_obj.status = File.Status.PENDING
+    file_obj.error_message = message
+    file_obj.save(update_fields=["status", "error_message", "updated_at"])
+    try:
+        task = process_pdf_task.apply_async(
+            args=[file_obj.id],
+            kwargs={"deferrals": deferrals + 1, "skip_mineru": skip_mineru},
+            countdown=settings.SERVICE_RETRY_DELAY,
+        )
+        file_obj.task_id = task.id
+        file_obj.save(update_fields=["task_id", "updated_at"])
+    except Exception as e:
+        logger.error(f"重新入队失败，文件保持待处理状态: {str(e)}")
+    return {"status": "deferred", "file_id": file_obj.id, "message": message}
@@ -6,13 +6,21 @@ import json
 import logging
 import os
 import tempfile
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
 
+import requests
 from django.conf import settings
 from django.test import TestCase
 
+from Step5_ontology_agent_v2 import LLMGateway, MemoryPool
 from text_extraction.services import (
+    CircuitBreaker,
+    CircuitOpenError,
     FileStorageService,
+    MinerUError,
     MinerUService,
+    MinerUUnavailableError,
     OntologyService,
 )
 from text_extraction.services.mineru_service import MinerUConversionResult
@@ -87,6 +95,70 @@ class MinerUServiceTestCase(TestCase):
         logger.info("测试输出结果%s", result)
 
 
+class MinerUCircuitBreakerTestCase(TestCase):
+    """MinerUService熔断测试用例"""
+
+    def setUp(self):
+        self.service = MinerUService()
+        self.service.breaker = CircuitBreaker("MinerU", min_calls=2, open_seconds=60)
+
+    @patch("text_extraction.services.mineru_service.requests.post")
+    def test_open_breaker_fails_fast(self, mock_post):
+        """测试连续失败后熔断，不再发起请求"""
+        mock_post.side_effect = requests.exceptions.ConnectionError("down")
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as pdf:
+            for _ in range(2):
+                with self.assertRaises(MinerUError):
+                    self.service.convert_pdf_to_markdown(pdf.name, "out")
+            with self.assertRaises(MinerUUnavailableError):
+                self.service.convert_pdf_to_markdown(pdf.name, "out")
+
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertEqual(self.service.breaker.state, CircuitBreaker.OPEN)
+
+    @patch("text_extraction.services.mineru_service.requests.post")
+    def test_half_open_probe_released_on_missing_pdf(self, mock_post):
+        """测试半开探测遇到本地文件不存在时归还探测名额"""
+        self.service.breaker = CircuitBreaker("MinerU", min_calls=2, open_seconds=0)
+        self.service.breaker.record_failure()
+        self.service.breaker.record_failure()
+
+        with self.assertRaises(MinerUError):
+            self.service.convert_pdf_to_markdown("/nonexistent/missing.pdf", "out")
+
+        mock_post.assert_not_called()
+        self.assertEqual(self.service.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(self.service.breaker.allow())
+
+
+class CircuitBreakerTestCase(TestCase):
+    """CircuitBreaker测试用例"""
+
+    def test_half_open_probe_success_closes(self):
+        """测试半开探测成功后恢复"""
+        breaker = CircuitBreaker("test", min_calls=2, open_seconds=0)
+        breaker.record_failure()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        # 熔断期已过：只放行一个探测请求
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success(0.1)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_slow_calls_trip_breaker(self):
+        """测试慢调用按失败计入"""
+        breaker = CircuitBreaker(
+            "test", slow_call_seconds=1, min_calls=2, open_seconds=60
+        )
+        breaker.record_success(5)
+        breaker.record_success(5)
+
+        with self.assertRaises(CircuitOpenError):
+            breaker.check()
+
+
 class OntologyServiceTestCase(TestCase):
     """OntologyService测试用例"""
 
@@ -128,3 +200,144 @@ class OntologyServiceTestCase(TestCase):
             self.assertFalse(result)
         finally:
             os.unlink(temp_path)
+
+    def test_output_roundtrip_gzip(self):
+        """测试压缩输出的写入与读取"""
+        data = {"_metadata": {"源文档": "a.md"}, "事故概况": {"事故等级": "一般"}}
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output_path = os.path.join(tmpdir, "a_ontology.json.gz")
+            OntologyService.save_output(output_path, data)
+
+            with open(output_path, "rb") as f:
+                self.assertEqual(f.read(2), b"\x1f\x8b")
+            self.assertEqual(OntologyService.load_output(output_path), data)
+
+    def test_estimate_extraction_dry_run(self):
+        """测试试运行估算不调用LLM并外推未转换文档"""
+        ontology_path = os.path.join(settings.BASE_DIR, "ontology_v2.json")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            markdown_path = os.path.join(tmpdir, "report.md")
+            with open(markdown_path, "w", encoding="utf-8") as f:
+                f.write(
+                    "# 一、事故概况\n\n2023年发生一起坍塌事故。\n\n# 二、事故原因\n\n违规施工。\n"
+                )
+
+            with (
+                patch(
+                    "Step5_ontology_agent_v2.LLMGateway._stream_completion"
+                ) as stream,
+                patch("Step5_ontology_agent_v2.request_hedger.call") as call,
+            ):
+                estimate = self.service.estimate_extraction(
+                    [markdown_path], ontology_path, pending_count=1, concurrency=2
+                )
+
+        stream.assert_not_called()
+        call.assert_not_called()
+        self.assertEqual(estimate["documents"], 1)
+        self.assertGreater(estimate["calls"], 0)
+        self.assertGreater(estimate["prompt_tokens"], 0)
+        self.assertEqual(estimate["projected"]["calls"], estimate["calls"] * 2)
+
+    def test_estimate_extraction_caps_dry_run_documents(self):
+        """测试超出上限的文档不逐篇试运行，按PDF大小外推"""
+        ontology_path = os.path.join(settings.BASE_DIR, "ontology_v2.json")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            markdown_paths = []
+            for name in ("a", "b"):
+                markdown_path = os.path.join(tmpdir, f"{name}.md")
+                with open(markdown_path, "w", encoding="utf-8") as f:
+                    f.write("# 一、事故概况\n\n2023年发生一起坍塌事故。\n")
+                markdown_paths.append(markdown_path)
+
+            estimate = self.service.estimate_extraction(
+                markdown_paths,
+                ontology_path,
+                markdown_sizes=[1000, 3000],
+                max_documents=1,
+            )
+
+        self.assertEqual(estimate["documents"], 1)
+        self.assertEqual(estimate["extrapolated"], 1)
+        self.assertEqual(estimate["projected"]["calls"], estimate["calls"] * 4)
+
+    def test_estimate_extraction_baseline_without_markdown(self):
+        """测试没有已转换文档时按每MB基线估算"""
+        ontology_path = os.path.join(settings.BASE_DIR, "ontology_v2.json")
+        estimate = self.service.estimate_extraction(
+            [], ontology_path, pending_sizes=[2 * 1024 * 1024], concurrency=2
+        )
+
+        baseline = OntologyService.BASELINE_PER_MB
+        self.assertEqual(estimate["documents"], 0)
+        self.assertEqual(estimate["pending"], 1)
+        self.assertEqual(estimate["projected"]["calls"], baseline["calls"] * 2)
+        self.assertEqual(estimate["projected"]["wall_time_s"], baseline["wall_time_s"])
+
+
+class LLMStreamingTestCase(TestCase):
+    """Step5 流式请求测试用例"""
+
+    @staticmethod
+    def _chunk(content=None, finish_reason=None, usage=None):
+        choices = (
+            []
+            if content is None and finish_reason is None
+            else [
+                SimpleNamespace(
+                    delta=SimpleNamespace(content=content),
+                    finish_reason=finish_reason,
+                )
+            ]
+        )
+        return SimpleNamespace(choices=choices, usage=usage)
+
+    def test_stream_closed_once_json_closes(self):
+        """测试顶层 JSON 闭合后立即关闭流，usage 按已接收文本估算"""
+        chunks = iter(
+            [
+                self._chunk('[{"a": 1}, '),
+                self._chunk('{"b": 2}]'),
+                self._chunk("\n以上为抽取结果。"),
+                self._chunk(finish_reason="stop"),
+            ]
+        )
+        stream = MagicMock()
+        stream.__iter__.return_value = chunks
+        client = MagicMock()
+        client.chat.completions.create.return_value = stream
+        memory_pool = MemoryPool()
+        items = []
+
+        text, finish_reason, usage = LLMGateway._stream_completion(
+            client,
+            {"model": "m", "messages": [{"role": "user", "content": "提取"}]},
+            "字段",
+            memory_pool,
+            items.append,
+        )
+
+        stream.close.assert_called_once()
+        self.assertEqual(len(list(chunks)), 2)  # 尾随文字未被读取
+        self.assertEqual(finish_reason, "stop")
+        self.assertEqual(items, [{"a": 1}, {"b": 2}])
+        self.assertEqual(json.loads(text), [{"a": 1}, {"b": 2}])
+        self.assertTrue(usage.estimated)
+        self.assertGreater(usage.completion_tokens, 0)
+        self.assertTrue(memory_pool.get("stream_timing")["字段"]["cut_off"])
+
+    def test_usage_in_final_chunk_kept_when_stream_ends(self):
+        """测试回复在 JSON 闭合处结束时读取最后一个 chunk 附带的 usage"""
+        usage = SimpleNamespace(prompt_tokens=100, completion_tokens=20)
+        chunks = [
+            self._chunk('{"a": 1}', finish_reason="stop"),
+            self._chunk(usage=usage),
+        ]
+        client = MagicMock()
+        client.chat.completions.create.return_value = iter(chunks)
+
+        _, _, result_usage = LLMGateway._stream_completion(
+            client, {"model": "m", "messages": []}, "字段", MemoryPool(), [].append
+        )
+
+        self.assertIs(result_usage, usage)
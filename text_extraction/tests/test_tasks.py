@@ -2,12 +2,15 @@
 Celery任务测试
 """
 
+import os
+import tempfile
 from unittest.mock import MagicMock, patch
 
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 from text_extraction.models import File, Project
+from text_extraction.services import MinerUUnavailableError, OntologyUnavailableError
 from text_extraction.tasks import process_pdf_task
 
 
@@ -100,3 +103,72 @@ class ProcessPdfTaskTestCase(TestCase):
         self.file_obj.refresh_from_db()
         self.assertEqual(self.file_obj.status, File.Status.FAILED)
         self.assertIsNotNone(self.file_obj.error_message)
+
+    @patch("text_extraction.tasks.process_pdf_task.apply_async")
+    @patch("text_extraction.tasks.MinerUService")
+    def test_process_pdf_task_deferred_when_breaker_open(
+        self, mock_mineru, mock_apply_async
+    ):
+        """测试依赖熔断时文件标记为待处理并延迟重新入队"""
+        mock_mineru_instance = MagicMock()
+        mock_mineru_instance.convert_pdf_to_markdown.side_effect = (
+            MinerUUnavailableError("MinerU服务熔断中")
+        )
+        mock_mineru.return_value = mock_mineru_instance
+        mock_apply_async.return_value = MagicMock(id="retry-task")
+
+        result = process_pdf_task(self.file_obj.id)
+
+        self.assertEqual(result["status"], "deferred")
+        self.assertEqual(
+            mock_apply_async.call_args.kwargs["kwargs"],
+            {"deferrals": 1, "skip_mineru": False},
+        )
+
+        self.file_obj.refresh_from_db()
+        self.assertEqual(self.file_obj.status, File.Status.PENDING)
+        self.assertEqual(self.file_obj.task_id, "retry-task")
+
+    @patch("text_extraction.tasks.process_pdf_task.apply_async")
+    @patch("text_extraction.tasks.OntologyService")
+    @patch("text_extraction.tasks.MinerUService")
+    def test_ontology_breaker_deferral_skips_mineru_on_retry(
+        self, mock_mineru, mock_ontology, mock_apply_async
+    ):
+        """测试本体论提取熔断推迟后重试复用已转换的Markdown，不再调用MinerU"""
+
+        def convert(pdf_path, output_path, mode):
+            with open(os.path.join(output_path, "test.md"), "w", encoding="utf-8") as f:
+                f.write("# 事故概况\n")
+            return MagicMock(output_path="test.md")
+
+        mineru = mock_mineru.return_value
+        mineru.convert_pdf_to_markdown.side_effect = convert
+        extract = mock_ontology.return_value.extract_information
+        extract.side_effect = OntologyUnavailableError("LLM 路由熔断中")
+        mock_apply_async.return_value = MagicMock(id="retry-task")
+
+        with (
+            tempfile.TemporaryDirectory() as media_root,
+            override_settings(MEDIA_ROOT=media_root),
+        ):
+            os.makedirs(
+                os.path.join(media_root, "mineru", str(self.project.id), "test")
+            )
+            result = process_pdf_task(self.file_obj.id)
+
+            self.assertEqual(result["status"], "deferred")
+            retry_kwargs = mock_apply_async.call_args.kwargs["kwargs"]
+            self.assertEqual(retry_kwargs, {"deferrals": 1, "skip_mineru": True})
+
+            extract.side_effect = None
+            extract.return_value = {
+                "status": "success",
+                "output_path": "test_ontology.json",
+                "document": "test.md",
+            }
+            result = process_pdf_task(self.file_obj.id, **retry_kwargs)
+
+        self.assertEqual(result["status"], "success")
+        mineru.convert_pdf_to_markdown.assert_called_once()
+        self.assertEqual(extract.call_count, 2)
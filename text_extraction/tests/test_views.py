@@ -2,14 +2,18 @@
 API视图测试
 """
 
+import os
+import tempfile
 from unittest.mock import patch
 
 from django.contrib.auth.models import User
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
 from rest_framework import status
 from rest_framework.test import APITestCase
 
 from text_extraction.models import File, Project
+from text_extraction.services import OntologyService
 
 
 class ProjectViewSetTestCase(APITestCase):
@@ -69,6 +73,24 @@ class ProjectViewSetTestCase(APITestCase):
         self.assertEqual(len(response.data["results"]), 1)
         self.assertEqual(response.data["results"][0]["name"], "正常项目")
 
+    @patch("text_extraction.views.OntologyService.estimate_extraction")
+    def test_estimate_project(self, mock_estimate):
+        """测试项目消耗估算：未转换文件计入待外推数量"""
+        project = Project.objects.create(name="项目1", created_by=self.user)
+        File.objects.create(project=project, filename="a.pdf", pdf_path="pdf/1/a.pdf")
+        mock_estimate.return_value = {"calls": 0}
+
+        response = self.client.get(
+            f"/api/v1/projects/{project.id}/estimate/?concurrency=4"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        args, kwargs = mock_estimate.call_args
+        self.assertEqual(args[0], [])
+        self.assertEqual(kwargs["pending_count"], 1)
+        self.assertEqual(kwargs["pending_sizes"], [0])
+        self.assertEqual(kwargs["concurrency"], 4)
+
 
 class FileUploadViewTestCase(APITestCase):
     """FileUploadView测试用例"""
@@ -185,6 +207,26 @@ class FileViewSetTestCase(APITestCase):
         self.assertIn("markdown", response.data)
         self.assertIn("ontology", response.data)
 
+    def test_get_file_content_compressed_output(self):
+        """测试读取 gzip 压缩的本体论输出"""
+        data = {"事故概况": {"事故等级": "一般"}}
+        with (
+            tempfile.TemporaryDirectory() as tmpdir,
+            override_settings(MEDIA_ROOT=tmpdir),
+        ):
+            os.makedirs(os.path.join(tmpdir, "extraction", "1"))
+            OntologyService.save_output(
+                os.path.join(tmpdir, "extraction", "1", "test_ontology.json.gz"), data
+            )
+            self.file_obj.status = File.Status.COMPLETED
+            self.file_obj.extraction_output_path = "extraction/1/test_ontology.json.gz"
+            self.file_obj.save()
+
+            response = self.client.get(f"/api/v1/files/{self.file_obj.id}/content/")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["json_content"], data)
+
 
 # 导入MagicMock供其他测试使用
 from unittest.mock import MagicMock
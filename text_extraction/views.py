@@ -30,6 +30,8 @@ from .serializers import (
     ProjectUpdateSerializer,
 )
 from .authentication import HeaderAuthentication
+from .renderers import content_renderers
+from .services import FileStorageService, OntologyError, OntologyService
 
 # X-User-ID Header 参数定义
 X_USER_ID_PARAM = OpenApiParameter(
@@ -86,6 +88,63 @@ class ProjectViewSet(viewsets.ModelViewSet):
         instance.is_deleted = True
         instance.save()
 
+    @extend_schema(
+        summary="估算项目的LLM调用消耗",
+        description=(
+            "不调用LLM，对项目内已有Markdown的文件渲染全部prompt，估算调用次数、"
+            "tokens与按并发数的预计耗时；尚无Markdown的文件按平均值外推。"
+        ),
+        tags=["项目管理"],
+        parameters=[
+            X_USER_ID_PARAM,
+            OpenApiParameter(
+                name="concurrency",
+                type=OpenApiTypes.INT,
+                location=OpenApiParameter.QUERY,
+                required=False,
+                description="文档并发数，默认1",
+            ),
+        ],
+    )
+    @action(detail=True, methods=["get"])
+    def estimate(self, request, pk=None):
+        """估算项目所有文件的本体论提取消耗"""
+        project = self.get_object()
+        try:
+            concurrency = max(1, int(request.query_params.get("concurrency", 1)))
+        except ValueError:
+            return Response(
+                {"error": "concurrency 必须是整数"}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        markdown_paths = []
+        markdown_sizes = []
+        pending_sizes = []
+        for file_obj in project.files.all():
+            markdown_path = (
+                FileStorageService.get_full_path(file_obj.mineru_output_path)
+                if file_obj.mineru_output_path
+                else None
+            )
+            if markdown_path and os.path.exists(markdown_path):
+                markdown_paths.append(markdown_path)
+                markdown_sizes.append(file_obj.size)
+            else:
+                pending_sizes.append(file_obj.size)
+
+        try:
+            estimate = OntologyService().estimate_extraction(
+                markdown_paths,
+                FileStorageService.get_full_path(project.ontology_path),
+                pending_count=len(pending_sizes),
+                concurrency=concurrency,
+                markdown_sizes=markdown_sizes,
+                pending_sizes=pending_sizes,
+            )
+        except OntologyError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(estimate)
+
 
 @extend_schema(
     request=FileUploadSerializer,
@@ -192,6 +251,10 @@ class FileViewSet(viewsets.ReadOnlyModelViewSet):
 
     @extend_schema(
         summary="获取文件内容",
+        description=(
+            "默认返回 JSON；安装 msgpack 时可通过 Accept: application/msgpack "
+            "或 ?format=msgpack 获取 MessagePack 编码的响应。"
+        ),
         tags=["文件管理"],
         parameters=[X_USER_ID_PARAM],
         responses={
@@ -204,7 +267,7 @@ class FileViewSet(viewsets.ReadOnlyModelViewSet):
             }
         },
     )
-    @action(detail=True, methods=["get"])
+    @action(detail=True, methods=["get"], renderer_classes=content_renderers())
     def content(self, request, pk=None):
         """获取文件的Markdown和本体论JSON内容"""
         file_obj = self.get_object()
@@ -233,8 +296,11 @@ class FileViewSet(viewsets.ReadOnlyModelViewSet):
                 settings.MEDIA_ROOT, file_obj.extraction_output_path
             )
             if os.path.exists(ontology_path):
-                with open(ontology_path, encoding="utf-8") as f:
-                    result["json_content"] = json.load(f)
+                # 以 MessagePack 返回时优先读取 msgpack 副本，省去 JSON 解析
+                result["json_content"] = OntologyService.load_output(
+                    ontology_path,
+                    prefer_msgpack=request.accepted_renderer.format == "msgpack",
+                )
 
         return Response(result)
 
@@ -266,6 +332,5 @@ class FileDeleteView(views.APIView):
         json_data = json.loads(request.body)
         json_out_path = Path(file_obj.extraction_output_path)
         full_path: Path = settings.MEDIA / json_out_path
-        with open(full_path.as_posix(), "w") as f:
-            f.write(json.dumps(json_data))
-        return Response(status=200)
\ No newline at end of file
+        OntologyService.save_output(full_path.as_posix(), json_data)
+        return Response(status=200)